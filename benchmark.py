@@ -0,0 +1,747 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+
+from utils.audio import SAMPLE_RATE, open_pcm, prepare_audio, to_float, write_pcm
+from utils.backends import BACKENDS, PROMPT, SEGMENT_KEYS, Backend
+from utils.chunking import HOP_LENGTH
+from utils.download import Downloader
+from models.VoDataModels import VoData
+from utils.generate_files import generate_srt, generate_txt, generate_vtt, render_all
+from utils.search_index import SearchIndex
+from utils.segment_store import SegmentStore
+from utils.transcribe import ModelCache, iter_transcribe_file, transcribe_file
+from utils.vad import filter_speech
+from utils.vo_data import iter_vo_data, iter_vo_results
+
+
+REPOSITORY = os.path.dirname(os.path.abspath(__file__))
+
+# The results get their own logger, so that the log messages of the stages can be hidden without hiding the results
+logger = logging.getLogger("VO-Transcriber.benchmark")
+
+STAGES = (
+    "feed_parse",
+    "feed_fetch",
+    "download",
+    "prepare",
+    "audio_load",
+    "vad",
+    "transcribe",
+    "transcribe_stream",
+    "render_txt",
+    "render_srt",
+    "render_vtt",
+    "render_all",
+    "pdf",
+    "index_build",
+    "search",
+    "cli_import",
+    "cli_startup",
+)
+# Packages main.py must not import when it starts, they are imported by the stages that need them
+HEAVY_MODULES = ("torch", "whisper", "numpy", "jinja2", "pdfkit", "youtube_dl", "faster_whisper")
+SEARCH_QUERIES = ("matrix", "beweis definition", '"lineare abbildung"', "funk*", "begriff17 begriff3", '"die menge" woche')
+WORDS = (
+    "die", "der", "und", "wir", "haben", "hier", "eine", "Funktion", "Menge", "also", "genau", "dann", "sehen", "Beweis",
+    "Matrix", "Vektor", "wenn", "nicht", "aber", "gilt", "folgt", "Definition", "Beispiel", "nächste", "Woche", "Prüfung",
+)
+
+
+def synthesize_speech(seconds: float, seed: int = 0) -> np.ndarray:
+    """
+    Generates audio that looks like a lecture to the audio code: phrases of a few seconds of voiced sound (a harmonic
+    tone with changing pitch, modulated in syllables) separated by pauses with low background noise.
+    :param seconds:     Length of the audio in seconds
+    :param seed:        Seed of the random generator (the same seed gives the same audio)
+    :return:            The samples (16 kHz, int16)
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * SAMPLE_RATE)
+    audio = np.empty(total, dtype=np.int16)
+    position = 0
+    while position < total:
+        length = min(int(rng.uniform(2.0, 8.0) * SAMPLE_RATE), total - position)
+        t = np.arange(length, dtype=np.float32) / SAMPLE_RATE
+        pitch = rng.uniform(90.0, 220.0) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.2, 0.5) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+        syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3.0, 6.0) * t + rng.uniform(0, 2 * np.pi)), 0, None)
+        signal = 0.15 * voiced * syllables + 0.01 * rng.standard_normal(length)
+        audio[position : position + length] = np.clip(signal * 32767, -32768, 32767)
+        position += length
+
+        pause = min(int(rng.uniform(0.2, 2.0) * SAMPLE_RATE), total - position)
+        audio[position : position + pause] = np.clip(rng.standard_normal(pause) * 60, -32768, 32767)
+        position += pause
+    return audio
+
+
+def synthesize_transcripts(vos: int, segments: int, seed: int = 0) -> list[tuple[VoData, SegmentStore]]:
+    """
+    Generates transcripts of lectures for the search index: segments of 5 seconds with about 12 words, drawn from the
+    common words of the stub backend and a long tail of rarer terms (Zipf distributed, like the words of real text).
+    :param vos:         Number of VOs
+    :param segments:    Number of segments per VO
+    :param seed:        Seed of the random generator (the same seed gives the same transcripts)
+    :return:            The VOs and their segments
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([word.lower() for word in WORDS] + ["lineare", "abbildung"] + [f"begriff{n}" for n in range(20000)])
+    transcripts = []
+    for vo in range(vos):
+        vo_data = VoData(vo_id=f"vo-{vo:05d}", vo_title=f"Lecture {vo:05d}", series_title=f"Series {vo % 20:02d}", vo_mp4_link=f"https://example.org/{vo:05d}.mp4")
+        store = SegmentStore()
+        words = vocabulary[np.minimum(rng.zipf(1.3, size=segments * 12) - 1, len(vocabulary) - 1)]
+        for segment in range(segments):
+            store.append(segment * 5000, segment * 5000 + 5000, " ".join(words[segment * 12 : segment * 12 + 12]))
+        transcripts.append((vo_data, store))
+    return transcripts
+
+
+def _vo_entry(index: int, uni: str, media_url: str, rng) -> dict:
+    """
+    Returns a raw VO entry in the format of the Opencast search results of the given university.
+    """
+    title = f"Lecture {index:05d}"
+    series = f"Series {index % 40:02d}"
+    duration = int(rng.uniform(45, 100) * 60 * 1000)
+    created = (datetime(2020, 10, 1, 9, tzinfo=timezone.utc) + timedelta(hours=index)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    description = " ".join(rng.choice(WORDS, size=80))
+    if uni == "tu":
+        return {
+            "id": f"bench-{index:06d}",
+            "dcCreator": "Benchmark Lecturer",
+            "dcCreated": created,
+            "dcDescription": description,
+            "mediapackage": {
+                "title": title,
+                "seriestitle": series,
+                "duration": duration,
+                "creators": {"creator": ["Benchmark Lecturer", "Benchmark Tutor"]},
+                "media": {
+                    "track": [
+                        {"mimetype": "video/mp4", "url": media_url, "video": {"resolution": "1280x720"}},
+                        {"mimetype": "video/mp4", "url": media_url, "video": {"resolution": "1920x1080"}},
+                        {"mimetype": "audio/mpeg", "url": media_url, "audio": {"bitrate": "128000"}},
+                    ]
+                },
+            },
+        }
+    return {
+        "id": f"bench-{index:06d}",
+        "dcCreated": created,
+        "dcDescription": description,
+        "mediapackage": {
+            "title": title,
+            "seriestitle": series,
+            "duration": duration,
+            "creators": {"creator": "Benchmark Lecturer"},
+            "contributors": {"contributor": "Benchmark Tutor"},
+            "media": {
+                "track": [
+                    {"mimetype": "video/mp4", "url": media_url, "tags": {"tag": ["000720000-quality"]}},
+                    {"mimetype": "video/mp4", "url": media_url, "tags": {"tag": ["001080000-quality"]}},
+                ]
+            },
+        },
+    }
+
+
+def write_feed(path: str, entries: int, uni: str, media_url: str, seed: int = 0) -> str:
+    """
+    Writes synthetic search results with the given number of VO entries (entry by entry, so that big feeds don't have
+    to fit into memory).
+    """
+    rng = np.random.default_rng(seed)
+    with open(path, "w", encoding="UTF-8") as f:
+        f.write(f'{{"search-results": {{"total": {entries}, "offset": 0, "limit": {entries}, "result": [')
+        for index in range(entries):
+            f.write(("\n" if index == 0 else ",\n") + json.dumps(_vo_entry(index, uni, media_url, rng), ensure_ascii=False))
+        f.write("\n]}}\n")
+    return path
+
+
+def write_wav(samples: np.ndarray, path: str) -> str:
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.astype("<i2").tobytes())
+    return path
+
+
+class StubBackend(Backend):
+    """
+    Backend that doesn't run a model. It reads the audio in 30 second windows like whisper does, measures the energy of
+    every second and turns it into segments of pseudo text, optionally sleeping to simulate a given real-time factor.
+    It makes the transcription stage measurable without model weights and without the noise of a real model.
+    """
+
+    name = "stub"
+    capabilities = frozenset({PROMPT})
+    real_time_factor = 0.0
+    window_length = 30.0
+    segment_length = 5.0
+
+    def load(self):
+        self.model = WORDS
+
+    def transcribe(self, audio, language=None, verbose=False, initial_prompt=None):
+        window = int(self.window_length * SAMPLE_RATE)
+        index = 0
+        for first in range(0, len(audio), window):
+            start = time.perf_counter()
+            samples = to_float(np.asarray(audio[first : first + window]))
+            seconds = len(samples) // SAMPLE_RATE
+            energy = np.sqrt(np.mean(samples[: seconds * SAMPLE_RATE].reshape(-1, SAMPLE_RATE) ** 2, axis=1)) if seconds else []
+
+            for offset in np.arange(0, len(samples) / SAMPLE_RATE, self.segment_length):
+                end = min(offset + self.segment_length, len(samples) / SAMPLE_RATE)
+                level = energy[int(offset)] if int(offset) < len(energy) else 0.0
+                words = [self.model[(index * 7 + k + int(level * 1000)) % len(self.model)] for k in range(int(end - offset) * 2 + 1)]
+                segment = dict.fromkeys(SEGMENT_KEYS, 0.0)
+                segment.update(
+                    id=index,
+                    seek=first // HOP_LENGTH,
+                    start=first / SAMPLE_RATE + float(offset),
+                    end=first / SAMPLE_RATE + float(end),
+                    text=" " + " ".join(words).capitalize() + ".",
+                    tokens=[],
+                )
+                if verbose:
+                    print(f"[{segment['start']:.3f} --> {segment['end']:.3f}] {segment['text']}")
+                index += 1
+                yield segment
+
+            remaining = self.real_time_factor * len(samples) / SAMPLE_RATE - (time.perf_counter() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Serves the files of the fixture folder, with support for HEAD and range requests (like the media servers do).
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send(body=False)
+
+    def do_GET(self):
+        self._send(body=True)
+
+    def _send(self, body: bool):
+        path = os.path.join(self.server.directory, os.path.basename(urlparse(self.path).path))
+        if not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        size = os.path.getsize(path)
+        first, last = 0, size - 1
+        status = HTTPStatus.OK
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            first = int(match.group(1))
+            last = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            if first >= size:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = HTTPStatus.PARTIAL_CONTENT
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json" if path.endswith(".json") else "application/octet-stream")
+        self.send_header("Content-Length", str(last - first + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        self.end_headers()
+        if not body:
+            return
+
+        with open(path, "rb") as f:
+            f.seek(first)
+            remaining = last - first + 1
+            while remaining > 0 and (block := f.read(min(2**20, remaining))):
+                self.wfile.write(block)
+                remaining -= len(block)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Local HTTP server for the fixtures, runs in a background thread until it is closed.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, directory: str):
+        super().__init__(("127.0.0.1", 0), _FixtureHandler)
+        self.directory = directory
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self._thread = threading.Thread(target=self.serve_forever, name="fixture-server", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _rss(field: str) -> int | None:
+    """
+    Reads the given field (VmRSS or VmHWM) of /proc/self/status in bytes.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Resets the peak RSS of the process (Linux only), so that the peak of a single stage can be measured.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> int | None:
+    peak = _rss("VmHWM")
+    if peak is None:
+        try:
+            import resource
+
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak *= 1 if sys.platform == "darwin" else 1024
+        except ImportError:
+            return None
+    return peak
+
+
+def measure(stage: str, function, repeat: int, amount: float, unit: str, setup=None) -> dict:
+    """
+    Runs the given function repeat times and measures its latency, throughput and peak memory.
+    :param stage:       Name of the stage
+    :param function:    The function to measure (called without arguments)
+    :param repeat:      How often the function is run
+    :param amount:      How much work one run of the function does (in unit)
+    :param unit:        Unit of the work (e.g. "MB" or "audio seconds"), the throughput is given in unit per second
+    :param setup:       Function that is called before every run (not measured)
+    :return:            The result of the stage
+    """
+    latencies = []
+    baseline = None
+    peak = None
+    peak_per_stage = False
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        peak_per_stage = _reset_peak_rss()
+        rss = _rss("VmRSS")
+        baseline = rss if baseline is None or rss is None else min(baseline, rss)
+
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+
+        run_peak = _peak_rss()
+        peak = run_peak if peak is None or run_peak is None else max(peak, run_peak)
+
+    median = statistics.median(latencies)
+    result = {
+        "stage": stage,
+        "repeat": repeat,
+        "amount": amount,
+        "unit": unit,
+        "latency_min": min(latencies),
+        "latency_median": median,
+        "latency_max": max(latencies),
+        "throughput": amount / median if median > 0 else None,
+        "peak_rss_mb": peak / 2**20 if peak is not None else None,
+        "peak_rss_delta_mb": (peak - baseline) / 2**20 if peak is not None and baseline is not None else None,
+        "peak_rss_scope": "stage" if peak_per_stage else "process",
+    }
+    logger.info(
+        "%-18s median %8.3fs (min %.3fs, max %.3fs), %10.1f %s/s, peak RSS %s",
+        stage,
+        median,
+        result["latency_min"],
+        result["latency_max"],
+        result["throughput"] or 0.0,
+        unit,
+        f"{result['peak_rss_mb']:.0f} MB (+{result['peak_rss_delta_mb']:.0f} MB)" if result["peak_rss_delta_mb"] is not None else "unknown",
+    )
+    return result
+
+
+def skipped(stage: str, reason: str) -> dict:
+    logger.warning("%-18s skipped: %s", stage, reason)
+    return {"stage": stage, "skipped": reason}
+
+
+class Fixtures:
+    """
+    Synthetic inputs of the benchmark: the VO-data feed, the audio of a VO (as prepared audio and as WAV file for the
+    download and the ffmpeg stages) and a local HTTP server that serves them.
+    """
+
+    def __init__(self, folder: str, feed_entries: int, uni: str, audio_seconds: float, seed: int = 0):
+        self.folder = folder
+        self.uni = uni
+        self.feed_entries = feed_entries
+        self.audio_seconds = audio_seconds
+        os.makedirs(folder, exist_ok=True)
+        self.server = FixtureServer(folder)
+
+        logger.info("Generating %.1f minutes of synthetic audio and a feed with %d entries", audio_seconds / 60, feed_entries)
+        samples = synthesize_speech(audio_seconds, seed)
+        self.pcm_path = write_pcm(samples, os.path.join(folder, "lecture.pcm"))
+        self.wav_path = write_wav(samples, os.path.join(folder, "lecture.wav"))
+        del samples
+        self.media_url = f"{self.server.url}/lecture.wav"
+        self.feed_path = write_feed(os.path.join(folder, "feed.json"), feed_entries, uni, self.media_url, seed)
+        self.feed_url = f"{self.server.url}/feed.json"
+        self._segments = None
+        self._transcripts = None
+        self.index_vos = 0
+        self.index_segments = 0
+
+    def transcripts(self) -> list[tuple[VoData, SegmentStore]]:
+        """
+        Returns the synthetic transcripts of the VOs that are indexed by the index stages.
+        """
+        if self._transcripts is None:
+            self._transcripts = synthesize_transcripts(self.index_vos, self.index_segments)
+        return self._transcripts
+
+    def segments(self, cache: ModelCache) -> list[dict]:
+        """
+        Returns the segments the stub backend produces for the audio (input of the render stages).
+        """
+        if self._segments is None:
+            self._segments = transcribe_file(to_float(open_pcm(self.pcm_path)), model_name="stub", cache=cache, backend="stub")
+        return self._segments
+
+    def close(self):
+        self.server.close()
+
+
+def _remove(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run_stage(stage: str, fixtures: Fixtures, args, cache: ModelCache) -> dict:
+    """
+    Runs the benchmark of a single stage.
+    """
+    output = os.path.join(fixtures.folder, "out")
+    audio_seconds = fixtures.audio_seconds
+
+    if stage == "feed_parse":
+        return measure(
+            stage,
+            lambda: sum(1 for _ in iter_vo_data(iter_vo_results(path=fixtures.feed_path), fixtures.uni)),
+            args.repeat,
+            fixtures.feed_entries,
+            "entries",
+        )
+
+    if stage == "feed_fetch":
+        return measure(
+            stage,
+            lambda: sum(1 for _ in iter_vo_data(iter_vo_results(link=fixtures.feed_url), fixtures.uni)),
+            args.repeat,
+            fixtures.feed_entries,
+            "entries",
+        )
+
+    if stage == "download":
+        downloader = Downloader(parallel_chunks=args.download_chunks, min_chunk_size=2**20, retries=0)
+        target = output + ".wav"
+        return measure(
+            stage,
+            lambda: downloader.download(fixtures.media_url, target),
+            args.repeat,
+            os.path.getsize(fixtures.wav_path) / 2**20,
+            "MB",
+            setup=lambda: _remove(target, target + ".part"),
+        )
+
+    if stage == "prepare":
+        if shutil.which("ffmpeg") is None:
+            return skipped(stage, "ffmpeg not found")
+        return measure(stage, lambda: prepare_audio(fixtures.wav_path, output + ".pcm"), args.repeat, audio_seconds, "audio seconds")
+
+    if stage == "audio_load":
+        return measure(stage, lambda: to_float(open_pcm(fixtures.pcm_path)), args.repeat, audio_seconds, "audio seconds")
+
+    if stage == "vad":
+        return measure(stage, lambda: filter_speech(open_pcm(fixtures.pcm_path), "lecture"), args.repeat, audio_seconds, "audio seconds")
+
+    if stage == "transcribe":
+        return measure(
+            stage,
+            lambda: transcribe_file(to_float(open_pcm(fixtures.pcm_path)), model_name="stub", cache=cache, backend="stub"),
+            args.repeat,
+            audio_seconds,
+            "audio seconds",
+        )
+
+    if stage == "transcribe_stream":
+        return measure(
+            stage,
+            lambda: sum(1 for _ in iter_transcribe_file(open_pcm(fixtures.pcm_path), model_name="stub", cache=cache, backend="stub")),
+            args.repeat,
+            audio_seconds,
+            "audio seconds",
+        )
+
+    segments = fixtures.segments(cache)
+    if stage in ("render_txt", "render_srt", "render_vtt"):
+        generate = {"render_txt": generate_txt, "render_srt": generate_srt, "render_vtt": generate_vtt}[stage]
+        path = f"{output}.{stage[-3:]}"
+        return measure(stage, lambda: generate(segments, path), args.repeat, len(segments), "segments")
+
+    if stage == "render_all":
+        def render():
+            store = SegmentStore.from_segments(segments)
+            render_all(store, txt=output + ".txt", srt=output + ".srt", vtt=output + ".vtt", json_file=output + ".json", pdf=True)
+
+        return measure(stage, render, args.repeat, len(segments), "segments")
+
+    if stage in ("index_build", "search"):
+        transcripts = fixtures.transcripts()
+        path = output + ".sqlite"
+
+        def build():
+            _remove(path, path + "-wal", path + "-shm")
+            index = SearchIndex(path)
+            for vo_data, store in transcripts:
+                index.add(vo_data, store, vo_data.vo_id)
+            index.close()
+
+        if stage == "index_build":
+            result = measure(stage, build, args.repeat, sum(len(store) for _, store in transcripts), "segments")
+        else:
+            if not os.path.isfile(path):
+                build()
+            index = SearchIndex(path)
+            result = measure(
+                stage,
+                lambda: [index.search(query) for query in SEARCH_QUERIES],
+                args.repeat,
+                len(SEARCH_QUERIES),
+                "queries",
+            )
+            index.close()
+        index = SearchIndex(path)
+        result.update({f"index_{key}": value for key, value in index.stats().items()})
+        index.close()
+        logger.info("%-18s index of %d VOs with %d words takes %.1f MB", stage, result["index_vos"], result["index_words"], result["index_bytes"] / 2**20)
+        return result
+
+    if stage == "cli_import":
+        # Which packages 'import main' loads, the heavy ones have to be imported lazily
+        command = [sys.executable, "-X", "importtime", "-c", "import main"]
+        process = subprocess.run(command, cwd=REPOSITORY, capture_output=True, text=True, check=True)
+        imported = {line.rsplit("|", 1)[1].strip().split(".")[0] for line in process.stderr.splitlines() if line.count("|") == 2}
+        result = measure(stage, lambda: subprocess.run(command[:1] + command[3:], cwd=REPOSITORY, check=True), args.repeat, 1, "imports")
+        result["heavy_imports"] = sorted(imported & set(HEAVY_MODULES))
+        if result["heavy_imports"]:
+            result["failed"] = f"main.py imports {', '.join(result['heavy_imports'])} when it starts"
+        return result
+
+    if stage == "cli_startup":
+        command = [sys.executable, os.path.join(REPOSITORY, "main.py"), "list", "--uni", fixtures.uni, "-p", fixtures.feed_path, "-o", fixtures.folder]
+        result = measure(stage, lambda: subprocess.run(command, capture_output=True, check=True), args.repeat, 1, "runs")
+        if result["latency_median"] > args.max_startup:
+            result["failed"] = f"'main.py list' took {result['latency_median']:.3f}s (limit {args.max_startup}s)"
+        return result
+
+    if stage == "pdf":
+        try:
+            from utils.generate_PDF import _configuration, convert_to_PDF_vo_data
+
+            _configuration()
+        except (ImportError, OSError) as e:
+            return skipped(stage, f"PDF generation is not available ({e})")
+
+        transcription = "\n".join(segment["text"].strip() for segment in segments)
+        return measure(
+            stage,
+            lambda: convert_to_PDF_vo_data(
+                output + ".pdf",
+                "Lecture 00000",
+                "Benchmark Lecturer",
+                "Benchmark Tutor",
+                timedelta(seconds=audio_seconds),
+                datetime(2020, 10, 1, 9),
+                "Series 00",
+                fixtures.media_url,
+                transcription,
+                page_numbers=True,
+            ),
+            args.repeat,
+            len(segments),
+            "segments",
+        )
+
+    raise ValueError(f"Unknown stage '{stage}'")
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPOSITORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path: str) -> list[dict]:
+    if not os.path.isfile(path):
+        return []
+    with open(path, "r", encoding="UTF-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(results: list[dict], previous: list[dict]):
+    """
+    Logs the change of the median latency of every stage compared to the last earlier run with the same parameters.
+    """
+    for result in results:
+        if "skipped" in result:
+            continue
+        earlier = [
+            old
+            for old in previous
+            if old["stage"] == result["stage"] and old.get("params") == result["params"] and "skipped" not in old
+        ]
+        if not earlier:
+            logger.info("%-18s no earlier run with the same parameters", result["stage"])
+            continue
+        old = earlier[-1]
+        change = result["latency_median"] / old["latency_median"] - 1 if old["latency_median"] else 0.0
+        logger.info(
+            "%-18s %8.3fs -> %8.3fs (%+.1f%%) compared to run %s (commit %s)",
+            result["stage"],
+            old["latency_median"],
+            result["latency_median"],
+            100 * change,
+            old["run"],
+            old.get("commit"),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks every stage of VO-Transcriber offline with synthetic fixtures")
+
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="stages to benchmark (default: all)")
+    parser.add_argument("--uni", choices=["uw", "tu"], default="tu", help="format of the synthetic VO-data")
+    parser.add_argument("--feed-entries", type=int, default=2000, help="number of VOs in the synthetic VO-data")
+    parser.add_argument("--audio-minutes", type=float, default=10.0, help="length of the synthetic VO audio in minutes")
+    parser.add_argument("--stub-rtf", type=float, default=0.0, help="real-time factor the stub backend simulates (0 runs as fast as possible)")
+    parser.add_argument("--download-chunks", type=int, default=1, help="number of parallel ranges the download is split into")
+    parser.add_argument("--index-vos", type=int, default=100, help="number of synthetic transcripts the index stages index")
+    parser.add_argument("--index-segments", type=int, default=600, help="number of segments (5 seconds each) per synthetic transcript")
+    parser.add_argument(
+        "--max-startup",
+        type=float,
+        default=0.5,
+        help="seconds 'main.py list' may take at most, the run fails if the cli_startup stage is slower",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="how often every stage is run (the median is reported)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic fixtures")
+    parser.add_argument("--work-dir", type=str, default=None, help="folder for the fixtures and outputs (a temporary folder if not set)")
+    parser.add_argument("--results", type=str, default="benchmark-results.jsonl", help="JSON-lines file the results are appended to")
+    parser.add_argument("--compare", action="store_true", help="compares the results to the last earlier run in the results file")
+    parser.add_argument("--verbose", "-v", action="store_true", help="also shows the log messages of the stages")
+
+    args = parser.parse_args()
+
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter(fmt="%(asctime)s %(levelname)-8s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+    logging.getLogger("VO-Transcriber").addHandler(ch)
+    logging.getLogger("VO-Transcriber").setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    BACKENDS[StubBackend.name] = StubBackend
+    StubBackend.real_time_factor = args.stub_rtf
+    params = {
+        "uni": args.uni,
+        "feed_entries": args.feed_entries,
+        "audio_minutes": args.audio_minutes,
+        "stub_rtf": args.stub_rtf,
+        "download_chunks": args.download_chunks,
+        "index_vos": args.index_vos,
+        "index_segments": args.index_segments,
+        "seed": args.seed,
+    }
+    run = {
+        "run": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": params,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="vo-benchmark-") as temp_dir:
+        fixtures = Fixtures(args.work_dir or temp_dir, args.feed_entries, args.uni, args.audio_minutes * 60, args.seed)
+        fixtures.index_vos = args.index_vos
+        fixtures.index_segments = args.index_segments
+        cache = ModelCache()
+        try:
+            results = [{**run, **run_stage(stage, fixtures, args, cache)} for stage in STAGES if stage in args.stages]
+        finally:
+            fixtures.close()
+            cache.clear()
+
+    previous = load_results(args.results)
+    with open(args.results, "a", encoding="UTF-8") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    logger.info("Appended %d result(s) to '%s'", len(results), args.results)
+    if args.compare:
+        compare(results, previous)
+    failed = [result for result in results if "failed" in result]
+    for result in failed:
+        logger.error("%-18s failed: %s", result["stage"], result["failed"])
+    sys.exit(1 if failed else 0)
@@ -1,84 +1,308 @@
 import argparse
-from datetime import datetime
+import contextlib
+from datetime import datetime, timedelta
+import hashlib
+import json
 import logging
 import os
+import shutil
+import sys
+import threading
+from typing import TYPE_CHECKING
 
 from models.VoDataModels import VoData
-from utils.transcribe import transcribe_file
-from utils.download import download_only_audio
-from utils.generate_PDF import convert_to_PDF_vo_data
-from utils.generate_files import generate_srt, generate_txt, generate_vtt
-from utils.vo_data import get_all_vo_data, parse_vo_data_tu, parse_vo_data_uni_wien
+from utils.backends import BACKENDS
+from utils.generate_files import MultiWriter, SrtWriter, TxtWriter, VttWriter, render_all
+from utils.segment_store import STORE_EXTENSION, SegmentStore
+from utils.pipeline import SKIP, Stage, run_pipeline, worker_index
+from utils.scheduler import MODEL_SIZES, parse_deadline
+from utils.ledger import RunLedger
+from utils.search_index import INDEX_FILE, SearchIndex
+from utils.tracing import SPANS, tracer
 
+# Modules that load whisper (torch), pdfkit, jinja2 or youtube_dl are imported by the functions that need them, so that
+# listing VOs or a wrong argument doesn't wait for their import
+if TYPE_CHECKING:
+    from utils.batching import BatchedTranscriber
+    from utils.cache import TranscriptionCache
+    from utils.chunking import ChunkedTranscriber
+    from utils.download import Downloader
+    from utils.generate_PDF import PdfBatchRenderer
 
-def download_vo(vo_data: VoData, output_file: str):
+
+logger = logging.getLogger("VO-Transcriber")
+
+COMMANDS = ("list", "download", "transcribe", "render", "run", "index", "search")
+# Stages of the pipeline the commands run ("load" reads the saved transcriptions)
+COMMAND_STAGES = {
+    "download": ("download",),
+    "transcribe": ("download", "transcribe"),
+    "render": ("load", "render"),
+    "run": ("download", "transcribe", "render", "index"),
+}
+COMMAND_VERBS = {"download": "downloaded", "transcribe": "transcribed", "render": "rendered", "run": "transcribed"}
+
+
+def download_vo(vo_data: VoData, output_file: str, downloader: "Downloader" = None) -> str:
     """
-    Downloads the audio track of the given vo_data to the given output_file
+    Downloads the audio track of the given vo_data without converting it. Direct links to media files are downloaded
+    with the Downloader (resumable, retried), every other link is handed to youtube_dl.
     :param vo_data:         The vo_data to download
-    :param output_file:     The output file to save the audio track to
+    :param output_file:     The output file to save the audio track to (without file extension)
+    :param downloader:      The Downloader to use for direct links (a new one is created if None)
+    :return:                The path of the downloaded file
     """
+    from utils.download import Downloader, download, is_direct_link, media_extension
+
     logger.info("Downloading %s", vo_data.vo_title)
 
     if vo_data.vo_mp3_link is not None:
+        logger.info("Found audiotrack for '%s'", vo_data.vo_title)
+        link = vo_data.vo_mp3_link
+    else:
         logger.warning(
-            "No audio track found for '%s' found!\nDownloading whole video and extracting audio track (will take more time)",
+            "No audio track found for '%s' found!\nDownloading whole video (will take more time)",
             vo_data.vo_title,
         )
-        logger.debug("Downloading video for '%s' from '%s'", vo_data.vo_title, vo_data.vo_mp3_link)
-        download_only_audio(vo_data.vo_mp3_link, output_file)
-        logger.info("Downloaded video and extracted audio track for '%s' to '%s'", vo_data.vo_title, output_file)
-    elif vo_data.vo_mp4_link is not None:
-        logger.info("Found audiotrack for '%s'", vo_data.vo_title)
-        logger.debug("Downloading audio track for '%s' from '%s'", vo_data.vo_title, vo_data.vo_mp4_link)
-        download_only_audio(vo_data.vo_mp4_link, output_file)
-        logger.info("Downloaded audio track for '%s' to '%s'", vo_data.vo_title, output_file)
+        link = vo_data.vo_mp4_link
+    logger.debug("Downloading '%s' from '%s'", vo_data.vo_title, link)
+
+    if is_direct_link(link):
+        path = output_file + media_extension(link)
+        (downloader or Downloader()).download(link, path)
+    else:
+        path = download(link, output_file + ".%(ext)s")
 
+    logger.info("Downloaded '%s' to '%s'", vo_data.vo_title, path)
+    return path
 
-def generate_transcribtions_vo(
+
+def transcribe_vo(
     audio_path: str,
-    vo_data: VoData,
-    output_folder: str,
     language: str = None,
     model_name: str = "tiny",
     verbose: bool = False,
+    device: str = "cpu",
+    fp16: bool = False,
+    model_slot: int = 0,
+    cache: "TranscriptionCache" = None,
+    chunked: "ChunkedTranscriber" = None,
+    vad: bool = False,
+    on_segment=None,
+    batched: "BatchedTranscriber" = None,
+    backend: str = "whisper",
+    window_length: float = None,
+    progress=None,
+):
+    """
+    Transcribes the audio file at the given path. By default whisper transcribes the whole recording in one pass. With a
+    window_length (or on_segment) the audio is transcribed window by window instead (the end of the previous window is
+    passed on as prompt), so the memory needed does not grow with the length of the recording.
+    :param audio_path:      Path to the audio file to transcribe (prepared audio files are read without decoding)
+    :param language:        Language of the given audio file
+    :param model_name:      Name of the whisper-model to use for transcription
+    :param verbose:         Whether to print the transcription to the console (will print each segment after it is transcribed)
+    :param device:          Device the whisper-model shall run on
+    :param fp16:            Whether the whisper-model shall use half precision
+    :param model_slot:      Which instance of the whisper-model to use (concurrent transcriptions need different slots)
+    :param cache:           The TranscriptionCache to look the transcription up in and store it to (None disables caching)
+    :param chunked:         The ChunkedTranscriber to transcribe the audio in parallel chunks with (None transcribes it in one pass)
+    :param vad:             Whether to remove silence and non-speech before transcribing (timestamps stay relative to the original audio)
+    :param on_segment:      Function that is called with every segment as soon as it is transcribed
+    :param batched:         The BatchedTranscriber whose batches the windows of the audio are decoded in (None decodes
+                            them one by one)
+    :param backend:         Name of the backend that runs the whisper-model (see utils.backends.BACKENDS), the chunked
+                            and batched transcribers bring their own
+    :param window_length:   Length of the windows in seconds (see utils.transcribe.window_length_for_budget), None
+                            transcribes in one pass (or in windows of DEFAULT_WINDOW_LENGTH with on_segment)
+    :param progress:        Function that is called with every segment as soon as the backend returns it (e.g. to report
+                            progress). Unlike on_segment it doesn't make the audio be transcribed in windows, in one pass
+                            whisper returns every segment at the end.
+    :return:                The transcribed segments and a dict with "cached" (whether they came from the cache) and
+                            "load_seconds" (how long this call spent getting the model, e.g. loading it)
+    """
+    from utils.audio import PCM_EXTENSION, SAMPLE_RATE, is_prepared, load_audio, open_pcm, prepare_audio, to_float
+    from utils.transcribe import DEFAULT_WINDOW_LENGTH, iter_transcribe_file, model_cache, transcribe_file
+    from utils.vad import filter_speech
+
+    options = {"fp16": fp16, "vad": vad}
+    if backend != "whisper":
+        options["backend"] = backend
+    if batched is not None:
+        options["batched"] = True
+    if chunked is not None:
+        options["chunk_length"] = chunked.chunk_length
+        options["chunk_overlap"] = chunked.overlap
+    elif batched is None and window_length is not None:
+        options["window_length"] = window_length
+
+    if cache is not None:
+        key = cache.key(audio_path, model_name, language, options)
+        segments = cache.get(key)
+        if segments is not None:
+            logger.info("Found transcription of '%s' in cache", audio_path)
+            tracer.annotate(cached=True)
+            for segment in segments if on_segment is not None else []:
+                on_segment(segment)
+            return segments, {"cached": True, "load_seconds": 0.0}
+
+    logger.info("Transcribing '%s'", audio_path)
+    load_seconds = model_cache.thread_seconds()
+    base = os.path.splitext(audio_path)[0]
+    temporary = []
+    audio = None
+    timeline = None
+    if vad:
+        if not is_prepared(audio_path):
+            # Decoded to a file first, so that the audio is never in memory as a whole
+            temporary.append(prepare_audio(audio_path, base + ".decoded" + PCM_EXTENSION))
+        samples = open_pcm(temporary[-1] if temporary else audio_path)
+        with tracer.span("vad", audio_seconds=len(samples) / SAMPLE_RATE) as vad_span:
+            vad_path = base + ".vad" + PCM_EXTENSION
+            audio, timeline = filter_speech(samples, os.path.basename(audio_path), output_file=vad_path)
+            temporary.append(vad_path)
+            vad_span.set(speech_seconds=timeline.compact_length / SAMPLE_RATE)
+        del samples
+
+    def remap(segment):
+        return timeline.remap_segments([segment])[0] if timeline is not None else segment
+
+    try:
+        with tracer.span("decode") as span:
+            if timeline is not None:
+                span.set(speech_seconds=timeline.compact_length / SAMPLE_RATE)
+            if chunked is not None:
+                del audio
+                segments = chunked.transcribe(temporary[-1] if timeline is not None else audio_path, language=language)
+            elif batched is None and window_length is None and on_segment is None:
+                # Without a memory budget (and without streaming) whisper gets the whole recording in one pass
+                segments = transcribe_file(
+                    input_file=to_float(audio) if audio is not None else load_audio(audio_path),
+                    language=language,
+                    model_name=model_name,
+                    verbose=verbose,
+                    device=device,
+                    fp16=fp16,
+                    slot=model_slot,
+                    backend=backend,
+                    on_segment=None if progress is None else lambda segment: progress(remap(segment)),
+                )
+                del audio
+            else:
+                if audio is None:
+                    # Unprepared audio files are streamed from ffmpeg (the batched transcriber needs all samples)
+                    if is_prepared(audio_path):
+                        audio = open_pcm(audio_path)
+                    else:
+                        audio = load_audio(audio_path) if batched is not None else audio_path
+                if batched is not None:
+                    windows = batched.transcribe(audio, language=language, verbose=verbose)
+                else:
+                    windows = iter_transcribe_file(
+                        audio,
+                        language=language,
+                        model_name=model_name,
+                        verbose=verbose,
+                        device=device,
+                        fp16=fp16,
+                        slot=model_slot,
+                        window_length=window_length or DEFAULT_WINDOW_LENGTH,
+                        backend=backend,
+                    )
+                segments = []
+                for segment in windows:
+                    segment = remap(segment)
+                    if on_segment is not None:
+                        on_segment(segment)
+                    if progress is not None:
+                        progress(segment)
+                    segments.append(segment)
+                del audio
+    finally:
+        for path in temporary:
+            if os.path.exists(path):
+                os.remove(path)
+
+    if timeline is not None:
+        if chunked is not None or (batched is None and window_length is None and on_segment is None):
+            segments = timeline.remap_segments(segments)
+        logger.info(
+            "Transcribed %.1f minutes of speech in %s (real-time factor %.2f)",
+            timeline.compact_length / SAMPLE_RATE / 60,
+            str(timedelta(seconds=span.seconds)),
+            span.seconds / max(timeline.compact_length / SAMPLE_RATE, 1e-9),
+        )
+    if chunked is not None and on_segment is not None:
+        for segment in segments:
+            on_segment(segment)
+    logger.info("Finished transcribing '%s'", audio_path)
+
+    if cache is not None:
+        cache.put(key, segments)
+    return segments, {"cached": False, "load_seconds": model_cache.thread_seconds() - load_seconds}
+
+
+def render_vo(
+    segments,
+    vo_data: VoData,
+    output_folder: str,
     txt: bool = True,
     vtt: bool = False,
     srt: bool = False,
     pdf: bool = False,
     pdf_page_numbers: bool = False,
+    json: bool = False,
+    pdf_renderer: "PdfBatchRenderer" = None,
+    pdf_file: bool = True,
+    save_store: bool = True,
 ):
     """
-    Transcribes the audio file at the given path and generates the output files.
-    :param audio_path:      Path to the audio file to transcribe
+    Generates the requested output files from the transcribed segments in a single pass. The segments are also saved
+    as segment store (.segs), so that the output files can be generated again later without transcribing.
+    :param segments:        The transcribed segments (list of whisper segments or a SegmentStore)
     :param vo_data:         The vo data
     :param output_folder:   The folder to save the output files to
-    :param language:        Language of the given audio file
-    :param model_name:      Name of the whisper-model to use for transcription
-    :param verbose:         Whether to print the transcription to the console (will print each segment after it is transcribed)
     :param txt:             Whether to generate a txt file
     :param vtt:             Whether to generate a vtt file
     :param srt:             Whether to generate a srt file
     :param pdf:             Whether to generate a pdf file
+    :param pdf_page_numbers: Whether to add page numbers to the pdf file
+    :param json:            Whether to generate a json file
+    :param pdf_renderer:    The PdfBatchRenderer to queue the pdf file in (None converts it right away)
+    :param pdf_file:        Whether to save the pdf as its own file (if False it is only part of the pdf_renderer's combined pdf)
+    :param save_store:      Whether to save the segment store
+    :return:                Future of the pdf conversion if it was queued in the pdf_renderer, otherwise None
     """
-    logger.info("Transcribing '%s'", audio_path)
-    segments = transcribe_file(
-        input_file=audio_path,
-        language=language,
-        model_name=model_name,
-        verbose=verbose,
+    store = segments if isinstance(segments, SegmentStore) else SegmentStore.from_segments(segments)
+    if save_store:
+        store.save(os.path.join(output_folder, vo_data.vo_title + STORE_EXTENSION))
+
+    path = os.path.join(output_folder, vo_data.vo_title)
+    transcription = render_all(
+        store,
+        txt=path + ".txt" if txt else None,
+        srt=path + ".srt" if srt else None,
+        vtt=path + ".vtt" if vtt else None,
+        json_file=path + ".json" if json else None,
+        pdf=pdf,
     )
+    if pdf and pdf_renderer is not None:
+        return pdf_renderer.submit(
+            output_file=path + ".pdf" if pdf_file else None,
+            vo_title=vo_data.vo_title,
+            autor=vo_data.author,
+            beitragende=vo_data.contributors,
+            length=vo_data.duration,
+            recorded_on=vo_data.recorded_on,
+            series_name=vo_data.series_title,
+            link=vo_data.vo_mp4_link,
+            transcription=transcription,
+        )
+    elif pdf and pdf_file:
+        from utils.generate_PDF import convert_to_PDF_vo_data
 
-    if txt:
-        generate_txt(segments, os.path.join(output_folder, vo_data.vo_title + ".txt"))
-    if vtt:
-        generate_vtt(segments, os.path.join(output_folder, vo_data.vo_title + ".vtt"))
-    if srt:
-        generate_srt(segments, os.path.join(output_folder, vo_data.vo_title + ".srt"))
-    if pdf:
-        path = os.path.join(output_folder, vo_data.vo_title + ".pdf")
-        transcription = generate_txt(segments)
         convert_to_PDF_vo_data(
-            output_file=path,
+            output_file=path + ".pdf",
             vo_title=vo_data.vo_title,
             autor=vo_data.author,
             beitragende=vo_data.contributors,
@@ -89,88 +313,823 @@ def generate_transcribtions_vo(
             transcription=transcription,
             page_numbers=pdf_page_numbers,
         )
-    logger.info("Finished transcribing '%s'", audio_path)
 
 
-def main(args):
-    # Getting VO-Data
-    all_vo_data = get_all_vo_data(args.data_path, args.data_link)
-    if all_vo_data is None:
-        logger.error("Could not get VO-Data! Exiting")
+def open_segment_writers(
+    vo_data: VoData,
+    output_folder: str,
+    txt: bool = True,
+    vtt: bool = False,
+    srt: bool = False,
+) -> MultiWriter:
+    """
+    Opens writers for the requested output files, which can be filled segment by segment while transcribing.
+    :param vo_data:         The vo data
+    :param output_folder:   The folder to save the output files to
+    :param txt:             Whether to write a txt file
+    :param vtt:             Whether to write a vtt file
+    :param srt:             Whether to write a srt file
+    :return:                A MultiWriter that writes every segment to all opened files
+    """
+    writers = []
+    if txt:
+        writers.append(TxtWriter(os.path.join(output_folder, vo_data.vo_title + ".txt")))
+    if vtt:
+        writers.append(VttWriter(os.path.join(output_folder, vo_data.vo_title + ".vtt")))
+    if srt:
+        writers.append(SrtWriter(os.path.join(output_folder, vo_data.vo_title + ".srt")))
+    return MultiWriter(writers)
+
+
+def select_from_catalog(args, list_all: bool = False):
+    """
+    Syncs the catalog with the given VO-data (if any) and selects the VOs to transcribe from it.
+    :param args:        The parsed command line arguments
+    :param list_all:    Whether every VO of the catalog is selected if no selection is given
+    :return:            The selected VOs or None if nothing was selected
+    """
+    from utils.catalog import Catalog
+
+    catalog_path = args.catalog or os.path.join(args.output_folder, "catalog.sqlite")
+    feeds = None
+    if args.manifest is not None:
+        from utils.feeds import load_manifest, sync_feeds
+
+        feeds = load_manifest(args.manifest)
+        sync_feeds(catalog_path, feeds, full=args.full_sync, workers=args.feed_workers, per_host_rate=args.feed_rate)
+
+    catalog = Catalog(catalog_path)
+    try:
+        try:
+            if args.data_link is not None:
+                with tracer.span("catalog_sync", logging.INFO, link=args.data_link) as span:
+                    span.set(new=catalog.sync_link(args.data_link, args.uni, full=args.full_sync))
+            elif args.data_path is not None:
+                with tracer.span("catalog_sync", logging.INFO, path=args.data_path) as span:
+                    span.set(new=catalog.sync_file(args.data_path, args.uni))
+        except Exception as e:
+            logger.error("Could not sync the catalog, using the VOs already in it: %s", e)
+
+        # The feeds of a manifest select their VOs themselves
+        if not (feeds or args.vos or args.series or args.since or args.until or args.vos_pattern or list_all):
+            logger.info("All Vos found: \n%s", "\n".join([20 * " " + title for title in catalog.titles()]))
+            logger.error("No VOs to transcribe given! Exiting")
+            return None
+
+        with tracer.span("catalog_select") as span:
+            if feeds is not None:
+                from utils.feeds import select_from_feeds
+
+                vos = select_from_feeds(
+                    catalog,
+                    feeds,
+                    titles=args.vos,
+                    series=args.series,
+                    since=args.since,
+                    until=args.until,
+                    pattern=args.vos_pattern,
+                )
+            else:
+                vos = catalog.select(
+                    titles=args.vos,
+                    series=args.series,
+                    since=args.since,
+                    until=args.until,
+                    pattern=args.vos_pattern,
+                )
+            span.set(vos=len(vos))
+        return vos
+    finally:
+        catalog.close()
+
+
+def select_vos(args):
+    """
+    Selects the VOs the command works on from the catalog (with --catalog), from the feeds of a manifest (with
+    --manifest) or from the VO-data.
+    :param args:    The parsed command line arguments
+    :return:        The selected VOs or None if nothing was selected
+    """
+    if args.catalog is not None:
+        vos = select_from_catalog(args)
+    elif args.manifest is not None:
+        from utils.feeds import ingest_feeds, load_manifest
+
+        feeds = load_manifest(args.manifest)
+        vos = ingest_feeds(
+            feeds,
+            titles=args.vos,
+            series=args.series,
+            workers=args.feed_workers,
+            per_host_rate=args.feed_rate,
+        )
+    else:
+        from utils.vo_data import iter_vo_data, iter_vo_results, iter_vo_titles
+
+        results = iter_vo_results(args.data_path, args.data_link)
+        if results is None:
+            logger.error("Could not get VO-Data! Exiting")
+            return None
+
+        # The VO-data is streamed, so a truncated or invalid feed only shows up while it is read
+        try:
+            # Without VOs to transcribe only the titles of the available VOs are listed (no VO is parsed)
+            if not args.vos and not args.series:
+                logger.info("All Vos found: \n%s", "\n".join([20 * " " + str(title) for title in iter_vo_titles(results)]))
+                logger.error("No VOs to transcribe given! Exiting")
+                return None
+
+            # Parseing VO-Data (only the selected VOs)
+            with tracer.span("feed_parse", logging.INFO) as span:
+                vos = list(iter_vo_data(results, args.uni, titles=args.vos, series=args.series))
+                span.set(vos=len(vos))
+        except Exception as e:
+            logger.error("Could not load VO-data: %s", e)
+            logger.error("Could not get VO-Data! Exiting")
+            return None
+
+    if vos is not None:
+        missing = set(args.vos or []) - {vo.vo_title for vo in vos}
+        if missing:
+            logger.warning("VOs not found in VO-Data: \n%s", "\n".join([20 * " " + title for title in sorted(missing)]))
+    return vos
+
+
+def create_scheduler(args, vos: list[VoData], audios_output_folder: str):
+    """
+    Creates the scheduler that chooses the model of every VO to meet args.deadline. The real-time factors of the models
+    this host doesn't know yet are calibrated on the beginning of one of the VOs.
+    :param args:                    The parsed command line arguments
+    :param vos:                     The VOs to transcribe
+    :param audios_output_folder:    Folder of the downloaded audios
+    :return:                        The DeadlineScheduler and the RtfTable (both None if no model could be calibrated)
+    """
+    from utils.audio import PCM_EXTENSION, SAMPLE_RATE, is_prepared, load_audio, open_pcm, to_float
+    from utils.download import is_direct_link
+    from utils.scheduler import CALIBRATION_SECONDS, RTF_FILE, DeadlineScheduler, RtfTable, model_ladder
+
+    rtf_table = RtfTable(os.path.join(args.output_folder, RTF_FILE), backend=args.backend, device=args.device, fp16=args.fp16)
+    models = model_ladder(args.model_name, args.min_model)
+    missing = [model_name for model_name in models if args.recalibrate or rtf_table.get(model_name) is None]
+    if missing and vos:
+        audio = None
+        for vo_data in vos:
+            pcm_path = os.path.join(audios_output_folder, vo_data.vo_title + PCM_EXTENSION)
+            link = vo_data.vo_mp3_link or vo_data.vo_mp4_link
+            try:
+                if is_prepared(pcm_path):
+                    audio = to_float(open_pcm(pcm_path)[: int(CALIBRATION_SECONDS * SAMPLE_RATE)])
+                elif is_direct_link(link):
+                    audio = load_audio(link, duration=CALIBRATION_SECONDS)
+            except Exception as e:
+                logger.warning("Could not load the audio of '%s' for the calibration: %s", vo_data.vo_title, e)
+            if audio is not None and len(audio):
+                logger.info("Calibrating model(s) %s on the beginning of '%s'", ", ".join(missing), vo_data.vo_title)
+                break
+
+        for model_name in missing if audio is not None else []:
+            try:
+                rtf_table.calibrate(model_name, audio, language=args.language)
+            except Exception as e:
+                logger.warning("Could not calibrate model '%s': %s", model_name, e)
+
+    models = [model_name for model_name in models if rtf_table.get(model_name) is not None]
+    if not models:
+        logger.error("No model could be calibrated, transcribing every VO with model '%s' regardless of the deadline", args.model_name)
+        return None, None
+    for model_name in models:
+        logger.info("Model '%s': real-time factor %.3f", model_name, rtf_table.get(model_name, args.chunk_workers, args.transcribe_workers))
+
+    scheduler = DeadlineScheduler(
+        vos,
+        args.deadline,
+        models,
+        rtf=lambda model_name: rtf_table.get(model_name, args.chunk_workers, args.transcribe_workers),
+        priorities={RunLedger.key(vo): 1 for vo in vos if vo.vo_title in set(args.priority or [])},
+        concurrency=args.transcribe_workers,
+    )
+    return scheduler, rtf_table
+
+
+def list_vos(args):
+    """
+    Prints the titles of the selected VOs (of every VO if nothing is selected), one per line.
+    """
+    if args.catalog is not None:
+        vos = select_from_catalog(args, list_all=True)
+        titles = [vo.vo_title for vo in vos or []]
+    elif args.manifest is not None or args.vos or args.series:
+        vos = select_vos(args)
+        titles = [vo.vo_title for vo in vos or []]
+    else:
+        from utils.vo_data import iter_vo_results, iter_vo_titles
+
+        results = iter_vo_results(args.data_path, args.data_link)
+        if results is None:
+            logger.error("Could not get VO-Data! Exiting")
+            return
+        # Only the titles are read, no VO is parsed
+        try:
+            titles = list(iter_vo_titles(results))
+        except Exception as e:
+            logger.error("Could not load VO-data: %s", e)
+            return
+
+    for title in titles:
+        print(title)
+
+
+def state_folder(args) -> str:
+    """
+    Returns the folder of the run ledger and the fingerprints. Workers keep them on their own machine (SQLite databases
+    can't be shared over a network file system), the finished stages are passed on in the task files instead.
+    """
+    if not getattr(args, "worker", False):
+        return args.output_folder
+    folder = args.state_folder
+    if folder is None:
+        output_id = hashlib.sha1(os.path.abspath(args.output_folder).encode("UTF-8")).hexdigest()[:12]
+        folder = os.path.join(os.path.expanduser("~"), ".cache", "VO-Transcriber", output_id)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def restore_worker_stages(ledger: RunLedger, output_folder: str):
+    """
+    Adds the stages that workers (see --worker) recorded in the finished tasks of the queues in the output folder to
+    the given ledger.
+    """
+    from utils.task_queue import QUEUE_FOLDER, finished_tasks
+
+    queue_folder = os.path.join(output_folder, QUEUE_FOLDER)
+    if not os.path.isdir(queue_folder):
+        return
+    for command in sorted(os.listdir(queue_folder)):
+        for task in finished_tasks(os.path.join(queue_folder, command)):
+            vo_data = VoData.parse_obj(task["payload"])
+            ledger.record_vo(vo_data)
+            ledger.restore(vo_data, task.get("stages", []), output_folder)
+
+
+def index_vos(args):
+    """
+    Adds every transcribed VO of the run ledger to the search index. VOs whose transcript did not change since they
+    were indexed are skipped.
+    """
+    ledger = RunLedger(os.path.join(args.output_folder, "ledger.sqlite"))
+    index = SearchIndex(os.path.join(args.output_folder, INDEX_FILE))
+    try:
+        restore_worker_stages(ledger, args.output_folder)
+        indexed = 0
+        for vo_data, record in ledger.records("transcribe"):
+            if not os.path.isfile(record["path"]):
+                logger.warning("Transcript '%s' of '%s' is missing, it is not indexed", record["path"], vo_data.vo_title)
+                continue
+            checksum = None if args.rebuild else record["checksum"]
+            with tracer.span("index", vo=vo_data.vo_title) as span:
+                span.set(indexed=index.add(vo_data, SegmentStore.load(record["path"]), checksum))
+            indexed += span.attributes["indexed"]
+        stats = index.stats()
+        logger.info(
+            "Indexed %d VO(s), the index contains %d VO(s) with %d words (%d distinct terms) and takes %.1f MB",
+            indexed,
+            stats["vos"],
+            stats["words"],
+            stats["terms"],
+            stats["bytes"] / 2**20,
+        )
+    finally:
+        index.close()
+        ledger.close()
+
+
+def search_vos(args):
+    """
+    Prints the VOs and the times in them that match the query.
+    """
+    path = os.path.join(args.output_folder, INDEX_FILE)
+    if not os.path.isfile(path):
+        logger.error("There is no search index in '%s', create it with the 'index' command", args.output_folder)
         return
 
-    # Parseing VO-Data
-    if args.uni == "uw":
-        all_vo_data = parse_vo_data_uni_wien(all_vo_data)
-    elif args.uni == "tu":
-        all_vo_data = parse_vo_data_tu(all_vo_data)
+    index = SearchIndex(path)
+    try:
+        results = index.search(" ".join(args.query), limit=args.limit, hits_per_vo=args.hits)
+    finally:
+        index.close()
 
-    logger.debug("All Vos found: \n%s", "\n".join([20 * " " + vo.vo_title for vo in all_vo_data]))
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    for result in results:
+        print(f"{result['title']} ({result['series']}): {result['matches']} match(es)")
+        for hit in result["hits"]:
+            print(f"    [{timedelta(seconds=round(hit['start']))}] {hit['text']}")
+            if hit["link"]:
+                print(f"        {hit['link']}")
+    if not results:
+        print("No matches")
 
-    for vo in all_vo_data:
-        temp = [f'{35 * " "}{k}: {v}'  for k, v in zip(vo.dict().keys(), vo.dict().values())]
-        logger.info("VO-Data for '%s':\n%s", vo.vo_title, "\n".join(temp))
 
-    # Getting VOs to transcribe
-    if args.vos is None or len(args.vos) == 0:
-        logger.error("No VOs to transcribe given! Exiting")
+def main(args):
+    stages = COMMAND_STAGES[args.command]
+    if args.worker and args.data_path is None and args.data_link is None and args.manifest is None and args.catalog is None:
+        # A worker without VO-data only works on the tasks other workers queued
+        vos_to_transcribe = []
+    else:
+        vos_to_transcribe = select_vos(args)
+    if vos_to_transcribe is None:
         return
 
-    vos_to_transcribe = [vo for vo in all_vo_data if vo.vo_title in args.vos]
-    logger.info("VOs to be transcribed: \n%s", "\n".join([20 * " " + vo.vo_title for vo in vos_to_transcribe]))
+    for vo in vos_to_transcribe:
+        temp = [f'{35 * " "}{k}: {v}'  for k, v in zip(vo.dict().keys(), vo.dict().values())]
+        logger.info("VO-Data for '%s':\n%s", vo.vo_title, "\n".join(temp))
 
-    # Download VOs
-    logger.info("Downloading VOs")
+    # Creating output folders
     audios_output_folder = os.path.join(args.output_folder, "audios")
     logger.debug("Creating output folder for VO-audios: '%s'", audios_output_folder)
-
     if not os.path.isdir(audios_output_folder):
         os.mkdir(audios_output_folder)
 
-    paths_to_audios = [os.path.join(audios_output_folder, vo.vo_title + ".mp3") for vo in vos_to_transcribe]
-    for vo_data, path in zip(vos_to_transcribe, paths_to_audios):
-        start = datetime.now()
-        download_vo(vo_data, path)
-        end = datetime.now()
-        logger.info("Downloading took %s", str(end - start))
-
-    logger.info("Finished downloading VOs")
-
-    # Transcribe VOs
-    logger.info("Transcribing VOs")
     transcription_output_folder = os.path.join(args.output_folder, "transcriptions")
-    logger.debug("Created output folder for VO-transcriptions: '%s'", transcription_output_folder)
-
+    logger.debug("Creating output folder for VO-transcriptions: '%s'", transcription_output_folder)
     if not os.path.isdir(transcription_output_folder):
         os.mkdir(transcription_output_folder)
 
-    for vo_data, audio_path in zip(vos_to_transcribe, paths_to_audios):
-        start = datetime.now()
-        generate_transcribtions_vo(
-            audio_path=audio_path,
-            output_folder=transcription_output_folder,
-            vo_data=vo_data,
-            language=args.language,
-            model_name=args.model_name,
-            verbose=args.verbose,
-            txt=args.txt,
-            vtt=args.vtt,
-            srt=args.srt,
-            pdf=args.pdf,
-            pdf_page_numbers=True,
+    duplicates = []
+    if "download" in stages and not args.no_dedup:
+        from utils.dedup import find_duplicates
+
+        # Copies of a VO (re-uploads, other resolutions, cross-listed series) are only downloaded and transcribed once,
+        # preferably the copy that is already transcribed
+        vos_to_transcribe, duplicates = find_duplicates(
+            vos_to_transcribe,
+            prefer=lambda vo: os.path.isfile(os.path.join(transcription_output_folder, vo.vo_title + STORE_EXTENSION)),
         )
-        end = datetime.now()
-        logger.info("Transcribing took %s", str(end - start))
+        for duplicate, original in duplicates:
+            logger.info("'%s' is a copy of '%s' (same recording in the VO-data)", duplicate.vo_title, original.vo_title)
 
-    logger.info("Finished transcribing VOs")
+    if "load" in stages:
+        transcribed = [
+            vo for vo in vos_to_transcribe if os.path.isfile(os.path.join(transcription_output_folder, vo.vo_title + STORE_EXTENSION))
+        ]
+        missing = [vo.vo_title for vo in vos_to_transcribe if vo not in transcribed]
+        if missing:
+            logger.warning("VOs that are not transcribed yet: \n%s", "\n".join([20 * " " + title for title in missing]))
+        vos_to_transcribe = transcribed
+    logger.info("VOs to be %s: \n%s", COMMAND_VERBS[args.command], "\n".join([20 * " " + vo.vo_title for vo in vos_to_transcribe]))
 
+    # The modules of the stages are only imported if the command runs them
+    if "download" in stages:
+        from utils.audio import PCM_EXTENSION, SAMPLE_RATE, is_prepared, open_pcm, prepare_audio, read_pcm_header
+        from utils.download import Downloader, is_direct_link
+    if "transcribe" in stages:
+        from utils.cache import TranscriptionCache
+        from utils.transcribe import model_cache, window_length_for_budget
+    if "load" in stages or "render" in stages:
+        from utils.cache import hash_file
+    fingerprints = None
+    if "download" in stages and not args.no_dedup:
+        from utils.dedup import FingerprintStore, fingerprint, fingerprint_link
 
-if __name__ == "__main__":
-    # Setup argparse
-    parser = argparse.ArgumentParser(description="Transcribe audio files to text")
+        fingerprints = FingerprintStore(os.path.join(state_folder(args), "fingerprints.sqlite"))
+
+    cache = None
+    transcribers = {}
+    transcribers_lock = threading.Lock()
+    models = [args.model_name] if "transcribe" in stages else []
+    if "transcribe" in stages:
+        if args.model_cache_size is not None:
+            model_cache.max_memory = args.model_cache_size * 2**20
+
+        window_length = None
+        if args.memory_budget is not None:
+            window_length = window_length_for_budget(args.memory_budget * 2**20)
+            logger.info("Transcribing in windows of %.0f seconds", window_length)
+
+        if not args.no_cache:
+            cache_folder = args.cache_folder or os.path.join(args.output_folder, "cache")
+            cache = TranscriptionCache(cache_folder, max_size=args.cache_size * 2**20 if args.cache_size else None)
+
+    def transcribers_for(model_name):
+        """
+        Returns the chunked and the batched transcriber of the model (None if not used), created on first use.
+        """
+        with transcribers_lock:
+            if model_name not in transcribers:
+                chunked = None
+                batched = None
+                if args.chunk_workers > 1:
+                    from utils.chunking import ChunkedTranscriber
+
+                    chunked = ChunkedTranscriber(
+                        model_name=model_name,
+                        workers=args.chunk_workers,
+                        chunk_length=args.chunk_length,
+                        overlap=args.chunk_overlap,
+                        device=args.device,
+                        fp16=args.fp16,
+                        backend=args.backend,
+                    )
+                elif args.batch_size > 1:
+                    from utils.batching import BatchedTranscriber
+
+                    batched = BatchedTranscriber(
+                        model_name=model_name,
+                        device=args.device,
+                        fp16=args.fp16,
+                        batch_size=args.batch_size,
+                        max_latency=args.batch_latency,
+                        backend=args.backend,
+                    )
+                transcribers[model_name] = chunked, batched
+            return transcribers[model_name]
+
+    def transcribe_params_for(model_name):
+        params = {"model_name": model_name, "language": args.language, "fp16": args.fp16, "vad": args.vad}
+        if args.backend != "whisper":
+            params["backend"] = args.backend
+        if args.chunk_workers > 1:
+            params["chunk_length"] = args.chunk_length
+            params["chunk_overlap"] = args.chunk_overlap
+        elif args.batch_size > 1:
+            params["batched"] = True
+        return params
+
+    pdf_renderer = None
+    formats = []
+    if "render" in stages:
+        if args.pdf or args.combined_pdf:
+            from utils.generate_PDF import PdfBatchRenderer
+
+            pdf_renderer = PdfBatchRenderer(
+                workers=args.pdf_workers,
+                page_numbers=True,
+                separate=args.pdf,
+                combine=args.combined_pdf is not None,
+            )
+        formats = [name for name, requested in (("txt", args.txt), ("vtt", args.vtt), ("srt", args.srt), ("json", args.json), ("pdf", args.pdf)) if requested]
+
+    index = None
+    if "index" in stages and args.index:
+        if args.worker:
+            # The search index is written in WAL mode, which only works for processes on the same machine
+            logger.info("Workers don't add the VOs to the search index, run 'main.py index' when the queue is drained")
+        else:
+            index = SearchIndex(os.path.join(args.output_folder, INDEX_FILE))
+
+    # The ledger records the finished stages of every VO, so that a restarted run only does the missing work
+    ledger = RunLedger(os.path.join(state_folder(args), "ledger.sqlite"))
+    for vo_data in vos_to_transcribe:
+        ledger.record_vo(vo_data)
+
+    def completed(vo_data, stage, params=None):
+        return None if args.redo else ledger.completed(vo_data, stage, params)
+
+    scheduler = None
+    rtf_table = None
+    if "transcribe" in stages and args.deadline is not None:
+        if args.worker:
+            logger.warning("--deadline is ignored by workers, they transcribe the tasks in the order they were queued")
+        else:
+            scheduler, rtf_table = create_scheduler(args, vos_to_transcribe, audios_output_folder)
+            if scheduler is not None:
+                models = scheduler.models
+
+    def model_for(vo_data):
+        return scheduler.model_for(vo_data) if scheduler is not None else args.model_name
+
+    def completed_transcription(vo_data, model_name):
+        # A transcription made with a more accurate model than the planned one is good as well
+        for name in reversed(models[models.index(model_name) :]):
+            transcribed = completed(vo_data, "transcribe", transcribe_params_for(name))
+            if transcribed is not None:
+                return transcribed
+        return None
+
+    duplicates_lock = threading.Lock()
 
+    def download_stage(vo_data):
+        transcribed = completed_transcription(vo_data, model_for(vo_data)) if "transcribe" in stages else None
+        if transcribed is not None:
+            logger.info("'%s' is already transcribed, skipping download", vo_data.vo_title)
+            return vo_data, None, transcribed
+
+        pcm_path = os.path.join(audios_output_folder, vo_data.vo_title + PCM_EXTENSION)
+        if is_prepared(pcm_path):
+            logger.info("Audio of '%s' is already prepared, skipping download", vo_data.vo_title)
+            return vo_data, pcm_path, None
+
+        downloaded = completed(vo_data, "download")
+        if downloaded is not None:
+            logger.info("'%s' is already downloaded, skipping download", vo_data.vo_title)
+            return vo_data, downloaded["path"], None
+
+        # If a recording of about the same length was downloaded before, the beginning of this one is fingerprinted
+        # to find out whether it is the same recording before downloading all of it
+        link = vo_data.vo_mp3_link or vo_data.vo_mp4_link
+        if fingerprints is not None and is_direct_link(link) and fingerprints.candidates(vo_data):
+            try:
+                with tracer.span("fingerprint", vo=vo_data.vo_title) as span:
+                    original = fingerprints.match(vo_data, fingerprint_link(link))
+                    span.set(duplicate=original is not None)
+            except Exception as e:
+                logger.warning("Could not fingerprint '%s', downloading it: %s", vo_data.vo_title, e)
+                original = None
+            if original is not None:
+                logger.info("'%s' is a copy of '%s' (same audio), skipping download", vo_data.vo_title, original.vo_title)
+                with duplicates_lock:
+                    duplicates.append((vo_data, original))
+                return SKIP
+
+        with tracer.span("download", logging.INFO, vo=vo_data.vo_title) as span:
+            path = download_vo(vo_data, os.path.join(audios_output_folder, vo_data.vo_title), downloader)
+            span.set(bytes=os.path.getsize(path))
+        ledger.finish(vo_data, "download", path, seconds=span.seconds)
+        return vo_data, path, None
+
+    def prepare_stage(item):
+        vo_data, path, transcribed = item
+        if path is None:
+            return item
+
+        pcm_path = path
+        if not path.endswith(PCM_EXTENSION):
+            with tracer.span("audio_decode", logging.INFO, vo=vo_data.vo_title) as span:
+                pcm_path = prepare_audio(path, os.path.splitext(path)[0] + PCM_EXTENSION)
+                span.set(audio_seconds=read_pcm_header(pcm_path)["samples"] / SAMPLE_RATE)
+            ledger.finish(vo_data, "prepare", pcm_path, seconds=span.seconds)
+            if args.delete_audios:
+                logger.debug("Deleting downloaded file '%s'", path)
+                os.remove(path)
+
+        # Later copies of this recording are recognized by the fingerprint
+        if fingerprints is not None and vo_data not in fingerprints:
+            with tracer.span("fingerprint", vo=vo_data.vo_title):
+                fingerprints.add(vo_data, fingerprint(open_pcm(pcm_path)))
+        return vo_data, pcm_path, None
+
+    def transcribe_stage(item):
+        vo_data, audio_path, transcribed = item
+        if transcribed is not None:
+            logger.info("Loading transcription of '%s' from '%s'", vo_data.vo_title, transcribed["path"])
+            if scheduler is not None:
+                scheduler.finished(vo_data)
+            return vo_data, SegmentStore.load(transcribed["path"]), transcribed["checksum"]
+
+        model_name = scheduler.start(vo_data) if scheduler is not None else args.model_name
+        chunked, batched = transcribers_for(model_name)
+
+        writers = None
+        if args.command == "run" and args.stream:
+            writers = open_segment_writers(vo_data, transcription_output_folder, txt=args.txt, vtt=args.vtt, srt=args.srt)
+
+        audio_seconds = vo_data.duration.total_seconds()
+        if is_prepared(audio_path):
+            audio_seconds = read_pcm_header(audio_path)["samples"] / SAMPLE_RATE
+        with tracer.span("transcribe", logging.INFO, vo=vo_data.vo_title, audio_seconds=audio_seconds) as span, writers or contextlib.nullcontext():
+            segments, info = transcribe_vo(
+                audio_path=audio_path,
+                language=args.language,
+                model_name=model_name,
+                verbose=args.verbose,
+                device=args.device,
+                fp16=args.fp16,
+                model_slot=worker_index(),
+                cache=cache,
+                chunked=chunked,
+                vad=args.vad,
+                on_segment=writers.write if writers is not None else None,
+                batched=batched,
+                backend=args.backend,
+                window_length=window_length,
+            )
+            span.set(segments=len(segments))
+
+        store = SegmentStore.from_segments(segments)
+        store_path = os.path.join(transcription_output_folder, vo_data.vo_title + STORE_EXTENSION)
+        store.save(store_path)
+        source = ledger.finish(vo_data, "transcribe", store_path, transcribe_params_for(model_name), seconds=span.seconds)
+        for writer in writers.writers if writers is not None else []:
+            ledger.finish(vo_data, writer.name.lower(), writer.output_file, {"source": source})
+
+        if scheduler is not None:
+            # Transcriptions from the cache say nothing about the speed of the model
+            if not info["cached"]:
+                seconds = span.seconds - info["load_seconds"]
+                rtf_table.observe(model_name, audio_seconds, seconds, args.chunk_workers, args.transcribe_workers)
+            scheduler.finished(vo_data)
+
+        if args.delete_audios:
+            logger.debug("Deleting audio file '%s'", audio_path)
+            os.remove(audio_path)
+        return vo_data, store, source
+
+    def load_stage(vo_data):
+        store_path = os.path.join(transcription_output_folder, vo_data.vo_title + STORE_EXTENSION)
+        logger.info("Loading transcription of '%s' from '%s'", vo_data.vo_title, store_path)
+        return vo_data, SegmentStore.load(store_path), hash_file(store_path)
+
+    def render_stage(item):
+        vo_data, store, source = item
+        params = {"source": source}
+        missing = [name for name in formats if completed(vo_data, name, params) is None]
+        if not missing and args.combined_pdf is None:
+            logger.info("Every output of '%s' is already generated", vo_data.vo_title)
+            return item
+
+        with tracer.span("render", logging.INFO, vo=vo_data.vo_title, formats=",".join(missing), segments=len(store)):
+            future = render_vo(
+                segments=store,
+                vo_data=vo_data,
+                output_folder=transcription_output_folder,
+                txt="txt" in missing,
+                vtt="vtt" in missing,
+                srt="srt" in missing,
+                pdf="pdf" in missing or args.combined_pdf is not None,
+                pdf_page_numbers=True,
+                json="json" in missing,
+                pdf_renderer=pdf_renderer,
+                pdf_file="pdf" in missing,
+                save_store=False,
+            )
+
+        path = os.path.join(transcription_output_folder, vo_data.vo_title)
+        for name in missing:
+            if name != "pdf":
+                ledger.finish(vo_data, name, f"{path}.{name}", params)
+
+        def pdf_done(future=None):
+            if future is None or future.exception() is None:
+                ledger.finish(vo_data, "pdf", path + ".pdf", params)
+
+        if "pdf" in missing:
+            if future is None:
+                pdf_done()
+            elif args.worker:
+                # The task of the VO is only finished once its pdf is generated, a failed pdf fails the task
+                future.result()
+                pdf_done()
+            else:
+                future.add_done_callback(pdf_done)
+        return item
+
+    def index_stage(item):
+        vo_data, store, source = item
+        with tracer.span("index", vo=vo_data.vo_title, segments=len(store)) as span:
+            span.set(indexed=index.add(vo_data, store, source))
+        return item
+
+    # Download, transcribe and render the VOs in a pipeline
+    pipeline = []
+    if "download" in stages:
+        downloader = Downloader(
+            workers=args.download_workers,
+            parallel_chunks=args.download_chunks,
+            retries=args.download_retries,
+        )
+        # Limits the number of audio files that are downloaded but not transcribed yet
+        pending_audios = threading.BoundedSemaphore(max(1, args.max_pending_audios))
+        pipeline.append(Stage("download", download_stage, workers=args.download_workers, queue_size=1, acquire=pending_audios))
+        pipeline.append(Stage("prepare", prepare_stage, workers=1, queue_size=1))
+    if "transcribe" in stages:
+        pipeline.append(Stage("transcribe", transcribe_stage, workers=args.transcribe_workers, queue_size=2, release=pending_audios))
+    if "load" in stages:
+        pipeline.append(Stage("load", load_stage, workers=1, queue_size=1))
+    if "render" in stages:
+        pipeline.append(Stage("render", render_stage, workers=args.render_workers, queue_size=1))
+    if index is not None:
+        pipeline.append(Stage("index", index_stage, workers=1, queue_size=1))
+    logger.info("Running stages: %s", ", ".join(stage.name for stage in pipeline))
+
+    if args.worker:
+        from utils.task_queue import QUEUE_FOLDER, TaskQueue
+
+        # The VOs are queued as tasks in the output folder, every worker (on this or another machine) that shares the
+        # folder leases tasks from the queue until it is drained
+        tasks = TaskQueue(
+            os.path.join(args.output_folder, QUEUE_FOLDER, args.command),
+            lease_timeout=args.lease_timeout,
+            retries=args.task_retries,
+        )
+        queued = [vo_data.vo_title for vo_data in vos_to_transcribe if tasks.add(RunLedger.key(vo_data), json.loads(vo_data.json()), redo=args.redo)]
+        if queued:
+            logger.info("Queued tasks: \n%s", "\n".join([20 * " " + title for title in queued]))
+        if len(queued) < len(vos_to_transcribe):
+            logger.info("%d VO(s) are already queued or finished (--redo queues finished VOs again)", len(vos_to_transcribe) - len(queued))
+        leased = {}
+        # Only as many tasks are leased as the stages work on at the same time plus the one that is downloaded next,
+        # the other tasks stay in the queue for the other workers
+        lease_slots = threading.BoundedSemaphore(max(stage.workers for stage in pipeline) + 1)
+
+        def leased_vos():
+            while lease_slots.acquire():
+                task = next(tasks.tasks(), None)
+                if task is None:
+                    return
+                vo_data = VoData.parse_obj(task["payload"])
+                ledger.record_vo(vo_data)
+                # Stages the worker that held the task before finished are not redone
+                ledger.restore(vo_data, task.get("stages", []), args.output_folder)
+                leased[id(vo_data)] = task
+                yield vo_data
+
+        def stage_finished(vo_data):
+            task = leased.get(id(vo_data))
+            if task is not None:
+                tasks.record(task, ledger.stage_records(vo_data, args.output_folder))
+
+        def task_finished(vo_data, ok):
+            lease_slots.release()
+            task = leased.pop(id(vo_data))
+            if ok:
+                tasks.complete(task)
+            else:
+                tasks.fail(task, f"A stage failed on worker '{tasks.worker}'")
+
+        ledger.on_finish = stage_finished
+        run_pipeline(leased_vos(), pipeline, on_finished=task_finished)
+        ledger.on_finish = None
+        tasks.close()
+    elif scheduler is not None:
+        run_pipeline(scheduler, pipeline, on_finished=lambda vo_data, ok: scheduler.finished(vo_data))
+    else:
+        run_pipeline(vos_to_transcribe, pipeline)
+
+    if duplicates:
+        # The copies get the transcription (and outputs) of the VO they are a copy of under their own title
+        downloads = {ledger.key(vo_data): record for vo_data, record in ledger.records("download")}
+        copies = []
+        saved_bytes = 0
+        saved_seconds = 0.0
+        for duplicate, original in duplicates:
+            saved_bytes += downloads.get(ledger.key(original), {}).get("size") or 0
+            if "transcribe" not in stages:
+                continue
+            transcribed = completed_transcription(original, models[0])
+            if transcribed is None:
+                logger.warning("'%s' is not transcribed, so its copy '%s' isn't either", original.vo_title, duplicate.vo_title)
+                continue
+            store_path = os.path.join(transcription_output_folder, duplicate.vo_title + STORE_EXTENSION)
+            if os.path.abspath(transcribed["path"]) != os.path.abspath(store_path):
+                shutil.copyfile(transcribed["path"], store_path)
+            ledger.record_vo(duplicate)
+            ledger.finish(duplicate, "transcribe", store_path, transcribed["params"], seconds=0.0)
+            saved_seconds += transcribed["seconds"] or 0.0
+            copies.append(duplicate)
+
+        logger.info(
+            "%d VO(s) are copies of other VOs, not downloading and transcribing them saved %.1f MB and %s of transcription",
+            len(duplicates),
+            saved_bytes / 2**20,
+            str(timedelta(seconds=round(saved_seconds))),
+        )
+        if copies and "render" in stages:
+            pipeline = [Stage("load", load_stage, workers=1, queue_size=1)]
+            pipeline.append(Stage("render", render_stage, workers=args.render_workers, queue_size=1))
+            if index is not None:
+                pipeline.append(Stage("index", index_stage, workers=1, queue_size=1))
+            logger.info("Generating the outputs of the copies: \n%s", "\n".join([20 * " " + vo.vo_title for vo in copies]))
+            run_pipeline(copies, pipeline)
+
+    if pdf_renderer is not None:
+        pdf_failures = pdf_renderer.close()
+        if pdf_failures:
+            logger.error(
+                "%d PDF(s) could not be generated: \n%s", len(pdf_failures), "\n".join(20 * " " + title for title, _ in pdf_failures)
+            )
+        if args.combined_pdf:
+            try:
+                pdf_renderer.write_combined(args.combined_pdf)
+            except Exception as e:
+                logger.error("Could not generate the combined PDF '%s': %s", args.combined_pdf, e)
+
+    if "transcribe" in stages:
+        model_cache.clear()
+        for chunked, batched in transcribers.values():
+            if chunked is not None:
+                chunked.close()
+            if batched is not None:
+                batched.close()
+                batched.log_stats()
+        if cache is not None:
+            cache.log_stats()
+    if index is not None:
+        index.close()
+    if fingerprints is not None:
+        fingerprints.close()
+    ledger.log_stats()
+    ledger.close()
+    if "transcribe" in stages:
+        logger.info("Finished transcribing VOs (loading models took %s in total)", str(timedelta(seconds=model_cache.load_seconds)))
+
+
+def add_selection_arguments(parser: argparse.ArgumentParser):
+    """
+    Arguments that select the VOs a command works on.
+    """
     # Data format
-    parser.add_argument("--uni", choices=["uw", "tu"], required=True, help="Which university is the data from")
+    parser.add_argument("--uni", choices=["uw", "tu"], default=None, help="Which university is the data from")
 
     # Download data
     vo_data_links = parser.add_mutually_exclusive_group()
@@ -182,14 +1141,83 @@ if __name__ == "__main__":
         help="path to the file where the VO-data is stored, this path is not influenced by the -i/--input-folder argument",
     )
     vo_data_links.add_argument("--data-link", "-k", type=str, default=None, help="link to the VO-Data of u:space")
+    vo_data_links.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="path to a JSON file that lists several feeds (link or path, each with its --uni and optionally its VOs and "
+        "series), they are fetched concurrently and their VOs are transcribed in one run",
+    )
+    parser.add_argument("--feed-workers", type=int, default=4, help="number of feeds of --manifest that are fetched at the same time")
+    parser.add_argument(
+        "--feed-rate",
+        type=float,
+        default=2.0,
+        help="maximum number of feed requests per second to the same server when fetching the feeds of --manifest",
+    )
     parser.add_argument(
         "--vos",
         action="append",
         type=str,
         help="Titels of the VOs which shall be transcribed. If this argument is not set, no VOs will be transcribed.",
     )
+    parser.add_argument("--series", action="append", type=str, help="Titles of series whose VOs shall be transcribed")
+    parser.add_argument(
+        "--catalog",
+        nargs="?",
+        const="",
+        default=None,
+        help="use a local catalog of the VO-data (defaults to 'catalog.sqlite' in the output folder), it is synced with -k/-p",
+    )
+    parser.add_argument("--full-sync", action="store_true", help="if set every page of the VO-data is fetched when syncing the catalog")
+    parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        default=None,
+        help="only VOs recorded at or after this date (YYYY-MM-DD[THH:MM]), requires --catalog",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.fromisoformat,
+        default=None,
+        help="only VOs recorded before this date (YYYY-MM-DD[THH:MM]), requires --catalog",
+    )
+    parser.add_argument(
+        "--vos-pattern",
+        type=str,
+        default=None,
+        help="only VOs whose title matches this pattern ('*' matches any text, '?' one character), requires --catalog",
+    )
+
+
+def add_download_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--download-workers", type=int, default=1, help="number of VOs that are downloaded at the same time")
+    parser.add_argument(
+        "--download-chunks",
+        type=int,
+        default=1,
+        help="number of parallel range requests a single large file is split into while downloading",
+    )
+    parser.add_argument("--download-retries", type=int, default=5, help="how often a failed download is retried/resumed")
+    parser.add_argument(
+        "--max-pending-audios",
+        type=int,
+        default=2,
+        help="maximum number of audios that are downloaded but not transcribed yet, downloading pauses when it is reached",
+    )
+    parser.add_argument(
+        "--delete-audios",
+        action="store_true",
+        help="if set the downloaded files are deleted after their audio was prepared and the prepared audios after they were transcribed",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="if set copies of a VO (same recording under another title) are downloaded and transcribed like every other VO",
+    )
+
 
-    # Transcribe options
+def add_transcribe_arguments(parser: argparse.ArgumentParser):
     parser.add_argument("--model-name", "-m", type=str, default="tiny", help="which whisper model shall be used for transcribing")
     parser.add_argument(
         "--language",
@@ -198,13 +1226,134 @@ if __name__ == "__main__":
         default="de",
         help="language which shall be used for transcribing (defaults to 'de' for german)",
     )
+    parser.add_argument("--device", type=str, default="cpu", help="device the whisper model shall run on (e.g. 'cpu' or 'cuda')")
+    parser.add_argument("--fp16", action="store_true", help="if set the whisper model will run in half precision (only useful on GPUs)")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="whisper",
+        choices=list(BACKENDS),
+        help="engine that runs the whisper model: 'whisper' (openai-whisper), 'whisper-int8' (openai-whisper with int8 "
+        "weights, CPU only) or 'faster-whisper' (needs the package faster-whisper, int8 on the CPU)",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=parse_deadline,
+        default=None,
+        help="time by which every selected VO shall be transcribed, from now ('90m', '2h', '1h30m') or as date and time "
+        "(YYYY-MM-DDTHH:MM): every VO gets the most accurate model between --min-model and -m that still meets it",
+    )
+    parser.add_argument("--min-model", choices=MODEL_SIZES, default="tiny", help="fastest model --deadline may choose")
+    parser.add_argument(
+        "--priority",
+        action="append",
+        metavar="TITLE",
+        help="title of a VO that --deadline transcribes first and with the best model (can be used multiple times)",
+    )
+    parser.add_argument(
+        "--recalibrate",
+        action="store_true",
+        help="if set the speed of the models is measured again, otherwise --deadline uses the speed measured in earlier runs",
+    )
+    parser.add_argument(
+        "--model-cache-size",
+        type=int,
+        default=None,
+        help="maximum memory (in MB) the loaded whisper models may take up, least recently used models get evicted",
+    )
+    parser.add_argument(
+        "--vad",
+        action="store_true",
+        help="if set silence and non-speech are detected and skipped before transcribing (timestamps are not affected)",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=None,
+        help="memory (in MB, without the model) one transcription may use for audio, the recording is transcribed in "
+        "windows that fit into it (without a budget it is transcribed in one pass, with --stream in windows of 5 minutes)",
+    )
+    parser.add_argument(
+        "--chunk-workers",
+        type=int,
+        default=1,
+        help="if bigger than 1, every VO is split into chunks that are transcribed by this many processes in parallel",
+    )
+    parser.add_argument("--chunk-length", type=float, default=600, help="target length of a chunk in seconds (split at silence)")
+    parser.add_argument("--chunk-overlap", type=float, default=5, help="seconds every chunk overlaps with its neighbours")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="if bigger than 1, the 30 second windows of the VOs (of all transcribe workers) are decoded in batches of this size",
+    )
+    parser.add_argument(
+        "--batch-latency",
+        type=float,
+        default=1.0,
+        help="seconds a window waits at most for its batch to fill up (only with --batch-size)",
+    )
     parser.add_argument("--verbose", "-v", action="store_true", help="does print the ouput of the transcribtion to the console")
+    parser.add_argument(
+        "--transcribe-workers",
+        type=int,
+        default=1,
+        help="number of VOs that are transcribed at the same time (every worker loads its own model)",
+    )
+
+    # Cache options
+    parser.add_argument(
+        "--cache-folder",
+        type=str,
+        default=None,
+        help="folder where finished transcriptions are cached (defaults to 'cache' in the output folder)",
+    )
+    parser.add_argument("--cache-size", type=int, default=2048, help="maximum size of the transcription cache in MB (0 for no limit)")
+    parser.add_argument("--no-cache", action="store_true", help="if set transcriptions are neither looked up in nor stored to the cache")
+
+
+def add_render_arguments(parser: argparse.ArgumentParser):
     parser.add_argument("--txt", action="store_true", help="if set the audios will be transcibed to txt")
     parser.add_argument("--vtt", action="store_true", help="if set the audios will be transcibed to vtt")
     parser.add_argument("--srt", action="store_true", help="if set the audios will be transcibed to srt")
 
+    parser.add_argument("--json", action="store_true", help="if set the audios will be transcibed to json (segments with timestamps)")
+
     # PDF options
     parser.add_argument("--pdf", action="store_true", help="if set the audios will be transcibed to pdfs with page numbers")
+    parser.add_argument(
+        "--combined-pdf",
+        type=str,
+        default=None,
+        help="path of a pdf that combines every transcribed VO (with bookmarks and a table of contents)",
+    )
+    parser.add_argument("--pdf-workers", type=int, default=None, help="number of pdfs that are converted at the same time (defaults to the number of CPU cores)")
+    parser.add_argument("--render-workers", type=int, default=1, help="number of VOs whose output files are generated at the same time")
+
+
+def add_output_arguments(parser: argparse.ArgumentParser):
+    # Instrumentation
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        const="",
+        default=None,
+        help="appends a span for every step (download, transcription, rendering, ...) to this JSON-lines file "
+        "(defaults to 'trace.jsonl' in the output folder)",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="?",
+        const="",
+        default=None,
+        help="writes the time spent per step as Prometheus textfile at the end of the run (defaults to 'metrics.prom' in the output folder)",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=SPANS,
+        default=None,
+        help="profiles every span of the given step with cProfile and saves the profile as 'profile-<step>.prof' in the output folder",
+    )
 
     # Output options
     parser.add_argument(
@@ -214,22 +1363,141 @@ if __name__ == "__main__":
         help="outputfolder where every ouput (audios and transcriptions) shall be stored",
     )
 
-    args = parser.parse_args()
+
+def add_worker_arguments(parser: argparse.ArgumentParser):
+    """
+    Arguments of the distributed mode, in which several processes (on several machines) share the work.
+    """
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="if set the selected VOs are queued as tasks in the output folder and this process works on the queued tasks "
+        "(also the ones other workers sharing the output folder queued) until the queue is drained, without -k/-p/--catalog "
+        "it only works on queued tasks",
+    )
+    parser.add_argument(
+        "--lease-timeout",
+        type=float,
+        default=300,
+        help="seconds after which the task of a worker that stopped renewing its lease (e.g. because it crashed) is queued again",
+    )
+    parser.add_argument("--task-retries", type=int, default=2, help="how often a failed task is queued again before it is given up")
+    parser.add_argument(
+        "--state-folder",
+        default=None,
+        help="folder on the local disk for the run ledger and the fingerprints of this worker (defaults to a folder in "
+        "~/.cache/VO-Transcriber), workers must not share it",
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Transcribe audio files to text",
+        epilog="Without a command 'run' is used, e.g. 'main.py --uni tu -k <link> --vos <title> --txt'.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    def command(name: str, help_text: str, *groups):
+        subparser = commands.add_parser(name, help=help_text, description=help_text)
+        for add_arguments in groups:
+            add_arguments(subparser)
+        return subparser
+
+    command("list", "lists the titles of the selected VOs (of every VO if none is selected)", add_selection_arguments, add_output_arguments)
+    subparser = command(
+        "download",
+        "downloads the selected VOs and prepares their audio",
+        add_selection_arguments,
+        add_download_arguments,
+        add_worker_arguments,
+        add_output_arguments,
+    )
+    subparser.add_argument("--redo", action="store_true", help="if set every stage is done again, even if the run ledger records it as completed")
+    subparser = command(
+        "transcribe",
+        "downloads and transcribes the selected VOs (the segments are saved as .segs files)",
+        add_selection_arguments,
+        add_download_arguments,
+        add_transcribe_arguments,
+        add_worker_arguments,
+        add_output_arguments,
+    )
+    subparser.add_argument("--redo", action="store_true", help="if set every stage is done again, even if the run ledger records it as completed")
+    subparser = command(
+        "render",
+        "generates the output files of the selected VOs from their saved transcriptions",
+        add_selection_arguments,
+        add_render_arguments,
+        add_worker_arguments,
+        add_output_arguments,
+    )
+    subparser.add_argument("--redo", action="store_true", help="if set every output is generated again, even if the run ledger records it as completed")
+    subparser = command(
+        "run",
+        "downloads, transcribes and renders the selected VOs and adds them to the search index",
+        add_selection_arguments,
+        add_download_arguments,
+        add_transcribe_arguments,
+        add_render_arguments,
+        add_worker_arguments,
+        add_output_arguments,
+    )
+    subparser.add_argument(
+        "--stream",
+        action="store_true",
+        help="if set the txt/vtt/srt files are written segment by segment while the VO is transcribed",
+    )
+    subparser.add_argument("--index", action="store_true", help="if set the transcribed VOs are added to the search index")
+    subparser.add_argument("--redo", action="store_true", help="if set every stage is done again, even if the run ledger records it as completed")
+    subparser = command("index", "adds every transcribed VO to the search index (VOs that did not change are skipped)", add_output_arguments)
+    subparser.add_argument("--rebuild", action="store_true", help="if set every VO is indexed again")
+    subparser = command("search", "searches the transcriptions for words and phrases (in double quotes)", add_output_arguments)
+    subparser.add_argument("query", nargs="+", help="words (a trailing '*' matches every word it prefixes) and phrases in double quotes")
+    subparser.add_argument("--limit", type=int, default=20, help="maximum number of VOs shown")
+    subparser.add_argument("--hits", type=int, default=5, help="maximum number of times shown per VO")
+    subparser.add_argument("--json", action="store_true", help="if set the results are printed as JSON")
+    return parser
+
+
+if __name__ == "__main__":
+    # Setup argparse
+    parser = build_parser()
+    argv = sys.argv[1:]
+    if argv and argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+        # Calls from before the commands existed run everything
+        argv.insert(0, "run")
+    args = parser.parse_args(argv)
 
     if not os.path.isdir(args.output_folder):
         parser.error("Output folder does not exist: " + args.output_folder)
+    pure_worker = getattr(args, "worker", False) and args.data_path is None and args.data_link is None
+    if "uni" in args and args.uni is None and args.manifest is None and not pure_worker:
+        parser.error("the following arguments are required: --uni (only --manifest and workers that don't queue VOs can omit it)")
+    if "uni" in args and args.catalog is None and (args.since or args.until or args.vos_pattern):
+        parser.error("--since, --until and --vos-pattern require --catalog")
 
     # Setup logging
     logger = logging.getLogger("VO-Transcriber")
     logger.setLevel(logging.DEBUG)
     fh = logging.FileHandler(os.path.join(args.output_folder, "VO-Transcriber.log"))
     ch = logging.StreamHandler()
+    # The output of list and search is printed, the console only shows problems then
+    ch.setLevel(logging.WARNING if args.command in ("list", "search") else logging.DEBUG)
     formatter = logging.Formatter(fmt="%(asctime)s %(levelname)-8s %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
     fh.setFormatter(formatter)
     ch.setFormatter(formatter)
     logger.addHandler(fh)
     logger.addHandler(ch)
 
-    logger.warning("Starting script")
-    main(args)
-    logger.warning("Finished script")
+    tracer.configure(
+        trace_path=None if args.trace is None else args.trace or os.path.join(args.output_folder, "trace.jsonl"),
+        metrics_path=None if args.metrics is None else args.metrics or os.path.join(args.output_folder, "metrics.prom"),
+        profile_span=args.profile,
+        profile_path=os.path.join(args.output_folder, f"profile-{args.profile}.prof") if args.profile else None,
+    )
+
+    logger.info("Starting script")
+    {"list": list_vos, "index": index_vos, "search": search_vos}.get(args.command, main)(args)
+    tracer.log_summary()
+    tracer.close()
+    logger.info("Finished script")
@@ -1,7 +1,10 @@
 from datetime import datetime, timedelta
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, root_validator
 
 class VoData(BaseModel):
+    vo_id: str | None = None
     vo_mp4_link: str = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
     vo_mp3_link: str | None = None
     vo_title: str = "-"
@@ -10,3 +13,20 @@ class VoData(BaseModel):
     series_title: str = "-"
     duration: timedelta = timedelta(seconds=0)
     recorded_on: datetime = datetime.now()
+
+class VoFeed(BaseModel):
+    uni: Literal["uw", "tu"]
+    link: str | None = None
+    path: str | None = None
+    vos: list[str] | None = None
+    series: list[str] | None = None
+
+    @root_validator(skip_on_failure=True)
+    def check_source(cls, values):
+        if (values.get("link") is None) == (values.get("path") is None):
+            raise ValueError("a feed needs either a link or a path")
+        return values
+
+    @property
+    def source(self) -> str:
+        return self.link or self.path
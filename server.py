@@ -0,0 +1,479 @@
+import argparse
+import json
+import logging
+import mimetypes
+import multiprocessing
+import os
+import re
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+from models.VoDataModels import VoData
+from utils.backends import BACKENDS
+from utils.catalog import Catalog
+from utils.job_queue import JobQueue
+from utils.search_index import INDEX_FILE, SearchIndex
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+FORMATS = ("txt", "vtt", "srt", "json", "pdf")
+JOB_OPTIONS = {"model_name", "language", "vad", *FORMATS}
+PROGRESS_INTERVAL = 2.0
+
+
+def setup_logging(output_folder: str):
+    logger.setLevel(logging.DEBUG)
+    fh = logging.FileHandler(os.path.join(output_folder, "VO-Transcriber.log"))
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter(fmt="%(asctime)s %(levelname)-8s %(processName)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    fh.setFormatter(formatter)
+    ch.setFormatter(formatter)
+    logger.addHandler(fh)
+    logger.addHandler(ch)
+
+
+def run_job(queue: JobQueue, job: dict, output_folder: str, settings: dict, cache, downloader, index=None) -> dict:
+    """
+    Downloads, transcribes and renders the VO of the given job (the same steps main.py runs for every VO).
+    :param queue:           The JobQueue the stage and progress of the job are reported to
+    :param job:             The job to run
+    :param output_folder:   The folder the audios and transcriptions are saved to
+    :param settings:        Settings of the worker (device, fp16)
+    :param cache:           The TranscriptionCache to use (None disables caching)
+    :param downloader:      The Downloader to use
+    :param index:           The SearchIndex the transcription is added to (None doesn't index it)
+    :return:                The generated output files (format -> path)
+    """
+    from main import download_vo, render_vo, transcribe_vo
+    from utils.audio import PCM_EXTENSION, is_prepared, prepare_audio
+    from utils.cache import hash_file
+    from utils.segment_store import STORE_EXTENSION, SegmentStore
+
+    vo_data = VoData.parse_obj(job["vo_data"])
+    options = job["options"]
+    audios_output_folder = os.path.join(output_folder, "audios")
+    transcription_output_folder = os.path.join(output_folder, "transcriptions")
+
+    pcm_path = os.path.join(audios_output_folder, vo_data.vo_title + PCM_EXTENSION)
+    if not is_prepared(pcm_path):
+        queue.update(job["id"], stage="download")
+        path = download_vo(vo_data, os.path.join(audios_output_folder, vo_data.vo_title), downloader)
+        queue.update(job["id"], stage="prepare")
+        prepare_audio(path, pcm_path)
+        os.remove(path)
+
+    queue.update(job["id"], stage="transcribe")
+    duration = max(vo_data.duration.total_seconds(), 1.0)
+    last_update = time.monotonic()
+
+    def progress(segment):
+        nonlocal last_update
+        if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+            queue.update(job["id"], progress=min(segment["end"] / duration, 0.99))
+            last_update = time.monotonic()
+
+    segments, _ = transcribe_vo(
+        audio_path=pcm_path,
+        language=options["language"],
+        model_name=options["model_name"],
+        device=settings["device"],
+        fp16=settings["fp16"],
+        cache=cache,
+        backend=settings["backend"],
+        vad=options.get("vad", False),
+        progress=progress,
+        window_length=settings["window_length"],
+    )
+
+    queue.update(job["id"], stage="render")
+    store = SegmentStore.from_segments(segments)
+    render_vo(
+        segments=store,
+        vo_data=vo_data,
+        output_folder=transcription_output_folder,
+        txt=options["txt"],
+        vtt=options["vtt"],
+        srt=options["srt"],
+        pdf=options["pdf"],
+        pdf_page_numbers=True,
+        json=options["json"],
+    )
+    path = os.path.join(transcription_output_folder, vo_data.vo_title)
+    outputs = {name: f"{path}.{name}" for name in FORMATS if options[name]}
+    outputs["segs"] = path + STORE_EXTENSION
+    if index is not None:
+        queue.update(job["id"], stage="index")
+        index.add(vo_data, store, hash_file(outputs["segs"]))
+    return outputs
+
+
+def worker_main(index: int, db_path: str, output_folder: str, settings: dict, stop):
+    """
+    Entry point of a worker process. The heavy imports and the models are loaded once, then jobs are taken from the
+    queue until stop is set.
+    :param index:           Index of the worker
+    :param db_path:         Path to the job database
+    :param output_folder:   The folder the audios and transcriptions are saved to
+    :param settings:        Settings of the worker (device, fp16, backend, memory_budget, preload, cache_folder, cache_size, retries,
+                            poll_interval)
+    :param stop:            multiprocessing.Event that stops the worker after its current job
+    """
+    setup_logging(output_folder)
+    from utils.cache import TranscriptionCache
+    from utils.download import Downloader
+    from utils.transcribe import model_cache, window_length_for_budget
+
+    settings["window_length"] = None
+    if settings["memory_budget"] is not None:
+        settings["window_length"] = window_length_for_budget(settings["memory_budget"])
+    for model_name in settings["preload"]:
+        model_cache.get(model_name, device=settings["device"], fp16=settings["fp16"], backend=settings["backend"])
+    cache = None
+    if settings["cache_folder"] is not None:
+        cache = TranscriptionCache(settings["cache_folder"], max_size=settings["cache_size"])
+    downloader = Downloader()
+    search_index = SearchIndex(os.path.join(output_folder, INDEX_FILE))
+    queue = JobQueue(db_path)
+    logger.info("Worker %d is ready", index)
+
+    try:
+        while not stop.is_set():
+            job = queue.claim(index)
+            if job is None:
+                stop.wait(settings["poll_interval"])
+                continue
+
+            logger.info("Worker %d started job %d ('%s', priority %d)", index, job["id"], job["title"], job["priority"])
+            start = time.monotonic()
+            try:
+                outputs = run_job(queue, job, output_folder, settings, cache, downloader, search_index)
+            except Exception as e:
+                logger.exception("Job %d ('%s') failed", job["id"], job["title"])
+                queue.fail(job["id"], f"{type(e).__name__}: {e}", retries=settings["retries"])
+                continue
+            queue.finish(job["id"], outputs)
+            logger.info("Worker %d finished job %d ('%s') in %.1fs", index, job["id"], job["title"], time.monotonic() - start)
+    finally:
+        search_index.close()
+        queue.close()
+
+
+class WorkerPool:
+    """
+    Keeps a number of worker processes running. Workers that die are restarted and their running job is queued again.
+    """
+
+    def __init__(self, workers: int, db_path: str, output_folder: str, settings: dict):
+        self.workers = max(1, workers)
+        self.db_path = db_path
+        self.output_folder = output_folder
+        self.settings = settings
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        self._processes = [None] * self.workers
+        self._monitor = None
+
+    def _start(self, index: int):
+        process = self._context.Process(
+            target=worker_main,
+            args=(index, self.db_path, self.output_folder, self.settings, self._stop),
+            name=f"worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._start(index)
+        self._monitor = threading.Thread(target=self._watch, name="worker-monitor", daemon=True)
+        self._monitor.start()
+
+    def _watch(self):
+        queue = JobQueue(self.db_path)
+        while not self._stop.wait(5):
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    requeued = queue.requeue_running(worker=index)
+                    logger.error("Worker %d died (exit code %s), restarting it (%d job(s) queued again)", index, process.exitcode, requeued)
+                    self._start(index)
+        queue.close()
+
+    def alive(self) -> int:
+        return sum(process is not None and process.is_alive() for process in self._processes)
+
+    def stop(self, timeout: float = 10):
+        """
+        Stops the workers. Workers that don't finish their job within timeout seconds are terminated, their jobs are
+        queued again when the server starts the next time.
+        """
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the server:
+        GET    /health                      number of live workers and queued jobs
+        POST   /jobs                        submits jobs (one per VO), see README
+        GET    /jobs[?status=&limit=]       lists the jobs
+        GET    /jobs/<id>                   status, stage, progress and outputs of a job
+        DELETE /jobs/<id>                   cancels a queued job
+        GET    /jobs/<id>/result/<format>   downloads an output file of a finished job
+        GET    /search?q=[&limit=&hits=]    searches the transcriptions (words, prefixes and "phrases")
+    """
+
+    server_version = "VO-Transcriber"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, status: HTTPStatus, data):
+        body = json.dumps(data, default=str).encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: HTTPStatus, message: str):
+        self._send_json(status, {"error": message})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        queue = self.server.queue
+        if url.path == "/health":
+            return self._send_json(HTTPStatus.OK, {"workers": self.server.pool.alive(), "queued": queue.count("queued")})
+
+        if url.path == "/jobs":
+            query = parse_qs(url.query)
+            jobs = queue.list(status=query.get("status", [None])[0], limit=int(query.get("limit", ["100"])[0]))
+            return self._send_json(HTTPStatus.OK, {"jobs": [_summary(job) for job in jobs]})
+
+        if url.path == "/search":
+            query = parse_qs(url.query)
+            if not query.get("q"):
+                return self._error(HTTPStatus.BAD_REQUEST, "The query parameter q is required")
+            results = self.server.index.search(
+                query["q"][0],
+                limit=int(query.get("limit", ["20"])[0]),
+                hits_per_vo=int(query.get("hits", ["5"])[0]),
+            )
+            return self._send_json(HTTPStatus.OK, {"query": query["q"][0], "results": results})
+
+        if match := re.fullmatch(r"/jobs/(\d+)", url.path):
+            job = queue.get(int(match.group(1)))
+            if job is None:
+                return self._error(HTTPStatus.NOT_FOUND, "Job not found")
+            return self._send_json(HTTPStatus.OK, {**_summary(job), "position": queue.position(job["id"]), "vo_data": job["vo_data"]})
+
+        if match := re.fullmatch(r"/jobs/(\d+)/result/(\w+)", url.path):
+            job = queue.get(int(match.group(1)))
+            if job is None:
+                return self._error(HTTPStatus.NOT_FOUND, "Job not found")
+            path = job["outputs"].get(match.group(2))
+            if path is None or not os.path.isfile(path):
+                return self._error(HTTPStatus.NOT_FOUND, f"Job has no '{match.group(2)}' output (status: {job['status']})")
+            return self._send_file(path)
+
+        self._error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+
+    def _send_file(self, path: str):
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(os.path.basename(path))}")
+        self.end_headers()
+        with open(path, "rb") as f:
+            while block := f.read(2**16):
+                self.wfile.write(block)
+
+    def do_DELETE(self):
+        match = re.fullmatch(r"/jobs/(\d+)", urlparse(self.path).path)
+        if match is None:
+            return self._error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+        if not self.server.queue.cancel(int(match.group(1))):
+            return self._error(HTTPStatus.CONFLICT, "Only queued jobs can be cancelled")
+        self._send_json(HTTPStatus.OK, {"cancelled": int(match.group(1))})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/jobs":
+            return self._error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            jobs, missing = self.server.submit(request)
+        except (ValueError, TypeError, KeyError) as e:
+            return self._error(HTTPStatus.BAD_REQUEST, str(e))
+        self._send_json(HTTPStatus.CREATED, {"jobs": jobs, "missing": missing})
+
+
+def _summary(job: dict) -> dict:
+    return {key: job[key] for key in ("id", "title", "priority", "status", "stage", "progress", "attempts", "error", "outputs", "created_at", "started_at", "finished_at")}
+
+
+class TranscriptionServer(ThreadingHTTPServer):
+    """
+    HTTP server that turns requests into jobs of the JobQueue, which are run by the WorkerPool.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, queue: JobQueue, pool: WorkerPool, catalog_path: str, uni: str, defaults: dict, index: SearchIndex):
+        """
+        :param address:         (host, port) to listen on
+        :param queue:           The JobQueue
+        :param pool:            The WorkerPool that runs the jobs
+        :param catalog_path:    Path to the VO catalog the titles are looked up in
+        :param uni:             Default parser for VO-data ("uw" or "tu")
+        :param defaults:        Default options of the jobs
+        :param index:           The SearchIndex the workers add the transcriptions to
+        """
+        super().__init__(address, RequestHandler)
+        self.queue = queue
+        self.pool = pool
+        self.catalog_path = catalog_path
+        self.uni = uni
+        self.defaults = defaults
+        self.index = index
+        self._catalog_lock = threading.Lock()
+
+    def submit(self, request: dict) -> tuple[list, list]:
+        """
+        Queues one job for every VO selected by the request. The VOs are looked up in the catalog, which is synced with
+        the given data_link first.
+        :param request:     {"vos": [...], "series": [...], "vos_pattern": "...", "data_link": "...", "uni": "uw"|"tu",
+                            "priority": 0, "options": {...}}
+        :return:            The queued jobs (id and title) and the requested titles that were not found
+        """
+        titles = request.get("vos") or []
+        series = request.get("series") or []
+        pattern = request.get("vos_pattern")
+        if not (titles or series or pattern):
+            raise ValueError("At least one of vos, series or vos_pattern is required")
+        options = {**self.defaults, **request.get("options", {})}
+        unknown = set(options) - JOB_OPTIONS
+        if unknown:
+            raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+        priority = int(request.get("priority", 0))
+
+        with self._catalog_lock:
+            catalog = Catalog(self.catalog_path)
+            try:
+                if request.get("data_link"):
+                    catalog.sync_link(request["data_link"], request.get("uni", self.uni))
+                vos = catalog.select(titles=titles or None, series=series or None, pattern=pattern)
+            finally:
+                catalog.close()
+
+        jobs = [{"id": self.queue.submit(vo, options, priority), "title": vo.vo_title} for vo in vos]
+        missing = sorted(set(titles) - {vo.vo_title for vo in vos})
+        logger.info("Queued %d job(s) with priority %d", len(jobs), priority)
+        return jobs, missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs VO-Transcriber as a service with a local HTTP API and warm models")
+
+    parser.add_argument("--uni", choices=["uw", "tu"], required=True, help="Which university the VO-data is from (can be overridden per request)")
+    parser.add_argument("--data-link", "-k", type=str, default=None, help="link to the VO-Data that is synced into the catalog on startup")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="host the HTTP API listens on")
+    parser.add_argument("--port", type=int, default=8080, help="port the HTTP API listens on")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (every worker keeps its own models loaded)")
+    parser.add_argument("--model-name", "-m", type=str, default="tiny", help="default whisper model, it is loaded when a worker starts")
+    parser.add_argument("--language", "-l", type=str, default="de", help="default language of the VOs")
+    parser.add_argument("--device", type=str, default="cpu", help="device the whisper models run on (e.g. 'cpu' or 'cuda')")
+    parser.add_argument("--fp16", action="store_true", help="if set the whisper models run in half precision (only useful on GPUs)")
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="whisper",
+        choices=list(BACKENDS),
+        help="engine that runs the whisper models (see the --backend option of main.py)",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=None,
+        help="memory (in MB, without the model) one job may use for audio (see the --memory-budget option of main.py)",
+    )
+    parser.add_argument("--retries", type=int, default=1, help="how often a failed job is queued again")
+    parser.add_argument("--cache-size", type=int, default=2048, help="maximum size of the transcription cache in MB (0 for no limit)")
+    parser.add_argument("--no-cache", action="store_true", help="if set transcriptions are neither looked up in nor stored to the cache")
+    for name in FORMATS:
+        parser.add_argument(f"--{name}", action="store_true", help=f"if set jobs generate a {name} file unless the request says otherwise")
+    parser.add_argument(
+        "-o",
+        "--output_folder",
+        default="output",
+        help="outputfolder where every ouput (audios, transcriptions, job database) shall be stored",
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output_folder):
+        parser.error("Output folder does not exist: " + args.output_folder)
+
+    setup_logging(args.output_folder)
+    for folder in ("audios", "transcriptions"):
+        os.makedirs(os.path.join(args.output_folder, folder), exist_ok=True)
+
+    catalog_path = os.path.join(args.output_folder, "catalog.sqlite")
+    if args.data_link is not None:
+        catalog = Catalog(catalog_path)
+        try:
+            catalog.sync_link(args.data_link, args.uni)
+        except Exception as e:
+            logger.error("Could not sync the catalog: %s", e)
+        finally:
+            catalog.close()
+
+    db_path = os.path.join(args.output_folder, "jobs.sqlite")
+    queue = JobQueue(db_path)
+    requeued = queue.requeue_running()
+    if requeued:
+        logger.warning("Queued %d job(s) again that were running when the server stopped", requeued)
+
+    pool = WorkerPool(
+        workers=args.workers,
+        db_path=db_path,
+        output_folder=args.output_folder,
+        settings={
+            "device": args.device,
+            "fp16": args.fp16,
+            "backend": args.backend,
+            "memory_budget": args.memory_budget * 2**20 if args.memory_budget else None,
+            "preload": [args.model_name],
+            "cache_folder": None if args.no_cache else os.path.join(args.output_folder, "cache"),
+            "cache_size": args.cache_size * 2**20 if args.cache_size else None,
+            "retries": args.retries,
+            "poll_interval": 1.0,
+        },
+    )
+    defaults = {"model_name": args.model_name, "language": args.language, "vad": False}
+    defaults.update({name: getattr(args, name) for name in FORMATS})
+    if not any(defaults[name] for name in FORMATS):
+        defaults["txt"] = True
+
+    index = SearchIndex(os.path.join(args.output_folder, INDEX_FILE))
+    server = TranscriptionServer((args.host, args.port), queue, pool, catalog_path, args.uni, defaults, index)
+    pool.start()
+    logger.warning("Serving on http://%s:%d with %d worker(s)", args.host, args.port, pool.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.stop()
+        index.close()
+        queue.close()
+        logger.warning("Stopped server")
@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# The tests import the modules of the repository like main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
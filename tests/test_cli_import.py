@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that must only be imported by the commands that need them (see the lazy imports in main.py)
+HEAVY_MODULES = ["torch", "whisper", "numpy", "jinja2", "pdfkit", "youtube_dl"]
+
+
+def loaded_modules(statement: str) -> set[str]:
+    """
+    Runs the given statement in a fresh interpreter (from the root of the repository) and returns the heavy modules it
+    loaded. The heavy modules don't have to be installed: a module that is not installed can't be loaded either.
+    """
+    script = f"import sys\n{statement}\nprint('\\nloaded:', *(name for name in {HEAVY_MODULES!r} if name in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return set(result.stdout.splitlines()[-1].split()[1:])
+
+
+def test_import_main_loads_no_heavy_module():
+    assert loaded_modules("import main") == set()
+
+
+@pytest.mark.parametrize("command", ["list", "download", "transcribe", "render", "run", "index", "search"])
+def test_parsing_a_command_loads_no_heavy_module(command):
+    statement = f"import main\ntry:\n    main.build_parser().parse_args([{command!r}, '--help'])\nexcept SystemExit:\n    pass"
+    assert loaded_modules(statement) == set()
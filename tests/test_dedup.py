@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from models.VoDataModels import VoData
+from utils.audio import SAMPLE_RATE
+from utils.dedup import FingerprintStore, bit_error_rate, find_duplicates, fingerprint
+
+
+RECORDED_ON = datetime(2026, 10, 5, 9, 15, tzinfo=timezone.utc)
+
+
+def sound(seconds: float, seed: int) -> np.ndarray:
+    # Noise with a changing envelope stands in for speech
+    generator = np.random.default_rng(seed)
+    samples = generator.normal(0.0, 0.1, int(seconds * SAMPLE_RATE))
+    envelope = np.repeat(generator.uniform(0.2, 1.0, int(seconds * 4) + 1), SAMPLE_RATE // 4)[: len(samples)]
+    return (samples * envelope).astype(np.float32)
+
+
+def silence(seconds: float) -> np.ndarray:
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+
+
+def vo(vo_id: str, title: str = "Vorlesung", **fields) -> VoData:
+    fields.setdefault("author", "Prof. Muster")
+    fields.setdefault("duration", timedelta(minutes=90))
+    fields.setdefault("recorded_on", RECORDED_ON)
+    return VoData(vo_id=vo_id, vo_title=title, vo_mp4_link=f"https://example.org/{vo_id}.mp4", **fields)
+
+
+def store_with(tmp_path, original: VoData, audio: np.ndarray) -> FingerprintStore:
+    store = FingerprintStore(str(tmp_path / "fingerprints.sqlite"))
+    store.add(original, fingerprint(audio))
+    return store
+
+
+def test_copies_of_a_recording_match(tmp_path):
+    audio = sound(130, seed=1)
+    store = store_with(tmp_path, vo("1", series_title="Analysis"), audio)
+    # The copy is cut 0.3 seconds later and slightly quieter
+    copy = audio[int(0.3 * SAMPLE_RATE) :] * 0.8
+    assert store.match(vo("2", series_title="Analysis (Wiederholung)"), fingerprint(copy)).vo_id == "1"
+    store.close()
+
+
+def test_silent_recordings_dont_match(tmp_path):
+    store = store_with(tmp_path, vo("1"), silence(130))
+    assert store.match(vo("2"), fingerprint(silence(130))) is None
+    store.close()
+
+
+def test_recordings_that_start_with_the_same_dead_air_dont_match(tmp_path):
+    first = np.concatenate([silence(100), sound(30, seed=1)])
+    second = np.concatenate([silence(100), sound(30, seed=2)])
+    assert bit_error_rate(fingerprint(first), fingerprint(second)) > 0.35
+
+    store = store_with(tmp_path, vo("1"), first)
+    assert store.match(vo("2"), fingerprint(second)) is None
+    store.close()
+
+
+def test_same_audio_with_unrelated_metadata_doesnt_match(tmp_path):
+    audio = sound(130, seed=1)
+    store = store_with(tmp_path, vo("1", author="A", series_title="Analysis"), audio)
+    other = vo("2", author="B", series_title="Algebra", recorded_on=RECORDED_ON + timedelta(days=7))
+    assert store.match(other, fingerprint(audio)) is None
+    store.close()
+
+
+def test_weekly_lectures_with_the_same_title_are_not_copies():
+    first = vo("1")
+    next_week = vo("2", recorded_on=RECORDED_ON + timedelta(days=7))
+    reupload = vo("3", recorded_on=RECORDED_ON + timedelta(minutes=5), duration=timedelta(minutes=90, seconds=1))
+    kept, duplicates = find_duplicates([first, next_week, reupload])
+    assert kept == [first, next_week]
+    assert duplicates == [(reupload, first)]
+
+
+def test_vos_without_a_duration_are_not_copies():
+    first = vo("1", duration=timedelta(0))
+    second = vo("2", duration=timedelta(0))
+    assert find_duplicates([first, second]) == ([first, second], [])
+
+
+def test_vos_with_the_same_media_file_are_copies():
+    first = vo("1")
+    cross_listed = vo("2", series_title="Other series", recorded_on=RECORDED_ON + timedelta(days=30))
+    cross_listed.vo_mp4_link = first.vo_mp4_link
+    assert find_duplicates([first, cross_listed]) == ([first], [(cross_listed, first)])
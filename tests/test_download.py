@@ -0,0 +1,133 @@
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.download import Downloader
+
+
+CONTENT = bytes(range(256)) * 4096  # 1 MiB
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves CONTENT at every path. The server decides whether ranges are announced (Accept-Ranges on HEAD), whether
+    they are honoured (206) and after how many bytes the first GET is cut off.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CONTENT)))
+        if self.server.announce_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get("Range"))
+        first, last = 0, len(CONTENT) - 1
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        partial = match is not None and self.server.honour_ranges
+        if partial:
+            first = int(match.group(1))
+            last = int(match.group(2)) if match.group(2) else last
+        body = CONTENT[first : last + 1]
+
+        self.send_response(206 if partial else 200)
+        self.send_header("Content-Length", str(len(body)))
+        if partial:
+            self.send_header("Content-Range", f"bytes {first}-{last}/{len(CONTENT)}")
+        self.end_headers()
+        with self.server.lock:
+            cut_after, self.server.cut_after = self.server.cut_after, None
+        if cut_after is not None:
+            # The connection breaks in the middle of the body
+            self.wfile.write(body[:cut_after])
+            self.wfile.flush()
+            self.connection.close()
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    server.announce_ranges = True
+    server.honour_ranges = True
+    server.cut_after = None
+    server.ranges = []
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/lecture.mp4"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download(server, tmp_path):
+    path = str(tmp_path / "lecture.mp4")
+    assert Downloader(backoff=0.01).download(server.url, path) == len(CONTENT)
+    assert read(path) == CONTENT
+    assert not os.path.exists(path + ".part")
+
+
+def test_resumes_existing_part_file(server, tmp_path):
+    path = str(tmp_path / "lecture.mp4")
+    with open(path + ".part", "wb") as f:
+        f.write(CONTENT[:300_000])
+
+    Downloader(backoff=0.01).download(server.url, path)
+    assert read(path) == CONTENT
+    assert server.ranges == [f"bytes=300000-{len(CONTENT) - 1}"]
+
+
+def test_resumes_interrupted_download(server, tmp_path):
+    path = str(tmp_path / "lecture.mp4")
+    server.cut_after = 100_000
+
+    Downloader(backoff=0.01, block_size=2**12).download(server.url, path)
+    assert read(path) == CONTENT
+    assert len(server.ranges) == 2
+    # The second request continues where the first one broke off
+    resumed_at = int(re.fullmatch(r"bytes=(\d+)-\d*", server.ranges[1]).group(1))
+    assert 0 < resumed_at <= 100_000
+
+
+def test_server_without_range_support_restarts_from_the_beginning(server, tmp_path):
+    path = str(tmp_path / "lecture.mp4")
+    server.announce_ranges = False
+    server.honour_ranges = False
+    with open(path + ".part", "wb") as f:
+        f.write(b"x" * 300_000)
+
+    Downloader(backoff=0.01).download(server.url, path)
+    assert read(path) == CONTENT
+
+
+def test_split_download(server, tmp_path):
+    path = str(tmp_path / "lecture.mp4")
+    Downloader(parallel_chunks=4, min_chunk_size=2**18, backoff=0.01).download(server.url, path)
+    assert read(path) == CONTENT
+    assert len(server.ranges) == 4
+    assert not [name for name in os.listdir(tmp_path) if ".part" in name]
+
+
+def test_split_download_falls_back_when_ranges_are_ignored(server, tmp_path):
+    # The server announces ranges but answers every range request with the whole file (200)
+    path = str(tmp_path / "lecture.mp4")
+    server.honour_ranges = False
+
+    Downloader(parallel_chunks=4, min_chunk_size=2**18, backoff=0.01).download(server.url, path)
+    assert read(path) == CONTENT
+    assert not [name for name in os.listdir(tmp_path) if ".part" in name]
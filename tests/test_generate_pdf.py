@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("pdfkit")
+pytest.importorskip("jinja2")
+
+from utils import generate_PDF  # noqa: E402
+
+
+def test_close_returns_failed_pdfs_instead_of_raising(tmp_path, monkeypatch):
+    def from_string(output_html, output_file, **kwargs):
+        if "broken" in output_html:
+            raise OSError("wkhtmltopdf exited with code 1")
+        with open(output_file, "w", encoding="UTF-8") as f:
+            f.write(output_html)
+
+    monkeypatch.setattr(generate_PDF, "render_vo_data_html", lambda vo_title, *args: vo_title)
+    monkeypatch.setattr(generate_PDF, "_configuration", lambda: None)
+    monkeypatch.setattr(generate_PDF.pdfkit, "from_string", from_string)
+
+    renderer = generate_PDF.PdfBatchRenderer(workers=2)
+    for title in ("first", "broken", "second"):
+        renderer.submit(str(tmp_path / f"{title}.pdf"), title, "-", "-", timedelta(0), datetime.now(), "-", "-", "")
+    failures = renderer.close()
+
+    assert [(title, str(error)) for title, error in failures] == [("broken", "wkhtmltopdf exited with code 1")]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["first.pdf", "second.pdf"]
@@ -0,0 +1,30 @@
+from models.VoDataModels import VoData
+from utils.ledger import RunLedger
+
+
+def test_stages_finished_on_another_machine_are_restored(tmp_path):
+    # Both machines mount the shared output folder at another path, every one has its own ledger
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    (shared / "lecture.segs").write_bytes(b"segments")
+    vo_data = VoData(vo_id="42", vo_title="Lecture")
+
+    first = RunLedger(str(tmp_path / "first.sqlite"), on_finish=lambda vo: finished.append(vo.vo_title))
+    finished = []
+    first.finish(vo_data, "transcribe", str(shared / "lecture.segs"), {"model": "tiny"}, seconds=3.0)
+    assert finished == ["Lecture"]
+    records = first.stage_records(vo_data, str(shared))
+    assert [(record["stage"], record["path"]) for record in records] == [("transcribe", "lecture.segs")]
+    first.close()
+
+    mounted = tmp_path / "mounted"
+    shared.rename(mounted)
+    second = RunLedger(str(tmp_path / "second.sqlite"))
+    second.restore(vo_data, records, str(mounted))
+    assert second.completed(vo_data, "transcribe", {"model": "tiny"})["path"] == str(mounted / "lecture.segs")
+    assert second.completed(vo_data, "transcribe", {"model": "small"}) is None
+
+    # An older record doesn't replace a newer one
+    second.restore(vo_data, [{**records[0], "seconds": 1.0, "finished_at": "2000-01-01T00:00:00+00:00"}], str(mounted))
+    assert second.completed(vo_data, "transcribe", {"model": "tiny"})["seconds"] == 3.0
+    second.close()
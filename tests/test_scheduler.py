@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+
+from models.VoDataModels import VoData
+from utils.ledger import RunLedger
+from utils.scheduler import DeadlineScheduler
+
+
+RTF = {"tiny": 0.1, "small": 0.5}
+
+
+def test_vos_with_the_same_title_are_planned_separately():
+    # Two series that both call their first lecture the same
+    first = VoData(vo_id="1", vo_title="Lecture 1", duration=timedelta(hours=1))
+    second = VoData(vo_id="2", vo_title="Lecture 1", duration=timedelta(hours=1))
+    # Time for one hour with "small" and one with "tiny"
+    deadline = datetime.now() + timedelta(seconds=(3600 * 0.5 + 3600 * 0.1) / 0.9 + 60)
+    scheduler = DeadlineScheduler(
+        [first, second], deadline, ["tiny", "small"], rtf=RTF.get, priorities={RunLedger.key(second): 1}
+    )
+
+    assert scheduler.model_for(second) == "small"
+    assert scheduler.model_for(first) == "tiny"
+    assert list(scheduler) == [second, first]
+
+    assert scheduler.start(second) == "small"
+    assert scheduler.start(first) == "tiny"
+    scheduler.finished(second)
+    assert scheduler.model_for(second) == "small"
+    assert list(scheduler.running) == [RunLedger.key(first)]
@@ -0,0 +1,98 @@
+import json
+import multiprocessing
+import os
+import time
+
+from utils.task_queue import DONE, FAILED, LEASED, PENDING, TaskQueue, finished_tasks
+
+
+LEASE_TIMEOUT = 2.0
+TASKS = 12
+
+
+def work(folder: str, results: str):
+    # A worker that handles every task it leases until the queue is drained
+    queue = TaskQueue(folder, lease_timeout=LEASE_TIMEOUT)
+    for task in queue.tasks(poll_interval=0.1):
+        with open(os.path.join(results, task["id"]), "a", encoding="UTF-8") as f:
+            f.write(json.dumps({"worker": queue.worker, "stages": task.get("stages", [])}) + "\n")
+        queue.record(task, task.get("stages", []) + [{"stage": "transcribe", "worker": queue.worker}])
+        time.sleep(0.05)
+        queue.complete(task)
+    queue.close()
+
+
+def crash(folder: str, leased):
+    # A worker that finishes the first stage of its task and then hangs until it is killed
+    queue = TaskQueue(folder, lease_timeout=LEASE_TIMEOUT)
+    task = queue.claim()
+    queue.record(task, [{"stage": "download", "worker": queue.worker}])
+    leased.put(task["id"])
+    time.sleep(60)
+
+
+def test_workers_reclaim_the_lease_of_a_killed_worker(tmp_path):
+    folder = str(tmp_path / "queue")
+    results = tmp_path / "results"
+    results.mkdir()
+    queue = TaskQueue(folder, lease_timeout=LEASE_TIMEOUT)
+    for number in range(TASKS):
+        assert queue.add(f"vo-{number}", {"number": number})
+    assert not queue.add("vo-0", {"number": 0})
+
+    context = multiprocessing.get_context("fork")
+    leased = context.Queue()
+    crashing = context.Process(target=crash, args=(folder, leased))
+    crashing.start()
+    crashed_id = leased.get(timeout=10)
+    crashing.kill()
+    crashing.join()
+    assert queue.counts()[LEASED] == 1
+
+    workers = [context.Process(target=work, args=(folder, str(results))) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+
+    assert queue.counts() == {PENDING: 0, LEASED: 0, DONE: TASKS, FAILED: 0}
+    # Every task was handled exactly once, the killed worker's task after its lease expired
+    assert sorted(os.listdir(results)) == sorted(task["id"] for task in finished_tasks(folder))
+    handled = {}
+    for name in os.listdir(results):
+        lines = (results / name).read_text(encoding="UTF-8").splitlines()
+        assert len(lines) == 1
+        handled[name] = json.loads(lines[0])
+    assert [stage["stage"] for stage in handled[crashed_id]["stages"]] == ["download"]
+    assert all(handled[tid]["stages"] == [] for tid in handled if tid != crashed_id)
+
+    # The stages of both workers end up in the finished task
+    stages = {task["id"]: task["stages"] for task in finished_tasks(folder)}
+    assert [stage["stage"] for stage in stages[crashed_id]] == ["download", "transcribe"]
+    assert next(task for task in finished_tasks(folder) if task["id"] == crashed_id)["attempts"] == 2
+    queue.close()
+
+
+def test_finished_tasks_keep_their_stages(tmp_path):
+    queue = TaskQueue(str(tmp_path / "queue"), lease_timeout=LEASE_TIMEOUT, retries=0)
+    assert queue.add("vo-1", {"number": 1})
+    task = queue.claim()
+    queue.record(task, [{"stage": "download"}, {"stage": "transcribe"}])
+    queue.complete(task)
+
+    # A restarted worker with the same selection doesn't queue the finished VO again
+    assert not queue.add("vo-1", {"number": 1})
+    assert [task["key"] for task in finished_tasks(queue.folder)] == ["vo-1"]
+
+    # With redo it does, the recorded stages are kept
+    assert queue.add("vo-1", {"number": 1}, redo=True)
+    task = queue.claim()
+    assert [stage["stage"] for stage in task["stages"]] == ["download", "transcribe"]
+    queue.fail(task, "render failed")
+    assert queue.counts()[FAILED] == 1
+
+    # A failed task is queued again without redo, also with its stages
+    assert queue.add("vo-1", {"number": 1})
+    assert [stage["stage"] for stage in queue.claim()["stages"]] == ["download", "transcribe"]
+    queue.close()
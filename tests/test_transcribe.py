@@ -0,0 +1,75 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from main import transcribe_vo
+from utils.audio import SAMPLE_RATE, write_pcm
+from utils.cache import TranscriptionCache
+from utils.backends import BACKENDS, Backend
+from utils.transcribe import DEFAULT_WINDOW_LENGTH, model_cache
+
+
+class FakeBackend(Backend):
+    """
+    Returns one segment per call that covers the whole audio it got.
+    """
+
+    name = "fake"
+    calls = []
+
+    def load(self):
+        pass
+
+    def transcribe(self, audio, language=None, verbose=False, initial_prompt=None):
+        FakeBackend.calls.append(len(audio))
+        seconds = len(audio) / SAMPLE_RATE
+        yield {"id": 0, "seek": 0, "start": 0.0, "end": seconds, "text": f" {seconds:.0f} seconds", "tokens": []}
+
+
+@pytest.fixture
+def audio_path(tmp_path, monkeypatch):
+    monkeypatch.setitem(BACKENDS, "fake", FakeBackend)
+    FakeBackend.calls = []
+    yield write_pcm(np.random.default_rng(0).normal(0.0, 0.1, 2 * int(DEFAULT_WINDOW_LENGTH) * SAMPLE_RATE), str(tmp_path / "vo.pcm"))
+    model_cache.clear()
+
+
+def test_progress_is_reported_without_windows(audio_path):
+    reported = []
+    segments, info = transcribe_vo(audio_path, backend="fake", progress=lambda segment: reported.append(segment["end"]))
+    # One pass over the whole recording, like without progress
+    assert FakeBackend.calls == [2 * int(DEFAULT_WINDOW_LENGTH) * SAMPLE_RATE]
+    assert reported == [segment["end"] for segment in segments] == [2 * DEFAULT_WINDOW_LENGTH]
+    assert info["cached"] is False
+
+
+def test_on_segment_transcribes_in_windows(audio_path):
+    streamed = []
+    transcribe_vo(audio_path, backend="fake", on_segment=streamed.append)
+    assert len(FakeBackend.calls) > 1
+    assert len(streamed) == len(FakeBackend.calls)
+
+
+class SlowBackend(FakeBackend):
+    name = "slow"
+
+    def load(self):
+        time.sleep(0.2)
+
+
+def test_cache_hits_and_model_loads_are_reported_per_call(audio_path, tmp_path, monkeypatch):
+    monkeypatch.setitem(BACKENDS, "slow", SlowBackend)
+    cache = TranscriptionCache(str(tmp_path / "cache"))
+
+    # A model that another thread loads doesn't count for this call
+    other = threading.Thread(target=model_cache.get, args=("other",), kwargs={"backend": "slow"})
+    other.start()
+    other.join()
+    _, info = transcribe_vo(audio_path, model_name="own", backend="slow", cache=cache)
+    assert info["cached"] is False
+    assert 0.2 <= info["load_seconds"] < 0.4
+
+    _, info = transcribe_vo(audio_path, model_name="own", backend="slow", cache=cache)
+    assert info == {"cached": True, "load_seconds": 0.0}
@@ -0,0 +1,31 @@
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def atomic_path(path: str):
+    """
+    Yields a temporary path ('<path>.tmp') to write to instead of path. When the block finishes without an error the
+    temporary file is renamed to path, otherwise it is removed. So path either keeps its old content or gets the
+    complete new content, but never a half-written one.
+    :param path:    The path the file shall end up at
+    """
+    temp_path = path + ".tmp"
+    try:
+        yield temp_path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+
+
+@contextlib.contextmanager
+def atomic_open(path: str, mode: str = "w", encoding: str = "UTF-8"):
+    """
+    Opens a file like open does, but the content is written to a temporary file that replaces path when the block
+    finishes without an error (see atomic_path).
+    """
+    with atomic_path(path) as temp_path:
+        with open(temp_path, mode, encoding=None if "b" in mode else encoding) as f:
+            yield f
@@ -0,0 +1,231 @@
+import logging
+import os
+import struct
+import subprocess
+
+import numpy as np
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+SAMPLE_RATE = 16000
+
+# Prepared audio files consist of a small header followed by raw 16 bit little endian mono samples:
+#   magic (4 bytes), version (uint16), sample width in bytes (uint16), sample rate (uint32), number of samples (uint64)
+# The header is padded to HEADER_SIZE bytes so that the samples can be memory-mapped directly.
+PCM_MAGIC = b"VOPC"
+PCM_VERSION = 1
+PCM_HEADER = struct.Struct("<4sHHIQ")
+HEADER_SIZE = 32
+PCM_EXTENSION = ".pcm"
+
+
+class AudioError(Exception):
+    pass
+
+
+def _ffmpeg_command(input_file: str, offset: float = None, duration: float = None) -> list[str]:
+    """
+    Returns the ffmpeg command that decodes the audio track of input_file to 16 kHz mono PCM on stdout.
+    :param input_file:  Path to the media file
+    :param offset:      Second to start decoding at (None for the start)
+    :param duration:    Number of seconds to decode (None for everything)
+    """
+    seek = ["-ss", f"{offset:.3f}"] if offset else []
+    limit = ["-t", f"{duration:.3f}"] if duration is not None else []
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-loglevel", "error",
+        "-threads", "0",
+        *seek,
+        "-i", input_file,
+        *limit,
+        "-vn",
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE),
+        "-",
+    ]
+
+
+def read_pcm_header(path: str) -> dict | None:
+    """
+    Reads the header of a prepared audio file.
+    :param path:    Path to the prepared audio file
+    :return:        Dict with sample_rate, sample_width and samples or None if the file is not a (complete) prepared audio file
+    """
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "rb") as f:
+        data = f.read(PCM_HEADER.size)
+    if len(data) < PCM_HEADER.size:
+        return None
+
+    magic, version, sample_width, sample_rate, samples = PCM_HEADER.unpack(data)
+    if magic != PCM_MAGIC or version != PCM_VERSION:
+        return None
+    if os.path.getsize(path) != HEADER_SIZE + samples * sample_width:
+        return None
+    return {"sample_rate": sample_rate, "sample_width": sample_width, "samples": samples}
+
+
+def is_prepared(path: str) -> bool:
+    """
+    Checks whether the given path is a complete prepared audio file.
+    """
+    return read_pcm_header(path) is not None
+
+
+def prepare_audio(input_file: str, output_file: str) -> str:
+    """
+    Decodes the audio track of the given media file once to 16 kHz mono PCM and stores it in the prepared audio format.
+    The file is written to a temporary file first and renamed when it is complete.
+    :param input_file:      Path to the media file (any format ffmpeg can read)
+    :param output_file:     Path to save the prepared audio to (should end with .pcm)
+    :return:                The path of the prepared audio file
+    """
+    logger.info("Preparing audio of '%s'", os.path.basename(input_file))
+    temp_file = output_file + ".tmp"
+    cmd = _ffmpeg_command(input_file)
+
+    with open(temp_file, "wb") as f:
+        f.write(bytes(HEADER_SIZE))
+        f.flush()
+        process = subprocess.Popen(cmd, stdout=f, stderr=subprocess.PIPE)
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            f.close()
+            os.remove(temp_file)
+            raise AudioError(f"ffmpeg could not decode '{input_file}': {stderr.decode(errors='replace').strip()}")
+
+        samples = (os.fstat(f.fileno()).st_size - HEADER_SIZE) // 2
+        f.truncate(HEADER_SIZE + samples * 2)
+        f.seek(0)
+        f.write(PCM_HEADER.pack(PCM_MAGIC, PCM_VERSION, 2, SAMPLE_RATE, samples))
+
+    os.replace(temp_file, output_file)
+    logger.info(
+        "Prepared audio of '%s' (%.1f minutes) at '%s'",
+        os.path.basename(input_file),
+        samples / SAMPLE_RATE / 60,
+        output_file,
+    )
+    return output_file
+
+
+def write_pcm(samples: np.ndarray, output_file: str) -> str:
+    """
+    Stores the given samples in the prepared audio format.
+    :param samples:         The audio samples (16 kHz, int16 or float in [-1, 1])
+    :param output_file:     Path to save the prepared audio to (should end with .pcm)
+    :return:                The path of the prepared audio file
+    """
+    return write_pcm_blocks([samples], output_file)
+
+
+def write_pcm_blocks(blocks, output_file: str) -> str:
+    """
+    Stores the given blocks of samples one after another in the prepared audio format, only one block is in memory at
+    a time.
+    :param blocks:          Iterable of blocks of audio samples (16 kHz, int16 or float in [-1, 1])
+    :param output_file:     Path to save the prepared audio to (should end with .pcm)
+    :return:                The path of the prepared audio file
+    """
+    temp_file = output_file + ".tmp"
+    samples = 0
+    with open(temp_file, "wb") as f:
+        f.write(bytes(HEADER_SIZE))
+        for block in blocks:
+            if not np.issubdtype(block.dtype, np.integer):
+                block = np.clip(block * 32768.0, -32768, 32767)
+            block = np.asarray(block, dtype="<i2")
+            f.write(block.tobytes())
+            samples += len(block)
+        f.seek(0)
+        f.write(PCM_HEADER.pack(PCM_MAGIC, PCM_VERSION, 2, SAMPLE_RATE, samples))
+    os.replace(temp_file, output_file)
+    return output_file
+
+
+def open_pcm(path: str) -> np.ndarray:
+    """
+    Memory-maps the samples of a prepared audio file (as int16, nothing is read into memory yet).
+    :param path:    Path to the prepared audio file
+    :return:        The memory-mapped samples
+    """
+    header = read_pcm_header(path)
+    if header is None:
+        raise AudioError(f"'{path}' is not a complete prepared audio file")
+    if header["sample_rate"] != SAMPLE_RATE or header["sample_width"] != 2:
+        raise AudioError(f"'{path}' has an unsupported sample format")
+    if header["samples"] == 0:
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(path, dtype="<i2", mode="r", offset=HEADER_SIZE, shape=(header["samples"],))
+
+
+def to_float(samples: np.ndarray) -> np.ndarray:
+    """
+    Converts int16 samples to float32 in the range [-1, 1] (float samples are returned unchanged).
+    """
+    if np.issubdtype(samples.dtype, np.integer):
+        return samples.astype(np.float32) / 32768.0
+    return samples
+
+
+def load_audio(path: str, offset: float = 0.0, duration: float = None) -> np.ndarray:
+    """
+    Loads the given audio as float32 array in the range [-1, 1] at 16 kHz, like whisper expects it.
+    Prepared audio files are read directly, every other file is decoded with ffmpeg.
+    :param path:        Path to a prepared audio file or any media file
+    :param offset:      Second to start at
+    :param duration:    Number of seconds to load (None for everything after offset)
+    :return:            The audio samples
+    """
+    if is_prepared(path):
+        first = int(offset * SAMPLE_RATE)
+        last = None if duration is None else first + int(duration * SAMPLE_RATE)
+        return to_float(np.asarray(open_pcm(path)[first:last]))
+
+    logger.debug("'%s' is not prepared, decoding it with ffmpeg", path)
+    try:
+        out = subprocess.run(_ffmpeg_command(path, offset, duration), capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise AudioError(f"ffmpeg could not decode '{path}': {e.stderr.decode(errors='replace').strip()}") from e
+    return to_float(np.frombuffer(out, np.int16))
+
+
+def iter_audio_blocks(source, block_length: float = 30.0):
+    """
+    Reads the audio block by block, so that only one block has to be in memory at a time. Media files are decoded by
+    ffmpeg while they are read.
+    :param source:          Path to a prepared audio file or any media file, or the samples (e.g. memory-mapped)
+    :param block_length:    Length of a block in seconds
+    :return:                Iterator over the blocks (int16 when reading a file, the dtype of the samples otherwise)
+    """
+    block = int(block_length * SAMPLE_RATE)
+    if isinstance(source, str):
+        if not is_prepared(source):
+            yield from _iter_ffmpeg_blocks(source, block)
+            return
+        source = open_pcm(source)
+    for first in range(0, len(source), block):
+        yield np.asarray(source[first : first + block])
+
+
+def _iter_ffmpeg_blocks(path: str, block: int):
+    logger.debug("'%s' is not prepared, decoding it with ffmpeg while reading it", path)
+    process = subprocess.Popen(_ffmpeg_command(path), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    complete = False
+    try:
+        while data := process.stdout.read(block * 2):
+            yield np.frombuffer(data[: len(data) // 2 * 2], np.int16)
+        complete = True
+    finally:
+        if not complete:
+            process.kill()
+        _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise AudioError(f"ffmpeg could not decode '{path}': {stderr.decode(errors='replace').strip()}")
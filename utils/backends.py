@@ -0,0 +1,157 @@
+import logging
+from typing import TYPE_CHECKING
+
+# numpy is only needed while transcribing, the registry itself is imported by the command line of main.py
+if TYPE_CHECKING:
+    import numpy as np
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+# Keys every backend fills in for a segment (the schema of openai-whisper's segments, used by utils/generate_files.py)
+SEGMENT_KEYS = ("id", "seek", "start", "end", "text", "tokens", "temperature", "avg_logprob", "compression_ratio", "no_speech_prob")
+
+# Capabilities a backend may have
+FP16 = "fp16"  # can run in half precision
+GPU = "gpu"  # can run on a GPU
+PROMPT = "prompt"  # accepts an initial prompt
+DECODE = "decode"  # exposes the whisper model for batched decoding (utils/batching.py)
+
+
+class Backend:
+    """
+    Interface of a transcription backend. A backend wraps one loaded model, load is called once before the first
+    transcription, transcribe yields the segments with the keys of SEGMENT_KEYS.
+    """
+
+    name = ""
+    capabilities = frozenset()
+
+    def __init__(self, model_name: str, device: str = "cpu", fp16: bool = False):
+        """
+        :param model_name:  Name of the whisper-model
+        :param device:      Device the model shall run on
+        :param fp16:        Whether the model shall use half precision
+        """
+        self.model_name = model_name
+        self.device = device
+        self.fp16 = fp16
+        self.model = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def transcribe(self, audio: "np.ndarray", language: str = None, verbose: bool = False, initial_prompt: str = None):
+        """
+        Transcribes the given audio.
+        :param audio:           Path to the audio file or the audio samples (16 kHz, float32)
+        :param language:        Language of the audio (detected if None)
+        :param verbose:         Whether to print each segment after it is transcribed
+        :param initial_prompt:  Text that precedes the audio (ignored by backends without the PROMPT capability)
+        :return:                Iterator over the segments
+        """
+        raise NotImplementedError
+
+    def memory_usage(self) -> int:
+        """
+        :return:    Number of bytes the model weights take up (0 if unknown)
+        """
+        return 0
+
+
+class WhisperBackend(Backend):
+    """
+    openai-whisper in full (or with fp16 half) precision.
+    """
+
+    name = "whisper"
+    capabilities = frozenset({FP16, GPU, PROMPT, DECODE})
+
+    def load(self):
+        import whisper
+
+        self.model = whisper.load_model(self.model_name, device=self.device)
+        if self.fp16:
+            self.model = self.model.half()
+
+    def transcribe(self, audio, language=None, verbose=False, initial_prompt=None):
+        result = self.model.transcribe(audio=audio, verbose=verbose, fp16=self.fp16, language=language, initial_prompt=initial_prompt)
+        yield from result["segments"]
+
+    def memory_usage(self):
+        return sum(p.numel() * p.element_size() for p in self.model.parameters())
+
+
+class QuantizedWhisperBackend(WhisperBackend):
+    """
+    openai-whisper with the weights of its linear layers dynamically quantized to int8 (CPU only). Decoding uses the
+    same code as WhisperBackend, so the results only differ by the precision of the matrix multiplications.
+    """
+
+    name = "whisper-int8"
+    capabilities = frozenset({PROMPT, DECODE})
+
+    def load(self):
+        import torch
+        import whisper
+
+        if self.device != "cpu" or self.fp16:
+            logger.warning("Backend '%s' only runs on the CPU in full precision, ignoring device '%s' and fp16", self.name, self.device)
+        self.device = "cpu"
+        self.fp16 = False
+
+        model = whisper.load_model(self.model_name, device="cpu")
+        # whisper uses its own subclass of Linear, which quantize_dynamic doesn't know (it only casts the weights)
+        for module in model.modules():
+            if type(module) is whisper.model.Linear:
+                module.__class__ = torch.nn.Linear
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def memory_usage(self):
+        import torch
+
+        size = sum(p.numel() * p.element_size() for p in self.model.parameters())
+        for module in self.model.modules():
+            if isinstance(module, torch.nn.quantized.dynamic.Linear):
+                weight = module.weight()
+                size += weight.numel() * weight.element_size()
+        return size
+
+
+class FasterWhisperBackend(Backend):
+    """
+    faster-whisper (CTranslate2), with int8 weights on the CPU. Needs the optional package faster-whisper.
+    """
+
+    name = "faster-whisper"
+    capabilities = frozenset({FP16, GPU, PROMPT})
+
+    def load(self):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise ImportError("Backend 'faster-whisper' needs the package faster-whisper (pip install faster-whisper)") from e
+
+        if self.device == "cpu":
+            compute_type = "int8"
+        else:
+            compute_type = "float16" if self.fp16 else "int8_float16"
+        self.model = WhisperModel(self.model_name, device=self.device, compute_type=compute_type)
+
+    def transcribe(self, audio, language=None, verbose=False, initial_prompt=None):
+        import numpy as np
+
+        if not isinstance(audio, str):
+            audio = np.asarray(audio, dtype=np.float32)
+        segments, info = self.model.transcribe(audio, language=language, initial_prompt=initial_prompt)
+        if language is None:
+            logger.info("Detected language '%s' (probability %.2f)", info.language, info.language_probability)
+        for segment in segments:
+            segment = {key: getattr(segment, key) for key in SEGMENT_KEYS}
+            segment["tokens"] = list(segment["tokens"])
+            if verbose:
+                print(f"[{segment['start']:.3f} --> {segment['end']:.3f}] {segment['text']}")
+            yield segment
+
+
+BACKENDS = {backend.name: backend for backend in (WhisperBackend, QuantizedWhisperBackend, FasterWhisperBackend)}
@@ -0,0 +1,278 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import whisper
+from whisper.audio import N_FRAMES, N_SAMPLES
+from whisper.tokenizer import get_tokenizer
+
+from utils.audio import SAMPLE_RATE, to_float
+from utils.backends import BACKENDS, DECODE
+from utils.chunking import HOP_LENGTH, find_chunks
+from utils.transcribe import model_cache
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+WINDOW_LENGTH = 26.0  # target window length in seconds, windows are split at silence and never exceed 30 seconds
+WINDOW_SEARCH = 3.0
+TIME_PRECISION = 0.02  # seconds per timestamp token
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+BATCH_SLOT = -1  # model cache slot of the batching engine (it is the only user of its model instance)
+
+
+def find_windows(audio: np.ndarray) -> list[tuple[int, int]]:
+    """
+    Splits the audio at silence into windows that fit into one whisper input (at most 30 seconds).
+    """
+    windows = []
+    for first, last in find_chunks(audio, WINDOW_LENGTH, WINDOW_SEARCH):
+        while last - first > N_SAMPLES:
+            middle = first + (last - first) // 2
+            windows.append((first, middle))
+            first = middle
+        windows.append((first, last))
+    return windows
+
+
+def _compression_ratio(text: str) -> float:
+    data = text.encode("UTF-8")
+    return len(data) / max(len(zlib.compress(data)), 1)
+
+
+def tokens_to_segments(tokens, tokenizer, window_length: float) -> list[tuple[float, float, list[int]]]:
+    """
+    Splits the decoded tokens of one window into segments at the timestamp tokens.
+    :param tokens:          The decoded tokens (including timestamp tokens)
+    :param tokenizer:       The whisper tokenizer
+    :param window_length:   Length of the window in seconds (end of text that is not closed by a timestamp)
+    :return:                List of (start, end, text tokens) with times relative to the window start
+    """
+    segments = []
+    start = None
+    text_tokens = []
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            time_ = (token - tokenizer.timestamp_begin) * TIME_PRECISION
+            if start is not None and text_tokens:
+                segments.append((start, time_, text_tokens))
+                text_tokens = []
+            start = time_
+        elif token < tokenizer.eot:
+            text_tokens.append(token)
+    if text_tokens:
+        segments.append((start or 0.0, max(window_length, start or 0.0), text_tokens))
+    return segments
+
+
+class _Window:
+    def __init__(self, mel, length: float, language: str):
+        self.mel = mel
+        self.length = length
+        self.language = language
+        self.future = Future()
+
+
+class BatchedTranscriber:
+    """
+    Transcribes the windows of many VOs in batches. Callers (e.g. several transcribe workers) hand in their audio and
+    the windows of all of them are collected into batches of up to batch_size windows, which run through the encoder
+    and decoder of the model together. A batch is started when it is full or when its first window waited for
+    max_latency seconds. The results are returned to the caller they belong to with timestamps relative to its audio.
+    Unlike a whisper pass over the whole audio the windows are decoded independently (no text of the previous window
+    is used as prompt).
+    """
+
+    def __init__(
+        self,
+        model_name: str = "small",
+        device: str = "cpu",
+        fp16: bool = False,
+        batch_size: int = 8,
+        max_latency: float = 1.0,
+        cache=None,
+        backend: str = "whisper",
+    ):
+        """
+        :param model_name:      Name of the whisper-model
+        :param device:          Device the model shall run on
+        :param fp16:            Whether the model shall use half precision
+        :param batch_size:      Maximum number of windows that are decoded together
+        :param max_latency:     Seconds a window waits at most for the batch to fill up
+        :param cache:           The ModelCache to take the model from (defaults to the module wide cache)
+        :param backend:         Name of the backend that holds the model, it has to expose the whisper model (see
+                                utils.backends.DECODE)
+        """
+        if DECODE not in BACKENDS[backend].capabilities:
+            raise ValueError(f"Backend '{backend}' doesn't support batched decoding")
+        self.model_name = model_name
+        self.device = device
+        self.fp16 = fp16
+        self.batch_size = max(1, batch_size)
+        self.max_latency = max_latency
+        self.backend = (cache or model_cache).get(model_name, device=device, fp16=fp16, slot=BATCH_SLOT, backend=backend)
+        self.model = self.backend.model
+        self.fp16 = self.backend.fp16
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.batches = 0
+        self.windows = 0
+        self._queue = queue.Queue()
+        self._tokenizers = {}
+        self._thread = threading.Thread(target=self._run, name="batch-decoder", daemon=True)
+        self._thread.start()
+
+    def transcribe(self, audio, language: str = None, verbose: bool = False):
+        """
+        Transcribes the given audio. Can be called from several threads at the same time, their windows share batches.
+        :param audio:       The audio samples (16 kHz, may be memory-mapped)
+        :param language:    Language of the audio (detected per window if None)
+        :param verbose:     Whether to print each segment after it is transcribed
+        :return:            Iterator over the transcribed segments (timestamps relative to the start of the audio)
+        """
+        # Only a few windows per caller are in flight, so that long VOs don't keep all their spectrograms in memory
+        max_pending = 2 * self.batch_size
+
+        def submitted():
+            pending = deque()
+            for first, last in find_windows(audio):
+                samples = to_float(np.asarray(audio[first:last]))
+                mel = whisper.pad_or_trim(whisper.log_mel_spectrogram(samples), N_FRAMES)
+                window = _Window(mel, (last - first) / SAMPLE_RATE, language)
+                pending.append((first, window))
+                self._queue.put(window)
+                if len(pending) > max_pending:
+                    yield pending.popleft()
+            yield from pending
+
+        index = 0
+        for first, window in submitted():
+            offset = first / SAMPLE_RATE
+            for segment in window.future.result():
+                segment["id"] = index
+                segment["seek"] = first // HOP_LENGTH
+                segment["start"] += offset
+                segment["end"] += offset
+                index += 1
+                if verbose:
+                    print(f"[{segment['start']:.3f} --> {segment['end']:.3f}] {segment['text']}")
+                yield segment
+
+    def _tokenizer(self, language):
+        if language not in self._tokenizers:
+            self._tokenizers[language] = get_tokenizer(self.model.is_multilingual, language=language, task="transcribe")
+        return self._tokenizers[language]
+
+    def _next_batch(self) -> list[_Window] | None:
+        window = self._queue.get()
+        if window is None:
+            return None
+        batch = [window]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.batch_size:
+            try:
+                window = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if window is None:
+                self._queue.put(None)
+                break
+            batch.append(window)
+        return batch
+
+    def _run(self):
+        while (batch := self._next_batch()) is not None:
+            # Windows with different languages can't share the decoding options
+            groups = {}
+            for window in batch:
+                groups.setdefault(window.language, []).append(window)
+            for language, windows in groups.items():
+                try:
+                    start = time.monotonic()
+                    results = self._decode(windows, language)
+                    self.busy_seconds += time.monotonic() - start
+                except Exception as e:
+                    for window in windows:
+                        window.future.set_exception(e)
+                    continue
+                self.batches += 1
+                self.windows += len(windows)
+                self.audio_seconds += sum(window.length for window in windows)
+                for window, segments in zip(windows, results):
+                    window.future.set_result(segments)
+
+    def _decode(self, windows: list[_Window], language: str) -> list[list[dict]]:
+        """
+        Decodes a batch of windows, windows whose result looks like a failure (repetitions, low probability) are
+        decoded again with a higher temperature, like whisper's transcribe does.
+        """
+        mel = torch.stack([window.mel for window in windows]).to(self.model.device)
+        if self.fp16:
+            mel = mel.half()
+
+        results = [None] * len(windows)
+        remaining = list(range(len(windows)))
+        for temperature in TEMPERATURES:
+            options = whisper.DecodingOptions(language=language, temperature=temperature, fp16=self.fp16)
+            decoded = self.model.decode(mel[remaining], options)
+            retry = []
+            for index, result in zip(remaining, decoded):
+                results[index] = (result, temperature)
+                failed = (
+                    _compression_ratio(result.text) > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+                )
+                if failed and result.no_speech_prob <= NO_SPEECH_THRESHOLD:
+                    retry.append(index)
+            if not retry:
+                break
+            remaining = retry
+
+        segments = []
+        for window, (result, temperature) in zip(windows, results):
+            if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+                segments.append([])
+                continue
+            tokenizer = self._tokenizer(result.language)
+            segments.append(
+                [
+                    {
+                        "start": start,
+                        "end": end,
+                        "text": tokenizer.decode(tokens),
+                        "tokens": tokens,
+                        "temperature": temperature,
+                        "avg_logprob": result.avg_logprob,
+                        "compression_ratio": result.compression_ratio,
+                        "no_speech_prob": result.no_speech_prob,
+                    }
+                    for start, end, tokens in tokens_to_segments(result.tokens, tokenizer, window.length)
+                ]
+            )
+        return segments
+
+    def log_stats(self):
+        if self.windows == 0:
+            return
+        logger.info(
+            "Batched decoding: %.1f minutes of audio in %d windows and %d batches (%.1f windows per batch), "
+            "decoding took %.1fs (aggregate real-time factor %.3f)",
+            self.audio_seconds / 60,
+            self.windows,
+            self.batches,
+            self.windows / max(self.batches, 1),
+            self.busy_seconds,
+            self.busy_seconds / max(self.audio_seconds, 1e-9),
+        )
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+CACHE_EXTENSION = ".json"
+
+
+def _json_default(value):
+    # numpy scalars (e.g. in the whisper segments) are converted to plain python numbers
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def hash_file(path: str, block_size: int = 2**20) -> str:
+    """
+    Returns the sha256 hex digest of the content of the given file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranscriptionCache:
+    """
+    Persistent cache for transcriptions. The entries are keyed by a hash of the prepared audio and the options used for
+    transcribing it (model name, language, decoding options) and contain the raw whisper segments.
+    Every entry stores a checksum of its content, corrupt entries are deleted when they are read. When the cache grows
+    beyond max_size the least recently used entries are evicted.
+    """
+
+    def __init__(self, folder: str, max_size: int = None):
+        """
+        :param folder:      The folder the cache entries are stored in (is created if it doesn't exist)
+        :param max_size:    Maximum number of bytes the cache may take up (None means no limit)
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.corrupt = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, audio_path: str, model_name: str, language: str = None, options: dict = None) -> str:
+        """
+        Computes the cache key for transcribing the given audio with the given options.
+        :param audio_path:  Path to the (prepared) audio file
+        :param model_name:  Name of the whisper-model
+        :param language:    Language of the audio
+        :param options:     Further options that influence the transcription result
+        :return:            The cache key
+        """
+        params = json.dumps(
+            {"audio": hash_file(audio_path), "model_name": model_name, "language": language, "options": options or {}},
+            sort_keys=True,
+        )
+        return hashlib.sha256(params.encode("UTF-8")).hexdigest()
+
+    def get(self, key: str) -> list | None:
+        """
+        Returns the cached segments for the given key or None if there is no (intact) entry.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                checksum = f.readline().strip().decode("ascii")
+                payload = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if hashlib.sha256(payload).hexdigest() != checksum:
+            logger.warning("Cache entry '%s' is corrupt, deleting it", key)
+            self._delete(path)
+            with self._lock:
+                self.corrupt += 1
+                self.misses += 1
+            return None
+
+        os.utime(path)
+        with self._lock:
+            self.hits += 1
+        logger.debug("Cache hit for '%s'", key)
+        return json.loads(payload)
+
+    def put(self, key: str, segments: list):
+        """
+        Stores the segments under the given key and evicts old entries if the cache is too big.
+        """
+        payload = json.dumps(segments, ensure_ascii=False, default=_json_default).encode("UTF-8")
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(hashlib.sha256(payload).hexdigest().encode("ascii") + b"\n")
+            f.write(payload)
+        os.replace(temp_path, path)
+        logger.debug("Stored '%s' in cache (%d bytes)", key, len(payload))
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache is not bigger than max_size.
+        """
+        if self.max_size is None:
+            return
+
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.folder):
+                if not name.endswith(CACHE_EXTENSION):
+                    continue
+                stat = os.stat(os.path.join(self.folder, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            size = sum(entry[1] for entry in entries)
+            for _, entry_size, name in sorted(entries):
+                if size <= self.max_size:
+                    break
+                logger.debug("Evicting '%s' from cache", name)
+                self._delete(os.path.join(self.folder, name))
+                size -= entry_size
+                self.evictions += 1
+
+    def log_stats(self):
+        logger.info(
+            "Transcription cache: %d hit(s), %d miss(es), %d evicted, %d corrupt",
+            self.hits,
+            self.misses,
+            self.evictions,
+            self.corrupt,
+        )
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + CACHE_EXTENSION)
+
+    def _delete(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,321 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from models.VoDataModels import VoData
+from utils.vo_data import PARSERS, iter_results, iter_vo_results
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vos (
+    id              TEXT PRIMARY KEY,
+    feed            TEXT,
+    title           TEXT NOT NULL,
+    series          TEXT,
+    author          TEXT,
+    contributors    TEXT,
+    duration_ms     INTEGER,
+    recorded_on     TEXT,
+    mp4_link        TEXT,
+    mp3_link        TEXT,
+    synced_at       TEXT
+);
+CREATE INDEX IF NOT EXISTS vos_title ON vos (title);
+CREATE INDEX IF NOT EXISTS vos_series ON vos (series);
+CREATE INDEX IF NOT EXISTS vos_author ON vos (author);
+CREATE INDEX IF NOT EXISTS vos_recorded_on ON vos (recorded_on);
+
+-- A VO can be listed in several feeds (vos.feed is the last one it was synced from)
+CREATE TABLE IF NOT EXISTS feed_vos (
+    feed            TEXT NOT NULL,
+    id              TEXT NOT NULL,
+    PRIMARY KEY (feed, id)
+);
+
+CREATE TABLE IF NOT EXISTS feeds (
+    feed            TEXT PRIMARY KEY,
+    etag            TEXT,
+    last_modified   TEXT,
+    synced_at       TEXT
+);
+"""
+
+
+def _utc(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def _with_params(link: str, **params) -> str:
+    parsed = urlparse(link)
+    query = dict(parse_qsl(parsed.query))
+    query.update({key: str(value) for key, value in params.items()})
+    return urlunparse(parsed._replace(query=urlencode(query)))
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    Transport adapter that spaces the requests to the same host at least 1 / per_host_rate seconds apart, so that
+    fetching many feeds at the same time doesn't flood a single server.
+    """
+
+    def __init__(self, per_host_rate: float, **kwargs):
+        self.interval = 1.0 / per_host_rate
+        self._next_request = {}
+        self._rate_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        with self._rate_lock:
+            now = time.monotonic()
+            start = max(now, self._next_request.get(host, now))
+            self._next_request[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return super().send(request, **kwargs)
+
+
+def create_session(pool_size: int = 4, retries: int = 3, per_host_rate: float = None) -> requests.Session:
+    """
+    Creates a requests session with a connection pool that retries failed requests with backoff.
+    :param pool_size:       Number of connections kept open per host
+    :param retries:         How often a failed request is retried
+    :param per_host_rate:   Maximum number of requests per second to the same host (None for no limit)
+    """
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=None)
+    if per_host_rate:
+        adapter = RateLimitedAdapter(per_host_rate, pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class Catalog:
+    """
+    Persistent SQLite index of VoData records. It is filled incrementally from VO-data feeds and answers selections by
+    title, series, author, recording date and title pattern without touching the feed.
+    """
+
+    def __init__(self, path: str, session: requests.Session = None):
+        """
+        :param path:    Path to the SQLite database (is created if it doesn't exist)
+        :param session: Session feeds are fetched with (e.g. shared by several catalogs, a new one is created if None)
+        """
+        self.path = path
+        # Several connections may write to the catalog at the same time when feeds are synced concurrently
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.executescript(SCHEMA)
+        self._session = session
+        self._owns_session = session is None
+
+    def close(self):
+        self.connection.close()
+        if self._session is not None and self._owns_session:
+            self._session.close()
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            self._session = create_session()
+        return self._session
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM vos").fetchone()[0]
+
+    def upsert(self, vos, feed: str = None) -> int:
+        """
+        Inserts the given VOs or updates them if they are already in the catalog.
+        :param vos:     Iterable of VoData objects
+        :param feed:    The feed the VOs come from
+        :return:        Number of VOs that were not in the catalog before
+        """
+        now = _utc(datetime.now(timezone.utc))
+        new = 0
+        with self.connection:
+            for vo in vos:
+                vo_id = vo.vo_id or hashlib.sha1(f"{vo.vo_title}|{vo.recorded_on}".encode("UTF-8")).hexdigest()
+                known = self.connection.execute("SELECT 1 FROM vos WHERE id = ?", (vo_id,)).fetchone()
+                new += known is None
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO vos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        vo_id,
+                        feed,
+                        vo.vo_title,
+                        vo.series_title,
+                        vo.author,
+                        vo.contributors,
+                        int(vo.duration.total_seconds() * 1000),
+                        _utc(vo.recorded_on),
+                        vo.vo_mp4_link,
+                        vo.vo_mp3_link,
+                        now,
+                    ),
+                )
+                if feed is not None:
+                    self.connection.execute("INSERT OR IGNORE INTO feed_vos VALUES (?, ?)", (feed, vo_id))
+        return new
+
+    def sync_file(self, path: str, uni: str) -> int:
+        """
+        Adds the VOs of a VO-data file to the catalog.
+        :param path:    Path to the file containing the VO-data
+        :param uni:     Which parser to use ("uw" or "tu")
+        :return:        Number of new VOs
+        """
+        results = iter_vo_results(path=path)
+        if results is None:
+            raise FileNotFoundError(path)
+        new = self.upsert(_parse_all(results, uni), feed=path)
+        logger.info("Synced %d new VO(s) from '%s' (%d in catalog)", new, path, len(self))
+        return new
+
+    def sync_link(self, link: str, uni: str, page_size: int = 100, full: bool = False) -> int:
+        """
+        Fetches the feed page by page (newest first) and adds the VOs to the catalog. Unless full is set the sync stops
+        at the first page that contains already known VOs, and the feed is not fetched at all if the server reports (via ETag or
+        Last-Modified) that it did not change since the last sync.
+        :param link:        Link to the VO-data (Opencast search API)
+        :param uni:         Which parser to use ("uw" or "tu")
+        :param page_size:   Number of VOs requested per page
+        :param full:        Whether to fetch every page even if nothing changed
+        :return:            Number of new VOs
+        """
+        row = self.connection.execute("SELECT etag, last_modified FROM feeds WHERE feed = ?", (link,)).fetchone()
+        headers = {}
+        if row is not None and not full:
+            if row[0]:
+                headers["If-None-Match"] = row[0]
+            if row[1]:
+                headers["If-Modified-Since"] = row[1]
+
+        new = 0
+        offset = 0
+        etag = last_modified = None
+        while True:
+            page_link = _with_params(link, limit=page_size, offset=offset, sort="DATE_CREATED_DESC")
+            response = self.session.get(page_link, timeout=30, headers=headers if offset == 0 else {}, stream=True)
+            if response.status_code == 304:
+                response.close()
+                logger.info("VO-data at '%s' did not change since the last sync", link)
+                break
+            response.raise_for_status()
+            if offset == 0:
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+            response.encoding = response.encoding or "UTF-8"
+            entries = list(iter_results(_text_chunks(response)))
+            page_new = self.upsert(_parse_all(entries, uni), feed=link)
+            new += page_new
+            logger.debug("Synced page at offset %d of '%s': %d entries, %d new", offset, link, len(entries), page_new)
+
+            # Pages are sorted newest first, so a page that contains known VOs is the last one with new VOs
+            if len(entries) < page_size or (page_new < len(entries) and not full):
+                break
+            offset += page_size
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO feeds VALUES (?, ?, ?, ?)",
+                (link, etag or (row[0] if row else None), last_modified or (row[1] if row else None), _utc(datetime.now(timezone.utc))),
+            )
+        logger.info("Synced %d new VO(s) from '%s' (%d in catalog)", new, link, len(self))
+        return new
+
+    def select(
+        self,
+        titles=None,
+        series=None,
+        author: str = None,
+        since: datetime = None,
+        until: datetime = None,
+        pattern: str = None,
+        feed: str = None,
+    ) -> list[VoData]:
+        """
+        Selects VOs from the catalog. All given criteria have to match, criteria that are None are ignored.
+        :param titles:      Exact titles of the VOs
+        :param series:      Titles of the series the VOs are part of
+        :param author:      Author of the VOs
+        :param since:       VOs recorded at or after this time
+        :param until:       VOs recorded before this time
+        :param pattern:     Pattern the title has to match ('*' matches any text, '?' a single character, case-insensitive)
+        :param feed:        The feed (link or path) that lists the VOs
+        :return:            The matching VOs ordered by recording date
+        """
+        where, params = [], []
+        if titles:
+            where.append(f"title IN ({', '.join('?' * len(titles))})")
+            params.extend(titles)
+        if series:
+            where.append(f"series IN ({', '.join('?' * len(series))})")
+            params.extend(series)
+        if author is not None:
+            where.append("author = ?")
+            params.append(author)
+        if since is not None:
+            where.append("recorded_on >= ?")
+            params.append(_utc(since))
+        if until is not None:
+            where.append("recorded_on < ?")
+            params.append(_utc(until))
+        if pattern is not None:
+            escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("title LIKE ? ESCAPE '\\'")
+            params.append(escaped.replace("*", "%").replace("?", "_"))
+        if feed is not None:
+            where.append("(feed = ? OR id IN (SELECT id FROM feed_vos WHERE feed = ?))")
+            params.extend((feed, feed))
+
+        query = "SELECT id, title, series, author, contributors, duration_ms, recorded_on, mp4_link, mp3_link FROM vos"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY recorded_on, title"
+
+        return [
+            VoData(
+                vo_id=row[0],
+                vo_title=row[1],
+                series_title=row[2],
+                author=row[3],
+                contributors=row[4],
+                duration=timedelta(milliseconds=row[5]),
+                recorded_on=datetime.fromisoformat(row[6]),
+                vo_mp4_link=row[7],
+                vo_mp3_link=row[8],
+            )
+            for row in self.connection.execute(query, params)
+        ]
+
+    def titles(self) -> list[str]:
+        return [row[0] for row in self.connection.execute("SELECT title FROM vos ORDER BY recorded_on, title")]
+
+
+def _parse_all(entries, uni):
+    parse = PARSERS[uni]
+    for vo in entries:
+        try:
+            yield parse(vo)
+        except Exception as e:
+            logger.error("Could not parse VO '%s': %s", vo.get("mediapackage", {}).get("title"), e)
+
+
+def _text_chunks(response):
+    with response:
+        yield from response.iter_content(chunk_size=2**16, decode_unicode=True)
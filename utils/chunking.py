@@ -0,0 +1,215 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from utils.audio import SAMPLE_RATE, is_prepared, iter_audio_blocks, load_audio, open_pcm
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+HOP_LENGTH = 160  # samples per mel frame in whisper, used to translate sample offsets into "seek" values
+FRAME_LENGTH = SAMPLE_RATE // 10  # energy is measured in frames of 100 ms when looking for silence
+
+
+def find_chunks(audio: np.ndarray, chunk_length: float = 600.0, search: float = 30.0) -> list[tuple[int, int]]:
+    """
+    Splits the audio into chunks of about chunk_length seconds. The boundaries are moved to the quietest 100 ms frame
+    within +-search seconds around the target position, so that chunks are (ideally) split in speech pauses.
+    :param audio:           The audio samples (16 kHz)
+    :param chunk_length:    Target length of a chunk in seconds
+    :param search:          How far (in seconds) a boundary may be moved to find silence
+    :return:                List of (first sample, last sample + 1) of each chunk, without overlap
+    """
+    total = len(audio)
+    step = int(chunk_length * SAMPLE_RATE)
+    if total <= step * 1.5:
+        return [(0, total)]
+
+    boundaries = [0]
+    target = step
+    while target < total - step // 2:
+        first = max(boundaries[-1] + FRAME_LENGTH, target - int(search * SAMPLE_RATE))
+        last = min(total - FRAME_LENGTH, target + int(search * SAMPLE_RATE))
+        boundaries.append(_quietest_boundary(audio, first, last, target))
+        target = boundaries[-1] + step
+    boundaries.append(total)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _quietest_boundary(audio: np.ndarray, first: int, last: int, default: int) -> int:
+    """
+    Returns the middle of the quietest 100 ms frame between the samples first and last (default if there is no frame).
+    """
+    frames = (last - first) // FRAME_LENGTH
+    if frames <= 0:
+        return default
+    window = np.asarray(audio[first : first + frames * FRAME_LENGTH], dtype=np.float32).reshape(frames, FRAME_LENGTH)
+    energy = np.sqrt(np.mean(window**2, axis=1))
+    return first + int(np.argmin(energy)) * FRAME_LENGTH + FRAME_LENGTH // 2
+
+
+def iter_windows(blocks, window_length: float = 300.0, search: float = 30.0):
+    """
+    Splits a stream of audio blocks into windows the same way find_chunks splits audio into chunks, but without
+    knowing the whole audio: at most about 1.5 windows (plus one block) are buffered at a time, so the memory needed
+    doesn't depend on the length of the recording.
+    :param blocks:          Iterable of blocks of audio samples (16 kHz), e.g. from utils.audio.iter_audio_blocks
+    :param window_length:   Target length of a window in seconds
+    :param search:          How far (in seconds) a boundary may be moved to find silence
+    :return:                Iterator over (first sample, samples) of every window
+    """
+    step = int(window_length * SAMPLE_RATE)
+    search = int(search * SAMPLE_RATE)
+    buffer = None
+    first = 0
+    for block in blocks:
+        buffer = block if buffer is None or len(buffer) == 0 else np.concatenate((buffer, block))
+        # Like find_chunks a window is only split off if the rest is at least half a window long
+        while len(buffer) > step * 1.5:
+            boundary = _quietest_boundary(buffer, max(FRAME_LENGTH, step - search), min(len(buffer) - FRAME_LENGTH, step + search), step)
+            yield first, buffer[:boundary]
+            first += boundary
+            buffer = buffer[boundary:]
+    if buffer is not None and len(buffer) > 0:
+        yield first, buffer
+
+
+def stitch_segments(chunk_results: list[tuple[int, int, int, list]]) -> list[dict]:
+    """
+    Combines the segments of overlapping chunks into one list with global timestamps. A chunk contributes the segments
+    that start before the end of its core (the part without overlap) and that were not already covered by the previous
+    chunk, which removes the segments that were transcribed twice in the overlap.
+    :param chunk_results:   List of (core start sample, core end sample, window start sample, segments) per chunk,
+                            segment timestamps relative to the window start
+    :return:                The stitched segments (same structure as the result of a single whisper pass)
+    """
+    stitched = []
+    covered_until = 0.0
+    for core_start, core_end, window_start, segments in sorted(chunk_results, key=lambda x: x[0]):
+        offset = window_start / SAMPLE_RATE
+        for segment in segments:
+            start = segment["start"] + offset
+            end = segment["end"] + offset
+            if start * SAMPLE_RATE >= core_end or (start + end) / 2 <= covered_until:
+                continue
+
+            segment = dict(segment)
+            segment["id"] = len(stitched)
+            segment["seek"] = segment.get("seek", 0) + window_start // HOP_LENGTH
+            segment["start"] = start
+            segment["end"] = end
+            stitched.append(segment)
+            covered_until = max(covered_until, end)
+
+    # Neighbouring chunks may disagree where a segment ends, so overlapping timestamps are clipped
+    for previous, segment in zip(stitched, stitched[1:]):
+        if segment["start"] < previous["end"]:
+            previous["end"] = max(previous["start"], segment["start"])
+    return stitched
+
+
+_worker_model = None
+
+
+def _init_worker(model_name, device, fp16, threads, backend):
+    global _worker_model
+    import torch
+
+    from utils.transcribe import model_cache
+
+    torch.set_num_threads(threads)
+    _worker_model = model_cache.get(model_name, device=device, fp16=fp16, backend=backend)
+
+
+def _transcribe_window(audio_path, window_start, window_end, language):
+    audio = load_audio(audio_path, offset=window_start / SAMPLE_RATE, duration=(window_end - window_start) / SAMPLE_RATE)
+    return list(_worker_model.transcribe(audio, language=language, verbose=None))
+
+
+class ChunkedTranscriber:
+    """
+    Transcribes long audio files by splitting them into overlapping chunks that are transcribed in parallel by a pool of
+    worker processes. Every worker holds its own model, the pool is started on first use and reused for every file.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        workers: int = None,
+        chunk_length: float = 600.0,
+        overlap: float = 5.0,
+        device: str = "cpu",
+        fp16: bool = False,
+        backend: str = "whisper",
+    ):
+        """
+        :param model_name:      Name of the whisper-model to use
+        :param workers:         Number of worker processes (defaults to the number of CPU cores)
+        :param chunk_length:    Target length of a chunk in seconds
+        :param overlap:         Seconds every chunk overlaps with its neighbours
+        :param device:          Device the models shall run on
+        :param fp16:            Whether the models shall use half precision
+        :param backend:         Name of the backend that runs the models (see utils.backends.BACKENDS)
+        """
+        self.model_name = model_name
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_length = chunk_length
+        self.overlap = overlap
+        self.device = device
+        self.fp16 = fp16
+        self.backend = backend
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            logger.info("Starting %d transcription worker(s) with %d thread(s) each", self.workers, threads)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.device, self.fp16, threads, self.backend),
+            )
+        return self._executor
+
+    def transcribe(self, audio_path: str, language: str = None) -> list[dict]:
+        """
+        Transcribes the given audio file chunk by chunk in parallel.
+        :param audio_path:  Path to the (prepared) audio file
+        :param language:    Language of the audio
+        :return:            The transcribed segments with timestamps relative to the start of the file
+        """
+        if is_prepared(audio_path):
+            audio = open_pcm(audio_path)
+            total = len(audio)
+            chunks = find_chunks(audio, self.chunk_length)
+            del audio
+        else:
+            # The file is decoded once to find the boundaries, without keeping the audio in memory
+            chunks = [(first, first + len(window)) for first, window in iter_windows(iter_audio_blocks(audio_path), self.chunk_length)]
+            total = chunks[-1][1] if chunks else 0
+        logger.info("Transcribing '%s' in %d chunk(s) with %d worker(s)", os.path.basename(audio_path), len(chunks), self.workers)
+
+        overlap = int(self.overlap * SAMPLE_RATE)
+        start = datetime.now()
+        futures = []
+        for core_start, core_end in chunks:
+            window_start = max(0, core_start - overlap)
+            window_end = min(total, core_end + overlap)
+            future = self._pool().submit(_transcribe_window, audio_path, window_start, window_end, language)
+            futures.append((core_start, core_end, window_start, future))
+
+        results = [(core_start, core_end, window_start, future.result()) for core_start, core_end, window_start, future in futures]
+        end = datetime.now()
+        logger.info("Chunked transcription took %s", str(end - start))
+        return stitch_segments(results)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
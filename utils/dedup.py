@@ -0,0 +1,284 @@
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+import numpy as np
+
+from models.VoDataModels import VoData
+from utils.audio import SAMPLE_RATE, load_audio, to_float
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+# The fingerprint covers the beginning of a recording: 16 bits per frame that tell whether the energy difference of
+# neighbouring frequency bands grows or shrinks from one frame to the next (Haitsma/Kalker). The frames overlap by 3/4,
+# so that copies that are cut at a different sample still produce mostly the same bits. Silent or constant frames
+# (dead air before a lecture starts) give the same bits for every recording, they are left out of the comparison.
+FINGERPRINT_SECONDS = 120.0
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+BAND_EDGES = np.geomspace(300.0, 3000.0, 18)
+# Frames quieter than this (RMS, about -50 dBFS) or whose band energies don't change are silent
+SILENCE_RMS = 0.003
+FLAT_THRESHOLD = 1e-3
+FINGERPRINT_DTYPE = np.dtype([("bits", "<u2"), ("voiced", "u1")])
+# Recordings whose fingerprints differ in less than this fraction of bits are the same (unrelated audio differs in half)
+MAX_BIT_ERROR_RATE = 0.35
+# How far the fingerprints may be shifted against each other (re-uploads are often trimmed differently) and how much
+# of them has to overlap (in frames)
+MAX_SHIFT = int(5 * SAMPLE_RATE / HOP_LENGTH)
+MIN_OVERLAP = int(10 * SAMPLE_RATE / HOP_LENGTH)
+# A fingerprint with fewer non-silent frames than this never matches
+MIN_VOICED_FRAMES = int(30 * SAMPLE_RATE / HOP_LENGTH)
+# Copies of a VO in the VO-data may differ this much in duration and recording time
+DURATION_TOLERANCE = 2.0
+RECORDED_ON_TOLERANCE = timedelta(hours=1)
+
+# Number of set bits of every 16 bit value
+_BITS = np.unpackbits(np.arange(1 << 16, dtype="<u2").view(np.uint8)).reshape(-1, 16).sum(axis=1, dtype=np.uint8)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    vo_key          TEXT PRIMARY KEY,
+    metadata        TEXT NOT NULL,
+    duration_ms     INTEGER,
+    fingerprint     BLOB NOT NULL,
+    created_at      TEXT
+);
+CREATE INDEX IF NOT EXISTS fingerprints_duration ON fingerprints (duration_ms);
+"""
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").casefold().split())
+
+
+def _media_key(link: str) -> str | None:
+    # The placeholder link of VOs without a video doesn't identify a recording
+    if not link or link == VoData.__fields__["vo_mp4_link"].default:
+        return None
+    url = urlparse(link)
+    return f"{url.netloc.lower()}{url.path}?{url.query}"
+
+
+def _known(vo: VoData, field: str):
+    # Fields that are not in the VO-data keep their default, which says nothing about the recording
+    value = getattr(vo, field)
+    return None if value == VoData.__fields__[field].default else value
+
+
+def _recorded_close(first: VoData, second: VoData) -> bool:
+    first_recorded, second_recorded = _known(first, "recorded_on"), _known(second, "recorded_on")
+    if first_recorded is None or second_recorded is None or (first_recorded.tzinfo is None) != (second_recorded.tzinfo is None):
+        return False
+    return abs(first_recorded - second_recorded) <= RECORDED_ON_TOLERANCE
+
+
+def same_recording_metadata(first: VoData, second: VoData) -> bool:
+    """
+    Checks whether the metadata of two VOs allows them to be the same recording: the same author or series, or
+    recorded at about the same time.
+    """
+    for field in ("author", "series_title"):
+        first_value, second_value = _known(first, field), _known(second, field)
+        if first_value is not None and second_value is not None and _normalize(first_value) == _normalize(second_value):
+            return True
+    return _recorded_close(first, second)
+
+
+def find_duplicates(vos: list[VoData], prefer=None) -> tuple[list[VoData], list[tuple[VoData, VoData]]]:
+    """
+    Finds VOs in the list that are copies of another VO (re-uploads, cross-listed series, ...) by their metadata: VOs
+    with the same media file, or with the same title and author, a (known) duration that differs by at most
+    DURATION_TOLERANCE seconds and a recording time that differs by at most RECORDED_ON_TOLERANCE (weekly lectures
+    often share their title and length).
+    :param vos:     The VOs
+    :param prefer:  Function that tells whether a VO should be kept rather than its copies (e.g. because it is already
+                    transcribed), otherwise the first copy with an audio track (smaller download) is kept
+    :return:        The VOs without their copies and the copies as pairs (copy, the VO that is kept)
+    """
+    groups = []
+    by_media = {}
+    by_title = {}
+    for vo in vos:
+        group = None
+        for link in (vo.vo_mp3_link, vo.vo_mp4_link):
+            key = _media_key(link)
+            if key is not None and key in by_media:
+                group = by_media[key]
+                break
+        if group is None:
+            for other, other_group in by_title.get((_normalize(vo.vo_title), _normalize(vo.author)), []):
+                if (
+                    other.duration
+                    and vo.duration
+                    and abs((other.duration - vo.duration).total_seconds()) <= DURATION_TOLERANCE
+                    and _recorded_close(other, vo)
+                ):
+                    group = other_group
+                    break
+        if group is None:
+            group = []
+            groups.append(group)
+        group.append(vo)
+        for link in (vo.vo_mp3_link, vo.vo_mp4_link):
+            if _media_key(link) is not None:
+                by_media.setdefault(_media_key(link), group)
+        by_title.setdefault((_normalize(vo.vo_title), _normalize(vo.author)), []).append((vo, group))
+
+    kept = []
+    duplicates = []
+    for group in groups:
+        original = next((vo for vo in group if prefer is not None and prefer(vo)), None)
+        original = original or next((vo for vo in group if vo.vo_mp3_link is not None), group[0])
+        kept.append(original)
+        for vo in group:
+            if vo is not original:
+                duplicates.append((vo, original))
+    kept.sort(key=vos.index)
+    return kept, duplicates
+
+
+def fingerprint(audio: np.ndarray) -> np.ndarray:
+    """
+    Computes the fingerprint of the beginning (FINGERPRINT_SECONDS) of the audio.
+    :param audio:   The audio samples (16 kHz, may be memory-mapped)
+    :return:        16 bits per frame and whether the frame is not silent (FINGERPRINT_DTYPE)
+    """
+    samples = to_float(np.asarray(audio[: int(FINGERPRINT_SECONDS * SAMPLE_RATE)]))
+    frames = (len(samples) - FRAME_LENGTH) // HOP_LENGTH + 1
+    if frames < 2:
+        return np.zeros(0, dtype=FINGERPRINT_DTYPE)
+
+    windows = np.lib.stride_tricks.as_strided(
+        samples,
+        shape=(frames, FRAME_LENGTH),
+        strides=(samples.strides[0] * HOP_LENGTH, samples.strides[0]),
+        writeable=False,
+    )
+    power = np.abs(np.fft.rfft(windows * np.hanning(FRAME_LENGTH).astype(np.float32), axis=1)) ** 2
+    edges = np.round(BAND_EDGES * FRAME_LENGTH / SAMPLE_RATE).astype(int)
+    energy = np.log(np.add.reduceat(power, edges, axis=1)[:, :-1] + 1e-10)
+
+    difference = np.diff(energy, axis=1)
+    change = difference[1:] - difference[:-1]
+    loud = np.sqrt(np.mean(windows.astype(np.float32) ** 2, axis=1)) >= SILENCE_RMS
+
+    print_ = np.zeros(frames - 1, dtype=FINGERPRINT_DTYPE)
+    print_["bits"] = np.packbits(change > 0, axis=1, bitorder="little").view("<u2").ravel()
+    print_["voiced"] = loud[1:] & loud[:-1] & (np.abs(change).max(axis=1) > FLAT_THRESHOLD)
+    return print_
+
+
+def fingerprint_link(link: str) -> np.ndarray:
+    """
+    Computes the fingerprint of a remote recording. ffmpeg only reads the beginning of the file, so this costs a small
+    part of the download.
+    """
+    return fingerprint(load_audio(link, duration=FINGERPRINT_SECONDS + 1))
+
+
+def bit_error_rate(first: np.ndarray, second: np.ndarray, max_shift: int = MAX_SHIFT) -> float:
+    """
+    Returns the smallest fraction of differing bits of the fingerprints over all shifts of up to max_shift frames.
+    Only frames that are not silent in both fingerprints are compared, at least MIN_OVERLAP of them.
+    """
+    best = 1.0
+    for shift in range(-max_shift, max_shift + 1):
+        a = first[max(shift, 0) :]
+        b = second[max(-shift, 0) :]
+        length = min(len(a), len(b))
+        voiced = (a["voiced"][:length] & b["voiced"][:length]).astype(bool)
+        compared = int(voiced.sum())
+        if compared < MIN_OVERLAP:
+            continue
+        errors = _BITS[a["bits"][:length][voiced] ^ b["bits"][:length][voiced]].sum(dtype=np.int64)
+        best = min(best, errors / (16 * compared))
+    return best
+
+
+class FingerprintStore:
+    """
+    Persistent fingerprints of the recordings that were downloaded, stored in SQLite, so that a copy of a recording
+    under another title is recognized before it is downloaded completely.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path:    Path to the SQLite database (is created if it doesn't exist)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self.connection:
+            self.connection.executescript(SCHEMA)
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] < 1:
+                # Fingerprints of older versions don't mark silent frames
+                self.connection.execute("DELETE FROM fingerprints")
+                self.connection.execute("PRAGMA user_version = 1")
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def key(vo_data: VoData) -> str:
+        return vo_data.vo_id or vo_data.vo_title
+
+    def __contains__(self, vo_data: VoData) -> bool:
+        with self._lock:
+            row = self.connection.execute("SELECT 1 FROM fingerprints WHERE vo_key = ?", (self.key(vo_data),)).fetchone()
+        return row is not None
+
+    def add(self, vo_data: VoData, print_: np.ndarray):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+                (
+                    self.key(vo_data),
+                    vo_data.json(),
+                    int(vo_data.duration.total_seconds() * 1000),
+                    print_.astype(FINGERPRINT_DTYPE).tobytes(),
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
+
+    def candidates(self, vo_data: VoData, tolerance: float = 0.05) -> list[tuple[VoData, np.ndarray]]:
+        """
+        Returns the other recordings with their fingerprints whose duration is close to the duration of
+        the VO (within the given fraction or DURATION_TOLERANCE seconds). VOs without a duration have none.
+        """
+        duration_ms = int(vo_data.duration.total_seconds() * 1000)
+        if duration_ms <= 0:
+            return []
+        margin = max(duration_ms * tolerance, DURATION_TOLERANCE * 1000)
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT metadata, fingerprint FROM fingerprints WHERE duration_ms BETWEEN ? AND ? AND vo_key != ?",
+                (duration_ms - margin, duration_ms + margin, self.key(vo_data)),
+            ).fetchall()
+        return [(VoData.parse_raw(metadata), np.frombuffer(blob, dtype=FINGERPRINT_DTYPE)) for metadata, blob in rows]
+
+    def match(self, vo_data: VoData, print_: np.ndarray) -> VoData | None:
+        """
+        Returns the recording with the same fingerprint as the VO (None if there is none). Fingerprints with fewer than
+        MIN_VOICED_FRAMES non-silent frames don't match, neither do recordings whose metadata rules out that they are
+        the same (see same_recording_metadata).
+        """
+        voiced = int(print_["voiced"].sum())
+        if voiced < MIN_VOICED_FRAMES:
+            logger.info(
+                "The beginning of '%s' is mostly silent (%.0fs of sound), it can't be compared by its fingerprint",
+                vo_data.vo_title,
+                voiced * HOP_LENGTH / SAMPLE_RATE,
+            )
+            return None
+        for other, other_print in self.candidates(vo_data):
+            if not same_recording_metadata(vo_data, other):
+                continue
+            rate = bit_error_rate(print_, other_print)
+            logger.debug("Fingerprints of '%s' and '%s' differ in %.0f%% of the bits", vo_data.vo_title, other.vo_title, 100 * rate)
+            if rate <= MAX_BIT_ERROR_RATE:
+                return other
+        return None
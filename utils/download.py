@@ -1,10 +1,332 @@
 import logging
+import os
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
+import requests
 import youtube_dl as ydl
+from requests.adapters import HTTPAdapter
 
 
 logger = logging.getLogger("VO-Transcriber")
 
+MEDIA_EXTENSIONS = (".mp3", ".mp4", ".m4a", ".m4v", ".aac", ".ogg", ".oga", ".opus", ".wav", ".webm", ".mkv", ".flac")
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RangeNotSupportedError(DownloadError):
+    """
+    The server answered a range request with something else than the requested range (e.g. the whole file).
+    """
+
+
+class Progress:
+    """
+    Keeps track of the downloaded bytes of one file and logs the progress and throughput in regular intervals.
+    """
+
+    def __init__(self, name: str, total: int = None, interval: float = 10.0):
+        """
+        :param name:        Name of the download (used for logging)
+        :param total:       Total number of bytes (None if unknown)
+        :param interval:    Seconds between two progress log messages
+        """
+        self.name = name
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.received = 0
+        self._start = time.monotonic()
+        self._last_log = self._start
+        self._lock = threading.Lock()
+
+    def add(self, count: int):
+        with self._lock:
+            self.done += count
+            self.received += count
+            now = time.monotonic()
+            if now - self._last_log >= self.interval:
+                self._last_log = now
+                self.log()
+
+    def skip(self, count: int):
+        """
+        Counts bytes as done that did not have to be downloaded (e.g. because a partial download was resumed).
+        """
+        with self._lock:
+            self.done += count
+
+    def throughput(self) -> float:
+        """
+        :return:    Bytes per second received since the download was started
+        """
+        elapsed = time.monotonic() - self._start
+        return self.received / elapsed if elapsed > 0 else 0.0
+
+    def log(self):
+        if self.total:
+            logger.info(
+                "  '%s': %.1f / %.1f MB (%d%%) at %.2f MB/s",
+                self.name,
+                self.done / 2**20,
+                self.total / 2**20,
+                100 * self.done // self.total,
+                self.throughput() / 2**20,
+            )
+        else:
+            logger.info("  '%s': %.1f MB at %.2f MB/s", self.name, self.done / 2**20, self.throughput() / 2**20)
+
+
+class Downloader:
+    """
+    Downloads files over HTTP(S) with pooled connections. Partial downloads are kept as '.part' files and resumed with
+    HTTP range requests, failed requests are retried with exponential backoff and large files can be split into several
+    ranges that are downloaded in parallel.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        parallel_chunks: int = 1,
+        min_chunk_size: int = 32 * 2**20,
+        retries: int = 5,
+        backoff: float = 1.0,
+        timeout: float = 30.0,
+        block_size: int = 2**20,
+        session: requests.Session = None,
+    ):
+        """
+        :param workers:         Number of files downloaded at the same time by download_many
+        :param parallel_chunks: Number of ranges a single file is split into (1 disables splitting)
+        :param min_chunk_size:  Files are only split if every range is at least this many bytes
+        :param retries:         How often a failed request is retried
+        :param backoff:         Seconds to wait before the first retry (doubles with every retry)
+        :param timeout:         Timeout for connecting and for reading from the connection in seconds
+        :param block_size:      Number of bytes read from the connection at once
+        :param session:         Session to use (a new one with a connection pool is created if None)
+        """
+        self.workers = max(1, workers)
+        self.parallel_chunks = max(1, parallel_chunks)
+        self.min_chunk_size = min_chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.block_size = block_size
+
+        if session is None:
+            session = requests.Session()
+            pool_size = self.workers * self.parallel_chunks
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def download(self, url: str, save_path: str) -> int:
+        """
+        Downloads the given url to save_path. An existing '<save_path>.part' file is resumed.
+        :param url:         The url to download
+        :param save_path:   The path to save the file to
+        :return:            Size of the downloaded file in bytes
+        """
+        name = os.path.basename(save_path)
+        size, ranges_supported = self._probe(url)
+        progress = Progress(name, total=size)
+
+        split = ranges_supported and size and self.parallel_chunks > 1 and size >= 2 * self.min_chunk_size
+        if split:
+            chunks = min(self.parallel_chunks, size // self.min_chunk_size)
+            logger.debug("Downloading '%s' in %d parallel ranges", name, chunks)
+            try:
+                self._download_split(url, save_path, size, chunks, progress)
+            except RangeNotSupportedError as e:
+                # The HEAD request promised range support, but the ranges themselves are not served
+                logger.warning("%s, downloading '%s' as a single stream", e, name)
+                split = False
+        if not split:
+            self._download_range(url, save_path + ".part", 0, size, progress)
+            self._check_size(save_path + ".part", size)
+            os.replace(save_path + ".part", save_path)
+
+        progress.log()
+        return os.path.getsize(save_path)
+
+    def download_many(self, jobs) -> dict:
+        """
+        Downloads several files at the same time (at most 'workers' at once).
+        :param jobs:    Iterable of (url, save_path) tuples
+        :return:        Dict mapping every save_path to None on success or to the exception that occurred
+        """
+        jobs = list(jobs)
+        results = {}
+
+        def run(job):
+            url, save_path = job
+            try:
+                self.download(url, save_path)
+                results[save_path] = None
+            except Exception as e:
+                logger.error("Could not download '%s': %s", url, e)
+                results[save_path] = e
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(run, jobs))
+        return results
+
+    def _probe(self, url):
+        """
+        Finds out the size of the file and whether the server accepts range requests.
+        """
+        try:
+            response = self._request("HEAD", url, allow_redirects=True)
+            size = int(response.headers.get("Content-Length", 0)) or None
+            return size, response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        except (DownloadError, ValueError):
+            return None, False
+
+    def _request(self, method, url, **kwargs):
+        """
+        Sends a request and retries it with exponential backoff on connection errors and server errors.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code < 500:
+                    if response.status_code >= 400 and response.status_code != 416:
+                        response.close()
+                        raise DownloadError(f"Server answered {response.status_code} for '{url}'")
+                    return response
+                response.close()
+                error = DownloadError(f"Server answered {response.status_code} for '{url}'")
+            except requests.RequestException as e:
+                error = e
+
+            if attempt < self.retries:
+                delay = self.backoff * 2**attempt * random.uniform(0.8, 1.2)
+                logger.warning("Request for '%s' failed (%s), retrying in %.1fs", url, error, delay)
+                time.sleep(delay)
+
+        raise DownloadError(f"Giving up on '{url}' after {self.retries + 1} attempts: {error}")
+
+    @staticmethod
+    def _check_size(path: str, size: int | None):
+        """
+        Checks that the downloaded file has the size the server announced. A file that is too big can't be resumed, it is
+        removed.
+        """
+        actual = os.path.getsize(path)
+        if size is not None and actual != size:
+            if actual > size:
+                os.remove(path)
+            raise DownloadError(f"Downloaded {actual} bytes instead of {size} bytes into '{path}'")
+
+    def _download_range(self, url, part_path, first, length, progress, partial: bool = False):
+        """
+        Downloads 'length' bytes starting at byte 'first' into part_path (the whole file if length is None).
+        Bytes that already are in part_path are not downloaded again if the server supports range requests.
+        If partial is set, the range is a part of the file: a server that doesn't answer with exactly this range
+        (206) raises a RangeNotSupportedError instead of the whole file being written into the part.
+        """
+        have = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        progress.skip(have)
+
+        for attempt in range(self.retries + 1):
+            have = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+            if length is not None and have >= length:
+                return
+
+            headers = {}
+            if have > 0 or length is not None:
+                last = "" if length is None else str(first + length - 1)
+                headers["Range"] = f"bytes={first + have}-{last}"
+
+            response = self._request("GET", url, headers=headers, stream=True)
+            if response.status_code == 416 and not partial:
+                response.close()
+                return
+            if headers and response.status_code != 206:
+                if partial or first > 0:
+                    response.close()
+                    raise RangeNotSupportedError(f"Server answered {response.status_code} to the range request for '{url}'")
+                logger.debug("Server does not support resuming '%s', starting from the beginning", url)
+                progress.skip(-have)
+                have = 0
+
+            try:
+                with response, open(part_path, "ab" if have > 0 else "wb") as f:
+                    for block in response.iter_content(chunk_size=self.block_size):
+                        f.write(block)
+                        progress.add(len(block))
+                if length is None or os.path.getsize(part_path) >= length:
+                    return
+                error = DownloadError("Connection closed before the download was complete")
+            except requests.RequestException as e:
+                error = e
+
+            if attempt < self.retries:
+                delay = self.backoff * 2**attempt * random.uniform(0.8, 1.2)
+                logger.warning("Download of '%s' was interrupted (%s), resuming in %.1fs", url, error, delay)
+                time.sleep(delay)
+
+        raise DownloadError(f"Giving up on '{url}' after {self.retries + 1} attempts: {error}")
+
+    def _download_split(self, url, save_path, size, chunks, progress):
+        """
+        Downloads the file as several ranges in parallel and joins them afterwards.
+        """
+        chunk_size = -(-size // chunks)
+        parts = []
+        for index in range(chunks):
+            first = index * chunk_size
+            parts.append((f"{save_path}.part{index}", first, min(chunk_size, size - first)))
+
+        with ThreadPoolExecutor(max_workers=chunks) as executor:
+            futures = [
+                executor.submit(self._download_range, url, path, first, length, progress, partial=True) for path, first, length in parts
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except RangeNotSupportedError:
+                for future in futures:
+                    future.exception()
+                for path, _, _ in parts:
+                    if os.path.isfile(path):
+                        os.remove(path)
+                raise
+
+        for path, _, length in parts:
+            self._check_size(path, length)
+        with open(save_path + ".part", "wb") as out:
+            for path, _, _ in parts:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out, self.block_size)
+        self._check_size(save_path + ".part", size)
+        os.replace(save_path + ".part", save_path)
+        for path, _, _ in parts:
+            os.remove(path)
+
+
+def is_direct_link(url: str) -> bool:
+    """
+    Checks whether the url points directly to a media file (and can be downloaded without youtube_dl).
+    """
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and parsed.path.lower().endswith(MEDIA_EXTENSIONS)
+
+
+def media_extension(url: str) -> str:
+    """
+    Returns the file extension of the media file the url points to (e.g. '.mp4').
+    """
+    return os.path.splitext(urlparse(url).path)[1].lower()
+
 
 def download_only_audio(url, save_path):
     """
@@ -28,13 +350,15 @@ def download_only_audio(url, save_path):
 
 def download(url, save_path):
     """
-    Downloads the audio/video from the given url.
+    Downloads the audio/video from the given url without converting it.
     :param url:         The url to download the audio/video from
-    :param save_path:   The path to save the audio/video to (will be MP3 file)
+    :param save_path:   The path to save the audio/video to (may contain youtube_dl template fields like '%(ext)s')
+    :return:            The path of the downloaded file
     """
     ydl_opts = {
         "format": "bestaudio/best",
         "outtmpl": save_path,
     }
     with ydl.YoutubeDL(ydl_opts) as downlaod:
-        downlaod.download([url])
+        info = downlaod.extract_info(url, download=True)
+        return downlaod.prepare_filename(info)
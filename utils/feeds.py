@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from pydantic import parse_obj_as
+
+from models.VoDataModels import VoData, VoFeed
+from utils.catalog import Catalog, create_session
+from utils.ledger import RunLedger
+from utils.tracing import tracer
+from utils.vo_data import iter_vo_data, iter_vo_results
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+
+def load_manifest(path: str) -> list[VoFeed]:
+    """
+    Reads a manifest of VO-data feeds: a JSON list of feeds (or an object with the list under "feeds"), every feed with
+    the parser of its university ("uni": "uw" or "tu"), either a "link" or a "path" (relative to the manifest) and
+    optionally the titles ("vos") and "series" to select from it (every VO of the feed if neither is given).
+    :param path:    Path to the manifest
+    :return:        The feeds in the order of the manifest
+    """
+    with open(path, "r", encoding="UTF-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("feeds", [])
+    feeds = parse_obj_as(list[VoFeed], data)
+
+    folder = os.path.dirname(os.path.abspath(path))
+    return [feed.copy(update={"path": os.path.join(folder, feed.path)}) if feed.path is not None else feed for feed in feeds]
+
+
+def _intersect(own: list[str] | None, selected: list[str] | None) -> list[str] | None:
+    if own is None or selected is None:
+        return own if selected is None else selected
+    return [value for value in own if value in set(selected)]
+
+
+def feed_selection(feed: VoFeed, titles=None, series=None) -> tuple[list[str] | None, list[str] | None]:
+    """
+    Combines the selection of a feed with the selection of the command line: a VO has to be selected by both.
+    :return:    The titles and series to select from the feed (None selects any, an empty list nothing)
+    """
+    return _intersect(feed.vos, titles), _intersect(feed.series, series)
+
+
+def merge_vos(vos_per_feed) -> list[VoData]:
+    """
+    Merges the VOs of several feeds into one list. A VO that is listed in several feeds (e.g. a course that is
+    cross-listed in two series) is only kept once, in the position of the first feed that lists it.
+    """
+    merged = {}
+    listed_twice = 0
+    for vos in vos_per_feed:
+        for vo in vos:
+            if RunLedger.key(vo) in merged:
+                listed_twice += 1
+                continue
+            merged[RunLedger.key(vo)] = vo
+    if listed_twice:
+        logger.info("%d VO(s) are listed in several feeds, they are only processed once", listed_twice)
+    return list(merged.values())
+
+
+def _fetch_feed(feed: VoFeed, session, titles=None, series=None) -> list[VoData] | None:
+    titles, series = feed_selection(feed, titles, series)
+    if titles == [] or series == []:
+        return []
+    try:
+        results = iter_vo_results(feed.path, feed.link, session=session)
+        if results is None:
+            return None
+        # The feed is parsed while it arrives, so parsing one feed overlaps with fetching the others
+        with tracer.span("feed_parse", logging.INFO, feed=feed.source, uni=feed.uni) as span:
+            vos = list(iter_vo_data(results, feed.uni, titles=titles, series=series))
+            span.set(vos=len(vos))
+        return vos
+    except Exception as e:
+        logger.error("Could not load VO-data from feed '%s': %s", feed.source, e)
+        return None
+
+
+def ingest_feeds(feeds: list[VoFeed], titles=None, series=None, workers: int = 4, per_host_rate: float = None, retries: int = 3) -> list[VoData]:
+    """
+    Fetches and parses several feeds at the same time and merges their VOs. The feeds share one session, so connections
+    to the same host are reused, failed requests are retried and a host gets at most per_host_rate requests per second.
+    A feed that can't be loaded is skipped.
+    :param feeds:           The feeds (e.g. from load_manifest)
+    :param titles:          Only VOs with one of these titles are selected (None for all)
+    :param series:          Only VOs of one of these series are selected (None for all)
+    :param workers:         Number of feeds fetched at the same time
+    :param per_host_rate:   Maximum number of requests per second to the same host (None for no limit)
+    :param retries:         How often a failed request is retried
+    :return:                The selected VOs of every feed (in the order of the feeds) without VOs listed twice
+    """
+    session = create_session(pool_size=workers, retries=retries, per_host_rate=per_host_rate)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="feed") as executor:
+            vos_per_feed = list(executor.map(lambda feed: _fetch_feed(feed, session, titles, series), feeds))
+    finally:
+        session.close()
+
+    failed = [feed.source for feed, vos in zip(feeds, vos_per_feed) if vos is None]
+    if failed:
+        logger.warning("Could not load %d of %d feed(s): \n%s", len(failed), len(feeds), "\n".join(20 * " " + source for source in failed))
+    vos = merge_vos(vos for vos in vos_per_feed if vos is not None)
+    logger.info("Selected %d VO(s) from %d feed(s)", len(vos), len(feeds) - len(failed))
+    return vos
+
+
+def sync_feeds(catalog_path: str, feeds: list[VoFeed], full: bool = False, workers: int = 4, per_host_rate: float = None, retries: int = 3) -> int:
+    """
+    Syncs several feeds into the catalog at the same time (every feed with its own connection to the catalog, all of
+    them with one shared session). A feed that can't be synced keeps the VOs that are already in the catalog.
+    :param catalog_path:    Path to the catalog
+    :param feeds:           The feeds (e.g. from load_manifest)
+    :param full:            Whether every page of the feeds is fetched
+    :param workers:         Number of feeds synced at the same time
+    :param per_host_rate:   Maximum number of requests per second to the same host (None for no limit)
+    :param retries:         How often a failed request is retried
+    :return:                Number of new VOs
+    """
+    session = create_session(pool_size=workers, retries=retries, per_host_rate=per_host_rate)
+
+    def sync(feed: VoFeed) -> int:
+        catalog = Catalog(catalog_path, session=session)
+        try:
+            with tracer.span("catalog_sync", logging.INFO, feed=feed.source) as span:
+                if feed.link is not None:
+                    new = catalog.sync_link(feed.link, feed.uni, full=full)
+                else:
+                    new = catalog.sync_file(feed.path, feed.uni)
+                span.set(new=new)
+            return new
+        except Exception as e:
+            logger.error("Could not sync feed '%s', using the VOs already in the catalog: %s", feed.source, e)
+            return 0
+        finally:
+            catalog.close()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="feed") as executor:
+            return sum(executor.map(sync, feeds))
+    finally:
+        session.close()
+
+
+def select_from_feeds(catalog: Catalog, feeds: list[VoFeed], titles=None, series=None, **criteria) -> list[VoData]:
+    """
+    Selects the VOs of the given feeds from the catalog, every feed with its own selection.
+    :param catalog:     The catalog the feeds were synced into
+    :param feeds:       The feeds
+    :param titles:      Only VOs with one of these titles are selected (None for all)
+    :param series:      Only VOs of one of these series are selected (None for all)
+    :param criteria:    Further criteria of Catalog.select (since, until, pattern)
+    :return:            The selected VOs without VOs listed twice
+    """
+    vos_per_feed = []
+    for feed in feeds:
+        feed_titles, feed_series = feed_selection(feed, titles, series)
+        if feed_titles == [] or feed_series == []:
+            continue
+        vos_per_feed.append(catalog.select(titles=feed_titles, series=feed_series, feed=feed.source, **criteria))
+    return merge_vos(vos_per_feed)
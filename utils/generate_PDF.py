@@ -1,15 +1,81 @@
 import argparse
+import functools
 import logging
 import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import jinja2
 import pdfkit
 
+from utils.atomic import atomic_path
+from utils.tracing import tracer
+
 
 logger = logging.getLogger("VO-Transcriber")
 
 
+@functools.lru_cache(maxsize=None)
+def _template_env():
+    """
+    Returns the jinja2 environment for the templates (created once, compiled templates are cached by it).
+    """
+    template_loader = jinja2.FileSystemLoader(searchpath="./templates")
+    return jinja2.Environment(loader=template_loader)
+
+
+@functools.lru_cache(maxsize=None)
+def _configuration():
+    """
+    Returns the pdfkit configuration (looking up the wkhtmltopdf binary spawns a process, so it is done only once).
+    """
+    return pdfkit.configuration()
+
+
+def _pdf_options(page_numbers=False):
+    options = {
+        "page-size": "A4",
+        "margin-top": "15mm",
+        "margin-right": "15mm",
+        "margin-bottom": "15mm",
+        "margin-left": "15mm",
+    }
+    if page_numbers:
+        options["footer-right"] = "[page] / [topage]"
+    return options
+
+
+def render_vo_data_html(
+    vo_title: str,
+    autor: str,
+    beitragende: str,
+    length: timedelta,
+    recorded_on: datetime,
+    series_name: str,
+    link: str,
+    transcription: str,
+) -> str:
+    """
+    Renders the HTML page (vo_data_index.html) for the given VO.
+    The parameters are the same as for convert_to_PDF_vo_data.
+    """
+    context = {
+        "vo_titel": vo_title,
+        "autor": autor,
+        "beitragende": beitragende,
+        "length": str(length),
+        "recorded_on": recorded_on.strftime("%d.%m.%Y %H:%M"),
+        "series_name": series_name,
+        "link": link,
+        "transcription": transcription,
+    }
+    logger.debug("  Context:       %s", str({k: v for (k, v) in context.items() if k != "transcription"}))
+
+    return _template_env().get_template("vo_data_index.html").render(context)
+
+
 def convert_to_PDF_vo_data(
     output_file: str,
     vo_title: str,
@@ -41,35 +107,13 @@ def convert_to_PDF_vo_data(
     # logger.debug("  VO-Data:       " + json.dumps(vo_data))
     # logger.debug("  Transcription: " + str(transcription))
 
-    context = {
-        "vo_titel": vo_title,
-        "autor": autor,
-        "beitragende": beitragende,
-        "length": str(length),
-        "recorded_on": recorded_on.strftime("%d.%m.%Y %H:%M"),
-        "series_name": series_name,
-        "link": link,
-        "transcription": transcription,
-    }
-    logger.debug("  Context:       %s", str({k: v for (k, v) in context.items() if k != "transcription"}))
-
-    template_loader = jinja2.FileSystemLoader(searchpath="./templates")
-    template_env = jinja2.Environment(loader=template_loader)
-    template = template_env.get_template("vo_data_index.html")
+    with tracer.span("pdf", vo=vo_title):
+        output_html = render_vo_data_html(vo_title, autor, beitragende, length, recorded_on, series_name, link, transcription)
+        options = _pdf_options(page_numbers)
+        logger.debug("  Options:       %s", str(options))
 
-    output_html = template.render(context)
-    options = {
-        "page-size": "A4",
-        "margin-top": "15mm",
-        "margin-right": "15mm",
-        "margin-bottom": "15mm",
-        "margin-left": "15mm",
-    }
-    if page_numbers:
-        options["footer-right"] = "[page] / [topage]"
-    logger.debug("  Options:       %s", str(options))
-
-    pdfkit.from_string(output_html, output_file, options=options)
+        with atomic_path(output_file) as temp_file:
+            pdfkit.from_string(output_html, temp_file, options=options, configuration=_configuration())
     logger.info("Generated PDF for '%s' at '%s'", vo_title, output_file)
 
 
@@ -91,26 +135,130 @@ def convert_to_PDF(transcription, output_file, page_numbers=False):
     }
     logger.debug("  Context:       %s", str({k: v for (k, v) in context.items() if k != "transcription"}))
 
-    template_loader = jinja2.FileSystemLoader(searchpath="./templates")
-    template_env = jinja2.Environment(loader=template_loader)
-    template = template_env.get_template("vo_index.html")
-
-    output_html = template.render(context)
-    options = {
-        "page-size": "A4",
-        "margin-top": "15mm",
-        "margin-right": "15mm",
-        "margin-bottom": "15mm",
-        "margin-left": "15mm",
-    }
-    if page_numbers:
-        options["footer-right"] = "[page] / [topage]"
-    logger.debug("  Options:       %s", str(options))
+    with tracer.span("pdf", vo=os.path.basename(output_file)):
+        output_html = _template_env().get_template("vo_index.html").render(context)
+        options = _pdf_options(page_numbers)
+        logger.debug("  Options:       %s", str(options))
 
-    pdfkit.from_string(output_html, output_file, options=options)
+        with atomic_path(output_file) as temp_file:
+            pdfkit.from_string(output_html, temp_file, options=options, configuration=_configuration())
     logger.info("Generated PDF for '%s' at '%s'", os.path.basename(output_file), output_file)
 
 
+class PdfBatchRenderer:
+    """
+    Renders the PDFs of many VOs with a pool of converter workers. The templates and the wkhtmltopdf configuration are
+    set up once and shared by every PDF. Pages can also be collected and converted into one combined PDF with a
+    bookmark (and optionally a table of contents entry) for every VO.
+
+    Every separate PDF still starts its own wkhtmltopdf process: one run writes exactly one PDF, so converting several
+    VOs at once would need the result to be split again. The pool only runs these processes in parallel, it doesn't
+    save their startup. The combined PDF is the only output that converts many VOs with a single process.
+    """
+
+    def __init__(self, workers: int = None, page_numbers: bool = False, separate: bool = True, combine: bool = False):
+        """
+        :param workers:         Number of wkhtmltopdf conversions that run at the same time (defaults to the number of CPU cores)
+        :param page_numbers:    Whether to add page numbers to the PDFs
+        :param separate:        Whether to convert every submitted VO into its own PDF
+        :param combine:         Whether to keep the pages of the submitted VOs for write_combined
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.page_numbers = page_numbers
+        self.separate = separate
+        self.combine = combine
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pdf")
+        self._futures = []
+        self._pages = []
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        output_file: str,
+        vo_title: str,
+        autor: str,
+        beitragende: str,
+        length: timedelta,
+        recorded_on: datetime,
+        series_name: str,
+        link: str,
+        transcription: str,
+    ):
+        """
+        Queues the PDF of one VO. The parameters are the same as for convert_to_PDF_vo_data, output_file may be None if
+        the VO shall only be part of the combined PDF.
+        :return:    Future of the conversion (None if no separate PDF is generated)
+        """
+        output_html = render_vo_data_html(vo_title, autor, beitragende, length, recorded_on, series_name, link, transcription)
+        if self.combine:
+            with self._lock:
+                self._pages.append((recorded_on, vo_title, output_html))
+        if output_file is None or not self.separate:
+            return None
+
+        future = self._executor.submit(self._convert, output_html, output_file, vo_title)
+        with self._lock:
+            self._futures.append((vo_title, future))
+        return future
+
+    def _convert(self, output_html, output_file, vo_title):
+        logger.info("Generating PDF (with VO-Data) for '%s'", vo_title)
+        try:
+            with tracer.span("pdf", vo=vo_title), atomic_path(output_file) as temp_file:
+                pdfkit.from_string(output_html, temp_file, options=_pdf_options(self.page_numbers), configuration=_configuration())
+        except Exception as e:
+            logger.error("Could not generate PDF for '%s': %s", vo_title, e)
+            raise
+        logger.info("Generated PDF for '%s' at '%s'", vo_title, output_file)
+
+    def write_combined(self, output_file: str, toc: bool = True):
+        """
+        Converts every submitted VO into one PDF (ordered by recording date) with a single wkhtmltopdf run.
+        Every VO starts on a new page and gets a bookmark.
+        :param output_file:     Path to the output file (should end with .pdf)
+        :param toc:             Whether to add a table of contents
+        """
+        with self._lock:
+            pages = sorted(self._pages, key=lambda page: (page[0], page[1]))
+        if not pages:
+            logger.warning("No VOs to combine into '%s'", output_file)
+            return
+
+        logger.info("Generating combined PDF of %d VOs at '%s'", len(pages), output_file)
+        options = _pdf_options(self.page_numbers)
+        options["outline"] = None
+        options["outline-depth"] = "1"
+        with tempfile.TemporaryDirectory() as folder:
+            paths = []
+            for index, (_, _, output_html) in enumerate(pages):
+                path = os.path.join(folder, f"{index:05d}.html")
+                with open(path, "w", encoding="UTF-8") as f:
+                    f.write(output_html)
+                paths.append(path)
+            with tracer.span("pdf_combined", vos=len(pages)), atomic_path(output_file) as temp_file:
+                pdfkit.from_file(paths, temp_file, options=options, toc={} if toc else None, configuration=_configuration())
+        logger.info("Generated combined PDF at '%s'", output_file)
+
+    def wait(self) -> list[tuple[str, Exception]]:
+        """
+        Waits until every queued PDF is generated.
+        :return:    The title and error of every PDF that could not be generated (each is logged already)
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+        failures = [(vo_title, future.exception()) for vo_title, future in futures]
+        return [(vo_title, error) for vo_title, error in failures if error is not None]
+
+    def close(self) -> list[tuple[str, Exception]]:
+        """
+        Waits for the queued PDFs (see wait) and stops the converter workers.
+        """
+        try:
+            return self.wait()
+        finally:
+            self._executor.shutdown()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Converts a transcription to a PDF")
 
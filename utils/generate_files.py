@@ -1,16 +1,51 @@
+import argparse
+import contextlib
+import json
 import logging
-from datetime import timedelta
+import os
+import time
+
+from utils.atomic import atomic_open
+from utils.segment_store import SegmentStore
 
 
 logger = logging.getLogger("VO-Transcriber")
 
+VTT_HEADER = "WEBVTT\n\n"
+
+
+def format_timestamp(milliseconds: int, separator: str = ",") -> str:
+    """
+    Formats a time as HH:MM:SS,mmm (SRT) or HH:MM:SS.mmm (VTT, with separator ".").
+    """
+    seconds, milliseconds = divmod(int(milliseconds), 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def format_txt_segment(index, segment):
+    return segment["text"].strip()
+
+
+def format_srt_segment(index, segment):
+    start = format_timestamp(round(segment["start"] * 1000))
+    end = format_timestamp(round(segment["end"] * 1000))
+    return f"{index}\n{start} --> {end}\n{segment['text'].strip()}"
+
+
+def format_vtt_segment(index, segment):
+    start = format_timestamp(round(segment["start"] * 1000), ".")
+    end = format_timestamp(round(segment["end"] * 1000), ".")
+    return f"{start} --> {end}\n{segment['text'].strip()}"
+
 
 def generate_txt(segments, output_file=None):
     logger.debug("Generating TXT")
-    out = "\n".join(segment["text"].strip() for segment in segments)
+    out = "\n".join(format_txt_segment(index, segment) for index, segment in enumerate(segments, start=1))
 
     if output_file:
-        with open(output_file, "w", encoding="UTF-8") as f:
+        with atomic_open(output_file) as f:
             f.write(out)
             logger.info("Generated output TXT %s", output_file)
 
@@ -20,15 +55,11 @@ def generate_txt(segments, output_file=None):
 
 def generate_srt(segments, output_file=None):
     logger.debug("Generating SRT")
-    out = []
-    for index, segment in enumerate(segments, start=1):
-        start = timedelta(seconds=int(segment["start"]))
-        end = timedelta(seconds=int(segment["end"]))
-        out.append(f"{index}\n{start},000 --> {end},000\n{segment['text'].strip()}")
+    out = [format_srt_segment(index, segment) for index, segment in enumerate(segments, start=1)]
 
     result = "\n\n".join(out)
     if output_file:
-        with open(output_file, "w", encoding="UTF-8") as f:
+        with atomic_open(output_file) as f:
             f.write(result)
             logger.info("Generated output SRT %s", output_file)
 
@@ -38,17 +69,177 @@ def generate_srt(segments, output_file=None):
 
 def generate_vtt(segments, output_file=None):
     logger.debug("Generating VTT")
-    out = []
-    for segment in segments:
-        start = timedelta(seconds=int(segment["start"]))
-        end = timedelta(seconds=int(segment["end"]))
-        out.append(f"{start},000 --> {end},000\n{segment['text'].strip()}")
+    out = [format_vtt_segment(index, segment) for index, segment in enumerate(segments, start=1)]
 
-    result = "\n\n".join(out)
+    result = VTT_HEADER + "\n\n".join(out)
     if output_file:
-        with open(output_file, "w", encoding="UTF-8") as f:
+        with atomic_open(output_file) as f:
             f.write(result)
             logger.info("Generated output VTT %s", output_file)
 
     logger.debug("Finished generating VTT")
     return result
+
+
+class SegmentWriter:
+    """
+    Writes segments to a file one at a time, so that the file can be written while the audio is still transcribed.
+    Until the writer is closed the segments go to '<output_file>.part', which is flushed every flush_interval seconds,
+    so partial transcripts are readable right away. Closing renames it to output_file.
+    The written file has exactly the same content as the corresponding generate_* function would produce.
+    """
+
+    name = ""
+    header = ""
+    separator = "\n"
+    format_segment = staticmethod(format_txt_segment)
+
+    def __init__(self, output_file: str, flush_interval: float = 5.0):
+        """
+        :param output_file:     Path to the output file
+        :param flush_interval:  Seconds between two flushes of the file
+        """
+        self.output_file = output_file
+        self.partial_file = output_file + ".part"
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._file = open(self.partial_file, "w", encoding="UTF-8")
+        self._file.write(self.header)
+        self._last_flush = time.monotonic()
+
+    def write(self, segment):
+        if self.count > 0:
+            self._file.write(self.separator)
+        self.count += 1
+        self._file.write(self.format_segment(self.count, segment))
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self, complete: bool = True):
+        """
+        Closes the file.
+        :param complete:    Whether every segment was written (otherwise the partial file is kept as it is)
+        """
+        self._file.close()
+        if not complete:
+            logger.warning("Kept incomplete output %s %s", self.name, self.partial_file)
+            return
+        os.replace(self.partial_file, self.output_file)
+        logger.info("Generated output %s %s", self.name, self.output_file)
+
+
+class TxtWriter(SegmentWriter):
+    name = "TXT"
+    separator = "\n"
+    format_segment = staticmethod(format_txt_segment)
+
+
+class SrtWriter(SegmentWriter):
+    name = "SRT"
+    separator = "\n\n"
+    format_segment = staticmethod(format_srt_segment)
+
+
+class VttWriter(SegmentWriter):
+    name = "VTT"
+    header = VTT_HEADER
+    separator = "\n\n"
+    format_segment = staticmethod(format_vtt_segment)
+
+
+class MultiWriter:
+    """
+    Passes every segment on to several SegmentWriters, so all requested formats are written in the same pass.
+    """
+
+    def __init__(self, writers: list[SegmentWriter]):
+        self.writers = writers
+
+    def write(self, segment):
+        for writer in self.writers:
+            writer.write(segment)
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+
+    def close(self, complete: bool = True):
+        for writer in self.writers:
+            writer.close(complete)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(complete=exc_type is None)
+
+
+def render_all(store: SegmentStore, txt=None, srt=None, vtt=None, json_file=None, pdf=False):
+    """
+    Renders every requested format in a single pass over the segment store.
+    :param store:       The segments to render
+    :param txt:         Path of the txt file to write (None to skip it)
+    :param srt:         Path of the srt file to write (None to skip it)
+    :param vtt:         Path of the vtt file to write (None to skip it)
+    :param json_file:   Path of the json file to write (None to skip it)
+    :param pdf:         Whether to return the text for the PDF body
+    :return:            The text for the PDF body (same as the txt file) or None if pdf is False
+    """
+    logger.debug("Rendering %d segments", len(store))
+    paths = {name: path for name, path in (("txt", txt), ("srt", srt), ("vtt", vtt), ("json", json_file)) if path}
+    # Every file is written to a temporary file and only renamed when all of them are complete
+    with contextlib.ExitStack() as stack:
+        files = {name: stack.enter_context(atomic_open(path)) for name, path in paths.items()}
+        if "vtt" in files:
+            files["vtt"].write(VTT_HEADER)
+        if "json" in files:
+            files["json"].write('{"segments": [')
+        body = [] if pdf else None
+
+        for index, (start, end, text) in enumerate(store):
+            if "txt" in files:
+                files["txt"].write(text if index == 0 else "\n" + text)
+            if "srt" in files or "vtt" in files:
+                start_text = format_timestamp(start)
+                end_text = format_timestamp(end)
+                separator = "" if index == 0 else "\n\n"
+                if "srt" in files:
+                    files["srt"].write(f"{separator}{index + 1}\n{start_text} --> {end_text}\n{text}")
+                if "vtt" in files:
+                    # VTT only differs in the separator between seconds and milliseconds
+                    files["vtt"].write(f"{separator}{start_text[:-4]}.{start_text[-3:]} --> {end_text[:-4]}.{end_text[-3:]}\n{text}")
+            if "json" in files:
+                segment = {"id": index, "start": start / 1000, "end": end / 1000, "text": text}
+                files["json"].write(("\n" if index == 0 else ",\n") + json.dumps(segment, ensure_ascii=False))
+            if body is not None:
+                body.append(text)
+
+        if "json" in files:
+            files["json"].write("\n]}\n")
+
+    for name, path in paths.items():
+        logger.info("Generated output %s %s", name.upper(), path)
+
+    return "\n".join(body) if body is not None else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Renders a saved segment store to txt, srt, vtt and json files")
+
+    parser.add_argument("--txt", type=str, help="Path of the txt file to write")
+    parser.add_argument("--srt", type=str, help="Path of the srt file to write")
+    parser.add_argument("--vtt", type=str, help="Path of the vtt file to write")
+    parser.add_argument("--json", type=str, help="Path of the json file to write")
+    parser.add_argument("store", type=str, help="Path to the segment store (.segs file)")
+
+    args = parser.parse_args()
+
+    if not any((args.txt, args.srt, args.vtt, args.json)):
+        parser.error("At least one of --txt, --srt, --vtt or --json is required")
+
+    render_all(SegmentStore.load(args.store), txt=args.txt, srt=args.srt, vtt=args.vtt, json_file=args.json)
@@ -0,0 +1,222 @@
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    title           TEXT NOT NULL,
+    vo_data         TEXT NOT NULL,
+    options         TEXT NOT NULL,
+    priority        INTEGER NOT NULL DEFAULT 0,
+    status          TEXT NOT NULL DEFAULT 'queued',
+    stage           TEXT,
+    progress        REAL NOT NULL DEFAULT 0,
+    worker          INTEGER,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    error           TEXT,
+    outputs         TEXT,
+    created_at      TEXT NOT NULL,
+    started_at      TEXT,
+    finished_at     TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, id);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+COLUMNS = (
+    "id",
+    "title",
+    "vo_data",
+    "options",
+    "priority",
+    "status",
+    "stage",
+    "progress",
+    "worker",
+    "attempts",
+    "error",
+    "outputs",
+    "created_at",
+    "started_at",
+    "finished_at",
+)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _to_job(row) -> dict | None:
+    if row is None:
+        return None
+    job = dict(zip(COLUMNS, row))
+    job["vo_data"] = json.loads(job["vo_data"])
+    job["options"] = json.loads(job["options"])
+    job["outputs"] = json.loads(job["outputs"]) if job["outputs"] else {}
+    return job
+
+
+class JobQueue:
+    """
+    Persistent priority queue of transcription jobs (one job per VO) stored in SQLite, so that queued jobs survive a
+    restart of the server. Jobs with a higher priority are handed out first, jobs with the same priority in the order
+    they were submitted. The queue can be used by several processes at the same time (every process opens its own
+    JobQueue on the same database).
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path:    Path to the SQLite database (is created if it doesn't exist)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def submit(self, vo_data, options: dict, priority: int = 0) -> int:
+        """
+        Adds a job to the queue.
+        :param vo_data:     The VoData of the VO to transcribe
+        :param options:     Transcription and output options of the job
+        :param priority:    Jobs with a higher priority are started first
+        :return:            The id of the job
+        """
+        with self._lock:
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (title, vo_data, options, priority, created_at) VALUES (?, ?, ?, ?, ?)",
+                (vo_data.vo_title, vo_data.json(), json.dumps(options), priority, _now()),
+            )
+        return cursor.lastrowid
+
+    def claim(self, worker: int) -> dict | None:
+        """
+        Takes the queued job with the highest priority and marks it as running.
+        :param worker:  Index of the worker that runs the job
+        :return:        The job or None if the queue is empty
+        """
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY priority DESC, id LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, stage = NULL, progress = 0, "
+                        "error = NULL, started_at = ? WHERE id = ?",
+                        (RUNNING, worker, _now(), row[0]),
+                    )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def update(self, job_id: int, stage: str = None, progress: float = None):
+        """
+        Updates the stage and/or progress (0 to 1) of a running job.
+        """
+        with self._lock:
+            if stage is not None:
+                self.connection.execute("UPDATE jobs SET stage = ? WHERE id = ?", (stage, job_id))
+            if progress is not None:
+                self.connection.execute("UPDATE jobs SET progress = ? WHERE id = ?", (progress, job_id))
+
+    def finish(self, job_id: int, outputs: dict):
+        """
+        Marks a job as done.
+        :param outputs:     The generated output files (format -> path)
+        """
+        with self._lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, progress = 1, outputs = ?, finished_at = ? WHERE id = ?",
+                (DONE, json.dumps(outputs), _now(), job_id),
+            )
+
+    def fail(self, job_id: int, error: str, retries: int = 0):
+        """
+        Marks a job as failed. It is queued again if it was attempted at most retries times.
+        """
+        with self._lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts <= ? THEN ? ELSE ? END, error = ?, finished_at = ? WHERE id = ?",
+                (retries, QUEUED, FAILED, error, _now(), job_id),
+            )
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Cancels a queued job (running jobs can't be cancelled).
+        :return:    Whether the job was cancelled
+        """
+        with self._lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?", (CANCELLED, _now(), job_id, QUEUED)
+            )
+        return cursor.rowcount > 0
+
+    def requeue_running(self, worker: int = None) -> int:
+        """
+        Queues the running jobs (of the given worker, or of every worker if None) again, e.g. after a crash.
+        :return:    Number of jobs queued again
+        """
+        with self._lock:
+            if worker is None:
+                cursor = self.connection.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+            else:
+                cursor = self.connection.execute(
+                    "UPDATE jobs SET status = ? WHERE status = ? AND worker = ?", (QUEUED, RUNNING, worker)
+                )
+        return cursor.rowcount
+
+    def get(self, job_id: int) -> dict | None:
+        with self._lock:
+            row = self.connection.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _to_job(row)
+
+    def list(self, status: str = None, limit: int = 100) -> list[dict]:
+        """
+        Returns the jobs (newest first), optionally only the ones with the given status.
+        """
+        query = f"SELECT {', '.join(COLUMNS)} FROM jobs"
+        params = []
+        if status is not None:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [_to_job(row) for row in rows]
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def position(self, job_id: int) -> int | None:
+        """
+        Returns how many queued jobs will be started before the given job (None if it is not queued).
+        """
+        with self._lock:
+            row = self.connection.execute("SELECT priority, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[1] != QUEUED:
+                return None
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND (priority > ? OR (priority = ? AND id < ?))",
+                (QUEUED, row[0], row[0], job_id),
+            ).fetchone()[0]
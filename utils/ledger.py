@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from models.VoDataModels import VoData
+from utils.cache import hash_file
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vos (
+    vo_key          TEXT PRIMARY KEY,
+    title           TEXT NOT NULL,
+    metadata        TEXT,
+    updated_at      TEXT
+);
+
+CREATE TABLE IF NOT EXISTS stages (
+    vo_key          TEXT NOT NULL,
+    stage           TEXT NOT NULL,
+    path            TEXT,
+    size            INTEGER,
+    mtime_ns        INTEGER,
+    checksum        TEXT,
+    params          TEXT,
+    seconds         REAL,
+    finished_at     TEXT,
+    PRIMARY KEY (vo_key, stage)
+);
+"""
+
+
+def _params(params: dict = None) -> str:
+    return json.dumps(params or {}, sort_keys=True)
+
+
+class RunLedger:
+    """
+    Persistent record of which stages (download, prepare, transcribe, every rendered format, ...) are finished for which
+    VO. Every finished stage stores the artifact it produced together with its size, modification time, checksum, the
+    parameters it was produced with and how long it took. A restarted run asks the ledger which stages it can skip:
+    a stage only counts as completed if it was run with the same parameters and its artifact is still intact.
+    """
+
+    def __init__(self, path: str, timeout: float = 60.0, on_finish=None):
+        """
+        :param path:        Path to the SQLite database (is created if it doesn't exist)
+        :param timeout:     Seconds a write waits for another process that holds the lock of the database
+        :param on_finish:   Function that is called with the VO whenever one of its stages is recorded as finished
+        """
+        self.path = path
+        self.skipped = 0
+        self.on_finish = on_finish
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        with self._lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def key(vo_data: VoData) -> str:
+        return vo_data.vo_id or vo_data.vo_title
+
+    def record_vo(self, vo_data: VoData):
+        """
+        Stores the metadata of the given VO.
+        """
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO vos VALUES (?, ?, ?, ?)",
+                (self.key(vo_data), vo_data.vo_title, vo_data.json(), datetime.now(timezone.utc).isoformat()),
+            )
+
+    def finish(self, vo_data: VoData, stage: str, path: str, params: dict = None, seconds: float = None) -> str:
+        """
+        Records that the given stage is finished for the given VO.
+        :param vo_data:     The VO
+        :param stage:       Name of the stage
+        :param path:        Path of the artifact the stage produced
+        :param params:      Parameters the artifact depends on (the stage has to be redone if they change)
+        :param seconds:     How long the stage took
+        :return:            The checksum of the artifact
+        """
+        stat = os.stat(path)
+        checksum = hash_file(path)
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.key(vo_data),
+                    stage,
+                    path,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    checksum,
+                    _params(params),
+                    seconds,
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
+        if self.on_finish is not None:
+            self.on_finish(vo_data)
+        return checksum
+
+    def completed(self, vo_data: VoData, stage: str, params: dict = None) -> dict | None:
+        """
+        Checks whether the given stage is completed for the given VO. The artifact is verified: its size has to match and
+        if it was modified since the stage finished, its checksum has to match as well. Records that don't hold anymore
+        are removed.
+        :param vo_data:     The VO
+        :param stage:       Name of the stage
+        :param params:      Parameters the artifact has to be produced with
+        :return:            The record (path, checksum, seconds, params) or None if the stage has to be (re)done
+        """
+        vo_key = self.key(vo_data)
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT path, size, mtime_ns, checksum, params, seconds FROM stages WHERE vo_key = ? AND stage = ?",
+                (vo_key, stage),
+            ).fetchone()
+        if row is None:
+            return None
+
+        path, size, mtime_ns, checksum, stored_params, seconds = row
+        if stored_params != _params(params):
+            logger.debug("Parameters of stage '%s' of '%s' changed, it is redone", stage, vo_data.vo_title)
+            return None
+
+        reason = None
+        try:
+            stat = os.stat(path)
+            if stat.st_size != size:
+                reason = "its size changed"
+            elif stat.st_mtime_ns != mtime_ns and hash_file(path) != checksum:
+                reason = "its content changed"
+        except FileNotFoundError:
+            reason = "it is missing"
+
+        if reason is not None:
+            logger.warning("Output '%s' of stage '%s' of '%s' is not intact (%s), it is redone", path, stage, vo_data.vo_title, reason)
+            self.forget(vo_data, stage)
+            return None
+
+        with self._lock:
+            self.skipped += 1
+        return {"path": path, "checksum": checksum, "seconds": seconds, "params": json.loads(stored_params)}
+
+    def records(self, stage: str) -> list[tuple[VoData, dict]]:
+        """
+        Returns every VO the given stage is recorded for together with the record (path, size, checksum, seconds). Unlike
+        completed the artifacts are not verified.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT vos.metadata, stages.path, stages.size, stages.checksum, stages.seconds FROM stages "
+                "JOIN vos ON vos.vo_key = stages.vo_key WHERE stages.stage = ? ORDER BY vos.title",
+                (stage,),
+            ).fetchall()
+        return [
+            (VoData.parse_raw(metadata), {"path": path, "size": size, "checksum": checksum, "seconds": seconds})
+            for metadata, path, size, checksum, seconds in rows
+        ]
+
+    def stage_records(self, vo_data: VoData, root: str) -> list[dict]:
+        """
+        Returns the records of every finished stage of the given VO, e.g. to pass them on to another machine.
+        :param vo_data:     The VO
+        :param root:        Folder the paths of the artifacts are made relative to (e.g. the shared output folder)
+        :return:            The records (JSON-serializable)
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT stage, path, size, mtime_ns, checksum, params, seconds, finished_at FROM stages WHERE vo_key = ? ORDER BY stage",
+                (self.key(vo_data),),
+            ).fetchall()
+        columns = ("stage", "path", "size", "mtime_ns", "checksum", "params", "seconds", "finished_at")
+        records = [dict(zip(columns, row)) for row in rows]
+        for record in records:
+            record["path"] = os.path.relpath(record["path"], root)
+        return records
+
+    def restore(self, vo_data: VoData, records: list[dict], root: str):
+        """
+        Records the stages of the given VO that were finished elsewhere (see stage_records). A stage that is recorded
+        here already is only replaced by a record that finished later. The artifacts are verified by completed as usual.
+        :param vo_data:     The VO
+        :param records:     The records from stage_records
+        :param root:        Folder the paths of the artifacts are relative to
+        """
+        with self._lock, self.connection:
+            for record in records:
+                self.connection.execute(
+                    "INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (vo_key, stage) DO UPDATE SET "
+                    "path = excluded.path, size = excluded.size, mtime_ns = excluded.mtime_ns, checksum = excluded.checksum, "
+                    "params = excluded.params, seconds = excluded.seconds, finished_at = excluded.finished_at "
+                    "WHERE excluded.finished_at > stages.finished_at",
+                    (
+                        self.key(vo_data),
+                        record["stage"],
+                        os.path.join(root, record["path"]),
+                        record["size"],
+                        record["mtime_ns"],
+                        record["checksum"],
+                        record["params"],
+                        record["seconds"],
+                        record["finished_at"],
+                    ),
+                )
+
+    def forget(self, vo_data: VoData, stage: str = None):
+        """
+        Removes the record of the given stage (or of every stage if stage is None) of the given VO.
+        """
+        with self._lock, self.connection:
+            if stage is None:
+                self.connection.execute("DELETE FROM stages WHERE vo_key = ?", (self.key(vo_data),))
+            else:
+                self.connection.execute("DELETE FROM stages WHERE vo_key = ? AND stage = ?", (self.key(vo_data), stage))
+
+    def log_stats(self):
+        with self._lock:
+            rows = self.connection.execute("SELECT stage, COUNT(*), SUM(seconds) FROM stages GROUP BY stage ORDER BY stage").fetchall()
+        logger.info(
+            "Run ledger: %d completed stage(s) skipped in this run, recorded stages:\n%s",
+            self.skipped,
+            "\n".join(f"{20 * ' '}{stage}: {count} VO(s), {seconds or 0:.1f}s in total" for stage, count, seconds in rows),
+        )
@@ -0,0 +1,188 @@
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+_STOP = object()
+# Returned by a stage function to drop the item without counting it as failed (e.g. a duplicate that isn't processed)
+SKIP = object()
+_worker = threading.local()
+
+
+def worker_index() -> int:
+    """
+    Returns the index of the stage worker the calling thread belongs to (0 when called outside of a pipeline).
+    Can be used to give every worker of a stage its own resources (e.g. its own whisper model).
+    """
+    return getattr(_worker, "index", 0)
+
+
+class Stage:
+    """
+    One step of a pipeline. The function is called with the item produced by the previous stage and its return value
+    is passed on to the next stage.
+    """
+
+    def __init__(self, name: str, func, workers: int = 1, queue_size: int = 1, acquire=None, release=None):
+        """
+        :param name:        Name of the stage (used for logging)
+        :param func:        Function that processes one item
+        :param workers:     Number of threads working on this stage concurrently
+        :param queue_size:  Number of finished items that may wait for the next stage before this stage blocks
+        :param acquire:     Semaphore that is acquired before an item enters this stage
+        :param release:     Semaphore that is released after an item left this stage (must be acquired by an earlier stage)
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.acquire = acquire
+        self.release = release
+        self.busy_seconds = 0.0
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+
+class _Job:
+    def __init__(self, index, item):
+        self.index = index
+        self.source = item
+        self.item = item
+        self.ok = True
+        self.held = []
+
+    def release_all(self):
+        for semaphore in self.held:
+            semaphore.release()
+        self.held = []
+
+
+def run_pipeline(items, stages: list[Stage], on_finished=None) -> list:
+    """
+    Runs every item through the given stages. All stages run at the same time and are connected by bounded queues, so
+    that e.g. the next VO is downloaded while the current one is transcribed. A stage blocks when the queue to the next
+    stage is full (backpressure). Items whose stage function raises an exception are logged and dropped, items for which
+    it returns SKIP are dropped silently.
+    :param items:       The items to feed into the first stage, taken one by one when the first stage has room for them
+                        (may be a generator that produces items while the pipeline runs)
+    :param stages:      The stages every item passes through (in order)
+    :param on_finished: Function that is called with every input item and whether it passed every stage (True) or
+                        was dropped because a stage failed (False), as soon as the item left the pipeline
+    :return:            The results of the last stage, ordered like the input items (None for dropped items)
+    """
+    results = {}
+    count = [0]
+    queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+    queues.append(queue.Queue())
+
+    def work(stage_number, stage, index, remaining):
+        _worker.index = index
+        in_queue = queues[stage_number]
+        out_queue = queues[stage_number + 1]
+        while True:
+            job = in_queue.get()
+            if job is _STOP:
+                with stage._lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    out_queue.put(_STOP)
+                return
+
+            try:
+                if stage.acquire is not None:
+                    stage.acquire.acquire()
+                    job.held.append(stage.acquire)
+                start = datetime.now()
+                job.item = stage.func(job.item)
+                end = datetime.now()
+                with stage._lock:
+                    stage.busy_seconds += (end - start).total_seconds()
+                    stage.processed += 1
+                if stage.release is not None and stage.release in job.held:
+                    job.held.remove(stage.release)
+                    stage.release.release()
+                if job.item is SKIP:
+                    with stage._lock:
+                        stage.skipped += 1
+                    job.release_all()
+                    job.item = None
+                    # Dropped items leave the pipeline right away (before the last stage passes on _STOP)
+                    queues[-1].put(job)
+                    continue
+            except Exception:
+                logger.exception("Stage '%s' failed for item %d, dropping it", stage.name, job.index)
+                with stage._lock:
+                    stage.failed += 1
+                job.release_all()
+                job.item = None
+                job.ok = False
+                queues[-1].put(job)
+                continue
+
+            out_queue.put(job)
+
+    threads = []
+    for stage_number, stage in enumerate(stages):
+        remaining = [stage.workers]
+        for index in range(stage.workers):
+            thread = threading.Thread(
+                target=work,
+                args=(stage_number, stage, index, remaining),
+                name=f"{stage.name}-{index}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+
+    def feed():
+        try:
+            for index, item in enumerate(items):
+                queues[0].put(_Job(index, item))
+                count[0] = index + 1
+        except Exception:
+            logger.exception("Could not get the next item of the pipeline, stopping")
+        finally:
+            for _ in range(stages[0].workers):
+                queues[0].put(_STOP)
+
+    start = datetime.now()
+    # The items are fed by a thread, so that the finished items are handled while the next ones are produced
+    feeder = threading.Thread(target=feed, name="pipeline-feed", daemon=True)
+    feeder.start()
+
+    while True:
+        job = queues[-1].get()
+        if job is _STOP:
+            break
+        job.release_all()
+        results[job.index] = job.item
+        if on_finished is not None:
+            try:
+                on_finished(job.source, job.ok)
+            except Exception:
+                logger.exception("Handling finished item %d failed", job.index)
+
+    feeder.join()
+
+    for thread in threads:
+        thread.join()
+    end = datetime.now()
+
+    logger.info("Pipeline finished in %s", str(end - start))
+    for stage in stages:
+        logger.info(
+            "  Stage %-12s %d done, %d skipped, %d failed, busy for %s (%d worker(s))",
+            stage.name,
+            stage.processed - stage.skipped,
+            stage.skipped,
+            stage.failed,
+            str(timedelta(seconds=round(stage.busy_seconds))),
+            stage.workers,
+        )
+    return [results.get(index) for index in range(count[0])]
@@ -0,0 +1,293 @@
+import json
+import logging
+import os
+import re
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from models.VoDataModels import VoData
+from utils.atomic import atomic_open
+from utils.ledger import RunLedger
+from utils.tracing import tracer
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+# The whisper models from the fastest to the most accurate
+MODEL_SIZES = ("tiny", "base", "small", "medium", "large")
+RTF_FILE = "rtf.json"
+# Seconds of audio a model transcribes to calibrate its real-time factor
+CALIBRATION_SECONDS = 30.0
+# Weight of a new measurement in the real-time factor of a model (the rest is the previous estimate)
+OBSERVATION_WEIGHT = 0.3
+# Assumed length of VOs whose VO-data has no duration (a typical lecture)
+UNKNOWN_DURATION = 5400.0
+# Share of the time until the deadline the plan may use (the rest covers downloads and estimation errors)
+DEADLINE_MARGIN = 0.9
+# A finished transcription whose duration differs from the estimate by more than this fraction is logged
+DIVERGENCE = 0.25
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)([dhms])")
+DURATION_UNITS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+
+
+def parse_deadline(text: str) -> datetime:
+    """
+    Parses a deadline, either a time from now ('90m', '2h', '1h30m', '1d') or a date and time ('YYYY-MM-DDTHH:MM').
+    :return:    The deadline as local time
+    """
+    parts = DURATION_PART.findall(text.strip().lower())
+    if parts and "".join(number + unit for number, unit in parts) == text.strip().lower():
+        return datetime.now() + timedelta(seconds=sum(float(number) * DURATION_UNITS[unit] for number, unit in parts))
+    return datetime.fromisoformat(text)
+
+
+def model_ladder(best: str, worst: str = "tiny") -> list[str]:
+    """
+    Returns the models the scheduler may choose from, from the fastest to the most accurate. Models that are not part
+    of MODEL_SIZES (e.g. 'large-v2' or 'medium.en') can't be exchanged for another size.
+    """
+    if best not in MODEL_SIZES or worst not in MODEL_SIZES:
+        logger.warning("The size of model '%s' can't be adapted, only sizes of %s can", best, ", ".join(MODEL_SIZES))
+        return [best]
+    return list(MODEL_SIZES[MODEL_SIZES.index(worst) : MODEL_SIZES.index(best) + 1])
+
+
+def _duration(vo_data: VoData) -> float:
+    return vo_data.duration.total_seconds() or UNKNOWN_DURATION
+
+
+class RtfTable:
+    """
+    Real-time factors (seconds it takes to transcribe a second of audio of a VO) of the models on this host, stored as
+    JSON. A factor is first measured by a calibration and then updated with every transcription of a VO. Factors are
+    kept per backend, device, precision and parallelism (number of chunk workers per VO and VOs transcribed at the same
+    time).
+    """
+
+    def __init__(self, path: str, backend: str = "whisper", device: str = "cpu", fp16: bool = False):
+        """
+        :param path:        Path to the JSON file (is created if it doesn't exist)
+        :param backend:     Backend the models run on
+        :param device:      Device the models run on
+        :param fp16:        Whether the models use half precision
+        """
+        self.path = path
+        self.backend = backend
+        self.device = device
+        self.fp16 = fp16
+        self.prefix = f"{socket.gethostname()}/{backend}/{device}/{'fp16' if fp16 else 'fp32'}"
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, encoding="UTF-8") as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                logger.warning("Real-time factors in '%s' are corrupt, they are measured again", path)
+
+    def _key(self, model_name: str, chunk_workers: int, transcribe_workers: int) -> str:
+        return f"{self.prefix}/{model_name}/{chunk_workers}x{transcribe_workers}"
+
+    def get(self, model_name: str, chunk_workers: int = 1, transcribe_workers: int = 1) -> float | None:
+        """
+        Returns the real-time factor of the model (None if it was never measured). Without a measurement for the
+        parallelism, the calibration of a single model is used and chunk workers are assumed to speed it up linearly,
+        the first transcriptions correct it.
+        :param model_name:          Name of the model
+        :param chunk_workers:       Number of processes a VO is transcribed with in parallel chunks
+        :param transcribe_workers:  Number of VOs that are transcribed at the same time
+        """
+        with self._lock:
+            entry = self.entries.get(self._key(model_name, chunk_workers, transcribe_workers))
+            if entry is None and (chunk_workers, transcribe_workers) != (1, 1):
+                entry = self.entries.get(self._key(model_name, 1, 1))
+                return None if entry is None else entry["rtf"] / chunk_workers
+        return None if entry is None else entry["rtf"]
+
+    def observe(self, model_name: str, audio_seconds: float, seconds: float, chunk_workers: int = 1, transcribe_workers: int = 1):
+        """
+        Updates the real-time factor of the model with a measurement.
+        :param model_name:          Name of the model
+        :param audio_seconds:       Seconds of audio that were transcribed
+        :param seconds:             Seconds the transcription took (without loading the model)
+        :param chunk_workers:       Number of processes the VO was transcribed with in parallel chunks
+        :param transcribe_workers:  Number of VOs that were transcribed at the same time
+        """
+        if audio_seconds <= 0:
+            return
+        rtf = seconds / audio_seconds
+        key = self._key(model_name, chunk_workers, transcribe_workers)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {"rtf": rtf, "measurements": 0}
+            else:
+                entry["rtf"] = (1 - OBSERVATION_WEIGHT) * entry["rtf"] + OBSERVATION_WEIGHT * rtf
+            entry["measurements"] += 1
+            entry["updated_at"] = datetime.now().isoformat(timespec="seconds")
+            self.entries[key] = entry
+            with atomic_open(self.path) as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+        logger.debug("Real-time factor of '%s': %.3f (measured %.3f)", key, entry["rtf"], rtf)
+
+    def calibrate(self, model_name: str, audio, language: str = None) -> float:
+        """
+        Measures the real-time factor of a single model by transcribing the given audio.
+        :param model_name:  Name of the model
+        :param audio:       The audio samples (16 kHz, float32), CALIBRATION_SECONDS are used
+        :param language:    Language of the audio
+        :return:            The real-time factor
+        """
+        from utils.audio import SAMPLE_RATE
+        from utils.transcribe import model_cache
+
+        model = model_cache.get(model_name, device=self.device, fp16=self.fp16, backend=self.backend)
+        audio = audio[: int(CALIBRATION_SECONDS * SAMPLE_RATE)]
+        with tracer.span("calibrate", logging.INFO, model=model_name, audio_seconds=len(audio) / SAMPLE_RATE) as span:
+            for _ in model.transcribe(audio, language=language):
+                pass
+        self.observe(model_name, len(audio) / SAMPLE_RATE, span.seconds)
+        return self.get(model_name)
+
+
+class DeadlineScheduler:
+    """
+    Decides in which order the VOs are transcribed and with which model, so that every VO is transcribed by the deadline
+    with the most accurate models possible. The transcription time of a VO is estimated from its duration and the
+    real-time factor of the model. VOs with a higher priority come first and keep the better models longest, within the
+    same priority the longest VOs come first. Whenever a transcription finishes the plan for the VOs that are not being
+    transcribed yet is made again with the updated real-time factors.
+    """
+
+    def __init__(self, vos: list[VoData], deadline: datetime, models: list[str], rtf, priorities: dict = None, concurrency: int = 1):
+        """
+        :param vos:         The VOs to transcribe
+        :param deadline:    When every VO shall be transcribed
+        :param models:      The models to choose from, from the fastest to the most accurate
+        :param rtf:         Function that returns the current real-time factor of a model
+        :param priorities:  Priority per VO, keyed by RunLedger.key (higher first, default 0)
+        :param concurrency: Number of VOs that are transcribed at the same time
+        """
+        self.deadline = deadline
+        self.models = models
+        self.rtf = rtf
+        self.concurrency = max(1, concurrency)
+        self.priorities = priorities or {}
+        self._lock = threading.Lock()
+        # VOs that are not handed out yet, in the planned order
+        self.pending = sorted(vos, key=lambda vo: (-self.priorities.get(RunLedger.key(vo), 0), -_duration(vo)))
+        # VOs that are handed out (their model can still change until their transcription starts)
+        self.queued = {}
+        # VOs that are being transcribed with their model and start
+        self.running = {}
+        self.plan = {}
+        self.finish_estimate = None
+        self.replan()
+
+    def _seconds(self, vo_data: VoData, model_name: str) -> float:
+        return _duration(vo_data) * self.rtf(model_name)
+
+    def replan(self):
+        """
+        Chooses the models of the VOs whose transcription didn't start yet. Every VO starts with the most accurate
+        model, as long as the estimated time exceeds the time left the VO whose next faster model saves the most time
+        is moved to it (VOs with a lower priority first).
+        """
+        with self._lock:
+            now = datetime.now()
+            # Seconds of transcription (summed over the concurrent transcriptions) that are left
+            busy = sum(
+                max(0.0, self._seconds(vo_data, model_name) - (now - start).total_seconds())
+                for vo_data, model_name, start in self.running.values()
+            )
+            vos = [*self.queued.values(), *self.pending]
+            levels = {RunLedger.key(vo): len(self.models) - 1 for vo in vos}
+            available = DEADLINE_MARGIN * self.concurrency * (self.deadline - now).total_seconds() - busy
+            needed = sum(self._seconds(vo, self.models[-1]) for vo in vos)
+
+            def saving(vo):
+                # Seconds the next faster model saves
+                level = levels[RunLedger.key(vo)]
+                return self._seconds(vo, self.models[level]) - self._seconds(vo, self.models[level - 1])
+
+            while needed > available:
+                candidates = [vo for vo in vos if levels[RunLedger.key(vo)] > 0]
+                if not candidates:
+                    break
+                lowest = min(self.priorities.get(RunLedger.key(vo), 0) for vo in candidates)
+                vo = max((vo for vo in candidates if self.priorities.get(RunLedger.key(vo), 0) == lowest), key=saving)
+                needed -= saving(vo)
+                levels[RunLedger.key(vo)] -= 1
+
+            plan = {RunLedger.key(vo): self.models[levels[RunLedger.key(vo)]] for vo in vos}
+            finish = now + timedelta(seconds=(busy + needed) / self.concurrency)
+            changed = plan != {key: self.plan.get(key) for key in plan}
+            self.plan.update(plan)
+            self.finish_estimate = finish
+
+        if changed:
+            counts = {model_name: list(plan.values()).count(model_name) for model_name in self.models if model_name in plan.values()}
+            logger.info(
+                "Plan for %d VO(s): %s, transcribed by %s (deadline %s)",
+                len(plan),
+                ", ".join(f"{count}x {model_name}" for model_name, count in counts.items()),
+                finish.strftime("%Y-%m-%d %H:%M:%S"),
+                self.deadline.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+        if vos and needed > available:
+            logger.warning(
+                "The deadline can't be met even with model '%s', the VOs are estimated to be transcribed by %s",
+                self.models[0],
+                finish.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+
+    def model_for(self, vo_data: VoData) -> str:
+        """
+        Returns the model the VO is (planned to be) transcribed with.
+        """
+        with self._lock:
+            if RunLedger.key(vo_data) in self.running:
+                return self.running[RunLedger.key(vo_data)][1]
+            return self.plan.get(RunLedger.key(vo_data), self.models[-1])
+
+    def start(self, vo_data: VoData) -> str:
+        """
+        Marks the VO as being transcribed, its model doesn't change anymore.
+        :return:    The model to transcribe the VO with
+        """
+        model_name = self.model_for(vo_data)
+        with self._lock:
+            self.queued.pop(RunLedger.key(vo_data), None)
+            self.running[RunLedger.key(vo_data)] = (vo_data, model_name, datetime.now())
+        return model_name
+
+    def finished(self, vo_data: VoData):
+        """
+        Marks the VO as transcribed (or given up) and plans the remaining VOs again.
+        """
+        with self._lock:
+            self.queued.pop(RunLedger.key(vo_data), None)
+            entry = self.running.pop(RunLedger.key(vo_data), None)
+        if entry is None:
+            return
+
+        _, model_name, start = entry
+        seconds = (datetime.now() - start).total_seconds()
+        estimate = self._seconds(vo_data, model_name)
+        if estimate and abs(seconds - estimate) > DIVERGENCE * estimate:
+            logger.info("Transcribing '%s' took %.1fs instead of the estimated %.1fs, planning again", vo_data.vo_title, seconds, estimate)
+        self.replan()
+
+    def __iter__(self):
+        """
+        Hands out the VOs in the planned order.
+        """
+        while True:
+            with self._lock:
+                if not self.pending:
+                    return
+                vo_data = self.pending.pop(0)
+                self.queued[RunLedger.key(vo_data)] = vo_data
+            yield vo_data
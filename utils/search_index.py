@@ -0,0 +1,312 @@
+import bisect
+import logging
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+
+from models.VoDataModels import VoData
+from utils.segment_store import SegmentStore
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+INDEX_FILE = "search.sqlite"
+TOKEN = re.compile(r"\w+")
+# A query consists of phrases in double quotes and single words, a word ending with '*' matches every term it prefixes
+QUERY_PART = re.compile(r'"([^"]*)"?|(\S+)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id              INTEGER PRIMARY KEY,
+    vo_key          TEXT NOT NULL UNIQUE,
+    title           TEXT NOT NULL,
+    series          TEXT,
+    link            TEXT,
+    checksum        TEXT,
+    tokens          INTEGER,
+    segment_tokens  BLOB,
+    indexed_at      TEXT
+);
+
+CREATE TABLE IF NOT EXISTS segments (
+    document        INTEGER NOT NULL,
+    segment         INTEGER NOT NULL,
+    start_ms        INTEGER,
+    end_ms          INTEGER,
+    text            TEXT,
+    PRIMARY KEY (document, segment)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS postings (
+    term            TEXT NOT NULL,
+    document        INTEGER NOT NULL,
+    positions       BLOB NOT NULL,
+    PRIMARY KEY (term, document)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_document ON postings (document);
+"""
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Splits the text into the terms of the index (lowercase words).
+    """
+    return TOKEN.findall(text.casefold())
+
+
+def parse_query(query: str) -> list[list[str]]:
+    """
+    Splits a query into its parts: every part is a list of terms that have to follow each other (a single word is a
+    part with one term, a phrase in double quotes or a word like 'e-mail' a part with several terms).
+    """
+    parts = []
+    for phrase, word in QUERY_PART.findall(query):
+        text = phrase if phrase else word
+        terms = tokenize(text)
+        if terms and text.endswith("*"):
+            terms[-1] += "*"
+        if terms:
+            parts.append(terms)
+    return parts
+
+
+def _pack(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array("I", values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack(blob: bytes) -> array:
+    values = array("I")
+    values.frombytes(blob)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class SearchIndex:
+    """
+    Persistent inverted index over the transcribed segments of the VOs, stored in SQLite. For every term the positions
+    (word numbers) it occurs at are stored per VO, the segments map the positions back to timestamps. This answers
+    queries with several words and phrases without reading the transcripts. VOs are added one by one as they are
+    transcribed, a VO whose transcript did not change is not indexed again.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path:    Path to the SQLite database (is created if it doesn't exist)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def key(vo_data: VoData) -> str:
+        return vo_data.vo_id or vo_data.vo_title
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def is_current(self, vo_data: VoData, checksum: str) -> bool:
+        """
+        Checks whether the VO is indexed with the transcript of the given checksum.
+        """
+        with self._lock:
+            row = self.connection.execute("SELECT checksum FROM documents WHERE vo_key = ?", (self.key(vo_data),)).fetchone()
+        return row is not None and checksum is not None and row[0] == checksum
+
+    def add(self, vo_data: VoData, store: SegmentStore, checksum: str = None) -> bool:
+        """
+        Indexes the segments of the VO, replacing what was indexed for it before.
+        :param vo_data:     The VO
+        :param store:       The transcribed segments
+        :param checksum:    Checksum of the transcript (e.g. of its segment store), if the VO is already indexed with the
+                            same checksum it is skipped
+        :return:            Whether the VO was (re)indexed
+        """
+        if self.is_current(vo_data, checksum):
+            logger.debug("'%s' is already indexed", vo_data.vo_title)
+            return False
+
+        start = time.perf_counter()
+        positions = {}
+        segment_tokens = array("I")
+        rows = []
+        position = 0
+        for index, (start_ms, end_ms, text) in enumerate(store):
+            segment_tokens.append(position)
+            for term in tokenize(text):
+                positions.setdefault(term, array("I")).append(position)
+                position += 1
+            rows.append((index, start_ms, end_ms, text))
+
+        with self._lock, self.connection:
+            self._remove(self.key(vo_data))
+            document = self.connection.execute(
+                "INSERT INTO documents (vo_key, title, series, link, checksum, tokens, segment_tokens, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.key(vo_data),
+                    vo_data.vo_title,
+                    vo_data.series_title,
+                    vo_data.vo_mp4_link,
+                    checksum,
+                    position,
+                    _pack(segment_tokens),
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            ).lastrowid
+            self.connection.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?)", [(document, *row) for row in rows])
+            self.connection.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?)",
+                [(term, document, _pack(values)) for term, values in positions.items()],
+            )
+        logger.debug(
+            "Indexed %d segments (%d words, %d terms) of '%s' in %.3fs",
+            len(rows),
+            position,
+            len(positions),
+            vo_data.vo_title,
+            time.perf_counter() - start,
+        )
+        return True
+
+    def remove(self, vo_data: VoData):
+        """
+        Removes the VO from the index.
+        """
+        with self._lock, self.connection:
+            self._remove(self.key(vo_data))
+
+    def _remove(self, vo_key: str):
+        row = self.connection.execute("SELECT id FROM documents WHERE vo_key = ?", (vo_key,)).fetchone()
+        if row is None:
+            return
+        for table in ("postings", "segments"):
+            self.connection.execute(f"DELETE FROM {table} WHERE document = ?", (row[0],))
+        self.connection.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+
+    def _postings(self, term: str) -> dict:
+        """
+        Returns the positions of the term per document (document -> sorted positions). A term ending with '*' matches
+        every term it prefixes.
+        """
+        if not term.endswith("*"):
+            rows = self.connection.execute("SELECT document, positions FROM postings WHERE term = ?", (term,))
+            return {document: _unpack(blob) for document, blob in rows}
+
+        prefix = term[:-1]
+        rows = self.connection.execute(
+            "SELECT document, positions FROM postings WHERE term >= ? AND term < ?",
+            (prefix, prefix + "\U0010ffff"),
+        )
+        postings = {}
+        for document, blob in rows:
+            postings.setdefault(document, []).append(_unpack(blob))
+        return {document: sorted(p for values in lists for p in values) for document, lists in postings.items()}
+
+    def _matches(self, part: list[str]) -> dict:
+        """
+        Returns the positions the part (a single term or a phrase) starts at per document.
+        """
+        matches = self._postings(part[0])
+        for offset, term in enumerate(part[1:], 1):
+            if not matches:
+                break
+            postings = self._postings(term)
+            following = {}
+            for document, starts in matches.items():
+                if document in postings:
+                    positions = set(postings[document])
+                    starts = [p for p in starts if p + offset in positions]
+                    if starts:
+                        following[document] = starts
+            matches = following
+        return matches
+
+    def search(self, query: str, limit: int = 20, hits_per_vo: int = 5) -> list[dict]:
+        """
+        Finds the VOs that contain every part of the query (words, prefixes like 'matri*' and phrases in double quotes).
+        :param query:           The query
+        :param limit:           Maximum number of VOs returned
+        :param hits_per_vo:     Maximum number of segments returned per VO
+        :return:                The VOs ordered by relevance (title, series, score, number of matches and the matching
+                                segments with start and end in seconds, text and a link to the time in the recording)
+        """
+        parts = parse_query(query)
+        if not parts:
+            return []
+
+        start = time.perf_counter()
+        with self._lock:
+            total = self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            scores = {}
+            positions = {}
+            for part in parts:
+                matches = self._matches(part)
+                documents = set(matches) if not positions else set(matches) & set(positions)
+                # Parts that occur in fewer VOs weigh more
+                weight = math.log(1 + total / max(len(matches), 1))
+                scores = {document: scores.get(document, 0.0) + weight * len(matches[document]) for document in documents}
+                positions = {document: [*positions.get(document, []), *matches[document]] for document in documents}
+                if not documents:
+                    break
+
+            results = []
+            for document in sorted(scores, key=lambda document: -scores[document])[:limit]:
+                title, series, link, blob = self.connection.execute(
+                    "SELECT title, series, link, segment_tokens FROM documents WHERE id = ?", (document,)
+                ).fetchone()
+                segment_tokens = _unpack(blob)
+                segments = sorted({bisect.bisect_right(segment_tokens, p) - 1 for p in positions[document]})
+                hits = []
+                for segment in segments[:hits_per_vo]:
+                    start_ms, end_ms, text = self.connection.execute(
+                        "SELECT start_ms, end_ms, text FROM segments WHERE document = ? AND segment = ?", (document, segment)
+                    ).fetchone()
+                    hits.append(
+                        {
+                            "segment": segment,
+                            "start": start_ms / 1000,
+                            "end": end_ms / 1000,
+                            "text": text,
+                            "link": f"{link}#t={start_ms // 1000}" if link else None,
+                        }
+                    )
+                results.append(
+                    {
+                        "title": title,
+                        "series": series,
+                        "score": scores[document],
+                        "matches": len(positions[document]),
+                        "segments": len(segments),
+                        "hits": hits,
+                    }
+                )
+        logger.debug("Search for '%s' found %d VO(s) in %.1fms", query, len(results), 1000 * (time.perf_counter() - start))
+        return results
+
+    def stats(self) -> dict:
+        """
+        Returns the number of indexed VOs, segments, words and distinct terms and the size of the index in bytes.
+        """
+        with self._lock:
+            documents, words = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM documents").fetchone()
+            segments = self.connection.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+            terms = self.connection.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+        size = sum(os.path.getsize(path) for path in (self.path, self.path + "-wal") if os.path.exists(path))
+        return {"vos": documents, "segments": segments, "words": words, "terms": terms, "bytes": size}
@@ -0,0 +1,103 @@
+import logging
+import os
+import struct
+import sys
+from array import array
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+# File layout: header (magic, version, number of segments, size of the text buffer), then the start times, the end
+# times (both in milliseconds, int64) and the text offsets (int64, one more than segments), then the UTF-8 text buffer.
+STORE_MAGIC = b"VOSG"
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct("<4sHxxQQ")
+STORE_EXTENSION = ".segs"
+
+
+class SegmentStore:
+    """
+    Compact representation of the transcribed segments: start and end times in milliseconds are kept in parallel arrays
+    and the texts are stored in one UTF-8 buffer with an array of offsets into it.
+    """
+
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+        self.offsets = array("q", [0])
+        self.buffer = bytearray()
+
+    @classmethod
+    def from_segments(cls, segments) -> "SegmentStore":
+        """
+        Creates a store from whisper segments (dicts with start, end and text).
+        """
+        store = cls()
+        for segment in segments:
+            store.append(round(segment["start"] * 1000), round(segment["end"] * 1000), segment["text"])
+        return store
+
+    def append(self, start_ms: int, end_ms: int, text: str):
+        self.starts.append(start_ms)
+        self.ends.append(end_ms)
+        self.buffer += text.strip().encode("UTF-8")
+        self.offsets.append(len(self.buffer))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def text(self, index: int) -> str:
+        return self.buffer[self.offsets[index] : self.offsets[index + 1]].decode("UTF-8")
+
+    def __iter__(self):
+        """
+        Iterates over (start_ms, end_ms, text) of every segment.
+        """
+        for index in range(len(self)):
+            yield self.starts[index], self.ends[index], self.text(index)
+
+    def save(self, path: str):
+        """
+        Saves the store to the given path (written to a temporary file first).
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(self), len(self.buffer)))
+            for values in (self.starts, self.ends, self.offsets):
+                _write_array(f, values)
+            f.write(self.buffer)
+        os.replace(temp_path, path)
+        logger.debug("Saved %d segments to '%s'", len(self), path)
+
+    @classmethod
+    def load(cls, path: str) -> "SegmentStore":
+        """
+        Loads a store that was saved with save.
+        """
+        store = cls()
+        with open(path, "rb") as f:
+            magic, version, count, size = STORE_HEADER.unpack(f.read(STORE_HEADER.size))
+            if magic != STORE_MAGIC or version != STORE_VERSION:
+                raise ValueError(f"'{path}' is not a segment store")
+            store.starts = _read_array(f, count)
+            store.ends = _read_array(f, count)
+            store.offsets = _read_array(f, count + 1)
+            store.buffer = bytearray(f.read(size))
+        if len(store.buffer) != size or store.offsets[-1] != size:
+            raise ValueError(f"Segment store '{path}' is incomplete")
+        return store
+
+
+def _write_array(f, values):
+    if sys.byteorder != "little":
+        values = array("q", values)
+        values.byteswap()
+    values.tofile(f)
+
+
+def _read_array(f, count):
+    values = array("q")
+    values.fromfile(f, count)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+QUEUE_FOLDER = "queue"
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def task_id(key: str) -> str:
+    return hashlib.sha1(key.encode("UTF-8")).hexdigest()[:16]
+
+
+class TaskQueue:
+    """
+    Queue of tasks (one per VO) in a folder that several machines share (e.g. over NFS), without a process that
+    coordinates them. Every task is a JSON file that moves between the folders pending, leased, done and failed by
+    atomic renames: a worker claims a task by renaming it from pending to leased (only one rename succeeds), keeps its
+    lease alive by touching the file (heartbeat) and finishes it by renaming it to done. Leases that were not renewed
+    for lease_timeout seconds belong to a worker that died, any worker moves them back to pending. The stages a worker
+    finished are recorded in the task file itself, so the worker that takes over a task (and 'main.py index') knows
+    them without sharing a database between machines.
+    """
+
+    def __init__(self, folder: str, lease_timeout: float = 300.0, retries: int = 2, worker: str = None):
+        """
+        :param folder:          Folder of the queue (is created if it doesn't exist)
+        :param lease_timeout:   Seconds after which a lease that was not renewed is taken back
+        :param retries:         How often a failed task is queued again before it is moved to failed
+        :param worker:          Name of this worker in the lease files (defaults to '<host>-<pid>')
+        """
+        self.folder = folder
+        self.lease_timeout = lease_timeout
+        self.retries = retries
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}".replace("@", "-")
+        for name in (PENDING, LEASED, DONE, FAILED):
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+
+        self._held = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew_leases, name="task-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def close(self):
+        self._closed.set()
+        self._heartbeat.join()
+
+    def _path(self, state: str, name: str) -> str:
+        return os.path.join(self.folder, state, name)
+
+    def _lease_name(self, tid: str) -> str:
+        return f"{tid}@{self.worker}.json"
+
+    def _names(self, state: str) -> list[str]:
+        return sorted(name for name in os.listdir(os.path.join(self.folder, state)) if name.endswith(".json"))
+
+    def _write(self, path: str, task: dict):
+        # The temporary file is unique per worker, so that workers on other machines never write to the same file
+        temp_path = f"{path}.{self.worker}.tmp"
+        with open(temp_path, "w", encoding="UTF-8") as f:
+            json.dump(task, f)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _read(path: str) -> dict:
+        with open(path, encoding="UTF-8") as f:
+            return json.load(f)
+
+    def add(self, key: str, payload: dict, redo: bool = False) -> bool:
+        """
+        Queues a task, unless a task with the same key is already queued or leased, or finished (unless redo is set).
+        A failed task with the same key is queued again. The new task keeps the stages the old one recorded.
+        :param key:         Key of the task (e.g. the key of the VO)
+        :param payload:     Data of the task (must be JSON-serializable)
+        :param redo:        Whether a finished task is queued again as well
+        :return:            Whether the task was queued
+        """
+        tid = task_id(key)
+        name = f"{tid}.json"
+        if os.path.exists(self._path(PENDING, name)) or any(lease.startswith(tid + "@") for lease in self._names(LEASED)):
+            return False
+        if os.path.exists(self._path(DONE, name)) and not redo:
+            return False
+
+        stages = []
+        for state in (DONE, FAILED):
+            try:
+                stages = self._read(self._path(state, name)).get("stages", stages)
+            except FileNotFoundError:
+                pass
+        task = {"id": tid, "key": key, "payload": payload, "attempts": 0, "error": None, "queued_at": _now(), "stages": stages}
+        temp_path = self._path(PENDING, f"{name}.{self.worker}.tmp")
+        self._write(temp_path, task)
+        try:
+            # Unlike a rename, a link fails if the task exists already (another worker queued it at the same time)
+            os.link(temp_path, self._path(PENDING, name))
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(temp_path)
+        for state in (DONE, FAILED):
+            if os.path.exists(self._path(state, name)):
+                os.remove(self._path(state, name))
+        return True
+
+    def claim(self) -> dict | None:
+        """
+        Leases the oldest queued task to this worker.
+        :return:    The task (id, key, payload, attempts) or None if no task is queued
+        """
+        names = sorted(self._names(PENDING), key=lambda name: self._mtime(self._path(PENDING, name)))
+        for name in names:
+            tid = name[: -len(".json")]
+            lease_path = self._path(LEASED, self._lease_name(tid))
+            try:
+                os.rename(self._path(PENDING, name), lease_path)
+            except FileNotFoundError:
+                # Another worker was faster
+                continue
+            os.utime(lease_path)
+            task = self._read(lease_path)
+            task["attempts"] += 1
+            task["worker"] = self.worker
+            task["leased_at"] = _now()
+            self._write(lease_path, task)
+            with self._lock:
+                self._held[tid] = lease_path
+            logger.info("Worker '%s' leased task '%s' (attempt %d)", self.worker, task["key"], task["attempts"])
+            return task
+        return None
+
+    def complete(self, task: dict):
+        """
+        Marks a leased task as done.
+        """
+        self._release(task, DONE, None)
+
+    def fail(self, task: dict, error: str):
+        """
+        Queues a failed task again or moves it to failed if it was attempted more than retries times.
+        """
+        self._release(task, PENDING if task["attempts"] <= self.retries else FAILED, error)
+
+    def _release(self, task: dict, state: str, error: str | None):
+        with self._lock:
+            lease_path = self._held.pop(task["id"], None)
+        if lease_path is None:
+            return
+        try:
+            if error is not None:
+                task = {**task, "error": error}
+                self._write(lease_path, task)
+            os.rename(lease_path, self._path(state, task["id"] + ".json"))
+        except FileNotFoundError:
+            logger.warning("Lease of task '%s' expired and was taken over by another worker", task["key"])
+            return
+        logger.debug("Task '%s' is %s", task["key"], state)
+
+    def record(self, task: dict, stages: list[dict]):
+        """
+        Records the finished stages of a leased task in its task file.
+        :param task:    The leased task
+        :param stages:  The records of the finished stages (must be JSON-serializable, see RunLedger.stage_records)
+        """
+        task["stages"] = stages
+        with self._lock:
+            lease_path = self._held.get(task["id"])
+            # Writing a lease that was taken over would bring it back
+            if lease_path is not None and os.path.exists(lease_path):
+                self._write(lease_path, task)
+
+    def _renew_leases(self):
+        interval = max(1.0, self.lease_timeout / 5)
+        while not self._closed.wait(interval):
+            with self._lock:
+                held = list(self._held.items())
+            for tid, lease_path in held:
+                try:
+                    os.utime(lease_path)
+                except FileNotFoundError:
+                    logger.warning("Lost the lease of task '%s', another worker took it over", tid)
+                    with self._lock:
+                        self._held.pop(tid, None)
+
+    @staticmethod
+    def _mtime(path: str) -> float:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 0.0
+        # Renaming the file changes its ctime, so a lease that was just taken over doesn't look stale
+        return max(stat.st_mtime, stat.st_ctime)
+
+    def reclaim_stale(self) -> int:
+        """
+        Queues the tasks whose lease was not renewed for lease_timeout seconds again (their worker died).
+        :return:    Number of tasks queued again
+        """
+        reclaimed = 0
+        now = time.time()
+        for name in self._names(LEASED):
+            lease_path = self._path(LEASED, name)
+            last_renewed = self._mtime(lease_path)
+            if not last_renewed or now - last_renewed < self.lease_timeout:
+                continue
+            tid, worker = name[: -len(".json")].split("@", 1)
+            try:
+                os.rename(lease_path, self._path(PENDING, tid + ".json"))
+            except FileNotFoundError:
+                continue
+            logger.warning("Lease of task '%s' held by '%s' is stale (%.0fs old), queued it again", tid, worker, now - last_renewed)
+            reclaimed += 1
+        return reclaimed
+
+    def counts(self) -> dict:
+        """
+        Returns the number of tasks per state.
+        """
+        return {state: len(self._names(state)) for state in (PENDING, LEASED, DONE, FAILED)}
+
+    def tasks(self, poll_interval: float = 5.0):
+        """
+        Leases tasks one by one until the queue is drained: no task is queued and no task is leased anymore (by this
+        or any other worker). While other workers still hold leases it waits, so that it takes over their tasks if
+        they die.
+        :param poll_interval:   Seconds between two looks at the queue while waiting
+        :return:                Iterator over the leased tasks
+        """
+        while not self._closed.is_set():
+            task = self.claim()
+            if task is not None:
+                yield task
+                continue
+            if self.reclaim_stale():
+                continue
+            counts = self.counts()
+            if counts[PENDING] == 0 and counts[LEASED] == 0:
+                logger.info("Task queue is drained (%d done, %d failed)", counts[DONE], counts[FAILED])
+                return
+            logger.debug("Waiting for %d leased task(s) of other workers", counts[LEASED])
+            self._closed.wait(poll_interval)
+
+
+def finished_tasks(folder: str) -> list[dict]:
+    """
+    Reads the finished tasks of the queue in the given folder (without joining the queue as a worker).
+    :param folder:  Folder of the queue
+    :return:        The tasks in the done folder
+    """
+    done_folder = os.path.join(folder, DONE)
+    if not os.path.isdir(done_folder):
+        return []
+    tasks = []
+    for name in sorted(os.listdir(done_folder)):
+        if name.endswith(".json"):
+            with open(os.path.join(done_folder, name), encoding="UTF-8") as f:
+                tasks.append(json.load(f))
+    return tasks
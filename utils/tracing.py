@@ -0,0 +1,308 @@
+import contextlib
+import cProfile
+import itertools
+import json
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+from datetime import timedelta
+
+from utils.atomic import atomic_open
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+METRIC_PREFIX = "vo_transcriber"
+# Names of the spans the transcriber records
+SPANS = (
+    "feed_fetch",
+    "feed_parse",
+    "catalog_sync",
+    "catalog_select",
+    "download",
+    "fingerprint",
+    "audio_decode",
+    "model_load",
+    "calibrate",
+    "transcribe",
+    "vad",
+    "decode",
+    "render",
+    "index",
+    "pdf",
+    "pdf_combined",
+)
+
+
+class Span:
+    """
+    A timed section of the work (e.g. the download of one VO) with attributes that describe it (bytes, audio seconds, ...).
+    """
+
+    __slots__ = ("name", "id", "parent", "attributes", "start", "seconds", "error")
+
+    def __init__(self, name: str, span_id: str, parent: str | None, attributes: dict):
+        self.name = name
+        self.id = span_id
+        self.parent = parent
+        self.attributes = attributes
+        self.start = time.time()
+        self.seconds = None
+        self.error = None
+
+    def set(self, **attributes):
+        """
+        Adds attributes to the span. Numeric attributes are summed up per span name in the metrics.
+        """
+        self.attributes.update(attributes)
+
+    def derived(self) -> dict:
+        """
+        Rates that follow from the attributes and the duration of the span.
+        """
+        derived = {}
+        if not self.seconds:
+            return derived
+        if isinstance(self.attributes.get("bytes"), (int, float)):
+            derived["bytes_per_second"] = self.attributes["bytes"] / self.seconds
+        if self.attributes.get("audio_seconds"):
+            derived["real_time_factor"] = self.seconds / self.attributes["audio_seconds"]
+        return derived
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "id": self.id,
+            "parent": self.parent,
+            "start": self.start,
+            "seconds": self.seconds,
+            "status": "ok" if self.error is None else "error",
+            "error": self.error,
+            "thread": threading.current_thread().name,
+            "pid": os.getpid(),
+            "attributes": {**self.attributes, **self.derived()},
+        }
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+class Tracer:
+    """
+    Collects spans of the work that is done. Every finished span is appended to a JSON-lines trace (if configured) and
+    aggregated per span name (count, errors, seconds and the sums of its numeric attributes), which can be exported as
+    Prometheus textfile. The spans of one name can additionally be profiled with cProfile.
+    Spans that are started while another span is open in the same thread become its children.
+    """
+
+    def __init__(self):
+        self.trace_path = None
+        self.metrics_path = None
+        self.profile_span = None
+        self.profile_path = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._trace = None
+        self._stats = {}
+        self._profile = None
+        self._started = time.time()
+
+    def configure(self, trace_path: str = None, metrics_path: str = None, profile_span: str = None, profile_path: str = None):
+        """
+        :param trace_path:      Path of the JSON-lines file the spans are appended to (None disables the trace)
+        :param metrics_path:    Path of the Prometheus textfile written by write_metrics (None disables it)
+        :param profile_span:    Name of the spans that are profiled with cProfile (None disables profiling)
+        :param profile_path:    Path the profile is saved to (pstats format, e.g. for snakeviz or 'python -m pstats')
+        """
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+            self.trace_path = trace_path
+            self.metrics_path = metrics_path
+            self.profile_span = profile_span
+            self.profile_path = profile_path
+            if trace_path is not None:
+                self._trace = open(trace_path, "a", encoding="UTF-8", buffering=1)
+
+    def _stack(self) -> list[Span]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self) -> Span | None:
+        """
+        Returns the innermost open span of the calling thread.
+        """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def annotate(self, **attributes):
+        """
+        Adds attributes to the innermost open span of the calling thread (nothing happens if there is none).
+        """
+        span = self.current()
+        if span is not None:
+            span.set(**attributes)
+
+    @contextlib.contextmanager
+    def span(self, name: str, log_level: int = logging.DEBUG, **attributes):
+        """
+        Times the enclosed code as a span.
+        :param name:        Name of the span (spans with the same name are aggregated in the metrics)
+        :param log_level:   Level the finished span is logged with
+        :param attributes:  Attributes of the span (more can be added with the set method of the yielded span)
+        :return:            The span
+        """
+        stack = self._stack()
+        span = Span(name, f"{os.getpid()}-{next(self._ids)}", stack[-1].id if stack else None, attributes)
+        stack.append(span)
+
+        profiler = None
+        if name == self.profile_span and not getattr(self._local, "profiling", False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._local.profiling = True
+            except ValueError:
+                # Only one profiler can be active at a time on newer Python versions
+                logger.debug("Could not profile span '%s', another profiler is active", name)
+                profiler = None
+
+        start = time.perf_counter()
+        try:
+            yield span
+        except GeneratorExit:
+            # A generator with an open span was closed before it was exhausted, which is not an error
+            raise
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._local.profiling = False
+            stack.remove(span)
+            self._finish(span, profiler, log_level)
+
+    def _finish(self, span: Span, profiler, log_level: int):
+        record = span.to_dict()
+        with self._lock:
+            stats = self._stats.setdefault(span.name, {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "sums": {}})
+            stats["count"] += 1
+            stats["errors"] += span.error is not None
+            stats["seconds"] += span.seconds
+            stats["max_seconds"] = max(stats["max_seconds"], span.seconds)
+            for key, value in span.attributes.items():
+                if _is_number(value):
+                    stats["sums"][key] = stats["sums"].get(key, 0) + value
+            if self._trace is not None:
+                self._trace.write(json.dumps(record, default=str) + "\n")
+            if profiler is not None:
+                if self._profile is None:
+                    self._profile = pstats.Stats(profiler)
+                else:
+                    self._profile.add(profiler)
+
+        if logger.isEnabledFor(log_level):
+            details = ", ".join(f"{key}={_format(value)}" for key, value in record["attributes"].items() if key != "vo")
+            logger.log(
+                log_level,
+                "Span '%s'%s took %s%s%s",
+                span.name,
+                f" of '{span.attributes['vo']}'" if "vo" in span.attributes else "",
+                str(timedelta(seconds=span.seconds)),
+                f" ({details})" if details else "",
+                f" and failed: {span.error}" if span.error else "",
+            )
+
+    def stats(self) -> dict:
+        """
+        Returns the aggregated spans: span name -> count, errors, seconds, max_seconds and the sums of the attributes.
+        """
+        with self._lock:
+            return {name: {**stats, "sums": dict(stats["sums"])} for name, stats in self._stats.items()}
+
+    def write_metrics(self, path: str = None):
+        """
+        Writes the aggregated spans as Prometheus textfile (e.g. for the textfile collector of the node exporter). The
+        file is replaced atomically, so that a scrape never sees a partial file.
+        """
+        path = path or self.metrics_path
+        if path is None:
+            return
+
+        lines = []
+
+        def metric(name, kind, help_text, values):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for span_name, value in values:
+                lines.append(f'{METRIC_PREFIX}_{name}{{span="{span_name}"}} {value:.6g}')
+
+        stats = self.stats()
+        metric("span_seconds_total", "counter", "Seconds spent in the spans", [(name, s["seconds"]) for name, s in stats.items()])
+        metric("span_count_total", "counter", "Number of finished spans", [(name, s["count"]) for name, s in stats.items()])
+        metric("span_errors_total", "counter", "Number of spans that failed", [(name, s["errors"]) for name, s in stats.items()])
+        metric("span_max_seconds", "gauge", "Duration of the longest span", [(name, s["max_seconds"]) for name, s in stats.items()])
+        for key in sorted({key for s in stats.values() for key in s["sums"]}):
+            values = [(name, s["sums"][key]) for name, s in stats.items() if key in s["sums"]]
+            metric(f"span_{_metric_name(key)}_total", "counter", f"Sum of the attribute {key} of the spans", values)
+        rtf = [(name, s["seconds"] / s["sums"]["audio_seconds"]) for name, s in stats.items() if s["sums"].get("audio_seconds")]
+        if rtf:
+            metric("real_time_factor", "gauge", "Seconds spent per second of audio", rtf)
+        lines.append(f"# HELP {METRIC_PREFIX}_run_start_timestamp_seconds Start of the run")
+        lines.append(f"# TYPE {METRIC_PREFIX}_run_start_timestamp_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_run_start_timestamp_seconds {self._started:.3f}")
+
+        with atomic_open(path) as f:
+            f.write("\n".join(lines) + "\n")
+        logger.debug("Wrote metrics to '%s'", path)
+
+    def log_summary(self):
+        stats = self.stats()
+        if not stats:
+            return
+        lines = []
+        for name, s in sorted(stats.items(), key=lambda item: -item[1]["seconds"]):
+            line = f"{20 * ' '}{name}: {s['count']} span(s), {s['seconds']:.1f}s in total, longest {s['max_seconds']:.1f}s"
+            if s["errors"]:
+                line += f", {s['errors']} failed"
+            if s["sums"].get("bytes"):
+                line += f", {s['sums']['bytes'] / max(s['seconds'], 1e-9) / 2**20:.1f} MB/s"
+            if s["sums"].get("audio_seconds"):
+                line += f", real-time factor {s['seconds'] / s['sums']['audio_seconds']:.3f}"
+            lines.append(line)
+        logger.info("Time spent per span:\n%s", "\n".join(lines))
+
+    def close(self):
+        """
+        Writes the metrics and the profile and closes the trace.
+        """
+        self.write_metrics()
+        with self._lock:
+            if self._profile is not None and self.profile_path is not None:
+                self._profile.dump_stats(self.profile_path)
+                logger.info("Saved profile of the spans '%s' to '%s'", self.profile_span, self.profile_path)
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+
+def _format(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.3g}"
+    return str(value)
+
+
+tracer = Tracer()
@@ -1,18 +1,276 @@
+import gc
 import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
 
-import whisper
+from utils.audio import SAMPLE_RATE, iter_audio_blocks, to_float
+from utils.backends import BACKENDS
+from utils.chunking import HOP_LENGTH, iter_windows
+from utils.tracing import tracer
 
 
 logger = logging.getLogger("VO-Transcriber")
 
+# Memory one second of a window needs while it is transcribed: the buffered int16 samples (up to 1.5 windows), the float
+# samples and whisper's STFT (complex values and magnitudes) and log-mel spectrogram (100 frames per second)
+BYTES_PER_AUDIO_SECOND = SAMPLE_RATE * (3 + 4) + 100 * (201 * 8 + 201 * 4 + 80 * 4)
+MIN_WINDOW_LENGTH = 30.0
+MAX_WINDOW_LENGTH = 1800.0
+# Window length of the streamed transcription (--stream) when no memory budget is given
+DEFAULT_WINDOW_LENGTH = 300.0
 
-def transcribe_file(input_file, language=None, model_name="small", verbose=False):
-    model = whisper.load_model(model_name)
 
-    options = {
-        "fp16": False,
-        "language": language,
-    }
+class ModelCache:
+    """
+    Keeps loaded models (as backends, see utils/backends.py) in memory, so that every VO of a run can reuse them instead
+    of loading the weights again. Models are keyed by model name, device, precision, slot and backend. When the cached
+    weights exceed max_memory the least recently used models are evicted.
+    """
 
-    result = model.transcribe(audio=input_file, verbose=verbose, **options)
-    return result["segments"]
+    def __init__(self, max_memory: int = None):
+        """
+        :param max_memory:  Maximum number of bytes the cached models may take up (None means no limit)
+        """
+        self.max_memory = max_memory
+        self.load_seconds = 0.0
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self, model_name: str, device: str = "cpu", fp16: bool = False, slot: int = 0, backend: str = "whisper"):
+        """
+        Returns the requested model, loading it if it is not cached yet.
+        :param model_name:  Name of the whisper-model
+        :param device:      Device the model shall be loaded onto (e.g. "cpu" or "cuda")
+        :param fp16:        Whether the model shall use half precision
+        :param slot:        Separate instances of the same model can be requested with different slots (a model instance
+                            must not be used by two threads at the same time)
+        :param backend:     Name of the backend that runs the model (see utils.backends.BACKENDS)
+        :return:            The loaded backend
+        """
+        start = time.monotonic()
+        try:
+            return self._get(model_name, device, fp16, slot, backend)
+        finally:
+            self._local.seconds = self.thread_seconds() + time.monotonic() - start
+
+    def thread_seconds(self) -> float:
+        """
+        :return:    Seconds the calling thread spent getting models (loading them or waiting for another thread that
+                    loads one)
+        """
+        return getattr(self._local, "seconds", 0.0)
+
+    def _get(self, model_name, device, fp16, slot, backend):
+        key = (model_name, device, fp16, slot, backend)
+        with self._lock:
+            if key in self._models:
+                logger.debug("Using cached model '%s' (device: %s, fp16: %s, backend: %s)", model_name, device, fp16, backend)
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            logger.info("Loading model '%s' (device: %s, fp16: %s, backend: %s)", model_name, device, fp16, backend)
+            with tracer.span("model_load", logging.INFO, model=model_name, backend=backend, device=device) as span:
+                model = BACKENDS[backend](model_name, device=device, fp16=fp16)
+                model.load()
+                span.set(bytes=model.memory_usage())
+            self.load_seconds += span.seconds
+
+            self._models[key] = model
+            self._sizes[key] = span.attributes["bytes"]
+            self._enforce_memory_cap(keep=key)
+            return model
+
+    def evict(self, model_name: str = None, device: str = None, fp16: bool = None, slot: int = None, backend: str = None):
+        """
+        Removes all cached models matching the given filters. Filters that are None match everything.
+        :param model_name:  Name of the whisper-model to evict
+        :param device:      Device of the models to evict
+        :param fp16:        Precision of the models to evict
+        :param slot:        Slot of the models to evict
+        :param backend:     Name of the backend of the models to evict
+        """
+        with self._lock:
+            keys = [
+                key
+                for key in self._models
+                if (model_name is None or key[0] == model_name)
+                and (device is None or key[1] == device)
+                and (fp16 is None or key[2] == fp16)
+                and (slot is None or key[3] == slot)
+                and (backend is None or key[4] == backend)
+            ]
+            for key in keys:
+                self._remove(key)
+        self._free_memory()
+
+    def clear(self):
+        """
+        Removes every cached model.
+        """
+        self.evict()
+
+    def memory_usage(self) -> int:
+        """
+        :return:    Number of bytes the cached model weights take up
+        """
+        return sum(self._sizes.values())
+
+    def _enforce_memory_cap(self, keep):
+        if self.max_memory is None:
+            return
+
+        evicted = False
+        for key in list(self._models):
+            if self.memory_usage() <= self.max_memory:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            evicted = True
+
+        if self.memory_usage() > self.max_memory:
+            logger.warning(
+                "Model '%s' alone needs %d MB which exceeds the model cache limit of %d MB",
+                keep[0],
+                self._sizes[keep] // 2**20,
+                self.max_memory // 2**20,
+            )
+        if evicted:
+            self._free_memory()
+
+    def _remove(self, key):
+        logger.info("Evicting model '%s' (device: %s, fp16: %s, slot: %d, backend: %s) from cache", *key)
+        del self._models[key]
+        del self._sizes[key]
+
+    def _free_memory(self):
+        gc.collect()
+        try:
+            import torch
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+
+model_cache = ModelCache()
+
+
+def window_length_for_budget(memory_budget: int) -> float:
+    """
+    Returns the longest window whose audio fits into the given memory budget (the model itself is not included).
+    :param memory_budget:   Bytes one worker may use for the audio it transcribes
+    :return:                Window length in seconds (between MIN_WINDOW_LENGTH and MAX_WINDOW_LENGTH)
+    """
+    window_length = memory_budget / BYTES_PER_AUDIO_SECOND
+    if window_length < MIN_WINDOW_LENGTH:
+        logger.warning(
+            "A memory budget of %.0f MB is too small, using windows of %.0f seconds (needs %.0f MB)",
+            memory_budget / 2**20,
+            MIN_WINDOW_LENGTH,
+            MIN_WINDOW_LENGTH * BYTES_PER_AUDIO_SECOND / 2**20,
+        )
+    return min(max(window_length, MIN_WINDOW_LENGTH), MAX_WINDOW_LENGTH)
+
+
+def transcribe_file(
+    input_file,
+    language=None,
+    model_name="small",
+    verbose=False,
+    device="cpu",
+    fp16=False,
+    cache=None,
+    slot=0,
+    backend="whisper",
+    on_segment=None,
+):
+    """
+    Transcribes the given audio file with a (cached) whisper model.
+    :param input_file:  Path to the audio file to transcribe
+    :param language:    Language of the given audio file
+    :param model_name:  Name of the whisper-model to use for transcription
+    :param verbose:     Whether to print each segment after it is transcribed
+    :param device:      Device the model shall run on
+    :param fp16:        Whether the model shall use half precision
+    :param cache:       The ModelCache to take the model from (defaults to the module wide cache)
+    :param slot:        Which instance of the model to use (concurrent transcriptions need different slots)
+    :param backend:     Name of the backend that runs the model (see utils.backends.BACKENDS)
+    :param on_segment:  Function that is called with every segment as soon as the backend returns it
+    :return:            The transcribed segments
+    """
+    cache = cache or model_cache
+    model = cache.get(model_name, device=device, fp16=fp16, slot=slot, backend=backend)
+
+    start = datetime.now()
+    segments = []
+    for segment in model.transcribe(input_file, language=language, verbose=verbose):
+        if on_segment is not None:
+            on_segment(segment)
+        segments.append(segment)
+    end = datetime.now()
+    logger.info("Transcription (without model loading) took %s", str(end - start))
+    return segments
+
+
+def iter_transcribe_file(
+    audio,
+    language=None,
+    model_name="small",
+    verbose=False,
+    device="cpu",
+    fp16=False,
+    cache=None,
+    slot=0,
+    window_length=DEFAULT_WINDOW_LENGTH,
+    prompt_length=500,
+    backend="whisper",
+):
+    """
+    Transcribes the given audio window by window and yields every segment as soon as its window is transcribed.
+    The windows are split at silence, the end of the previous window is passed to the model as prompt, so that the
+    context is carried over.
+    :param audio:           The audio samples (16 kHz, may be memory-mapped) or the path of an audio file (decoded by
+                            ffmpeg while it is transcribed). Only about one and a half windows are in memory at a time.
+    :param language:        Language of the given audio
+    :param model_name:      Name of the whisper-model to use for transcription
+    :param verbose:         Whether to print each segment after it is transcribed
+    :param device:          Device the model shall run on
+    :param fp16:            Whether the model shall use half precision
+    :param cache:           The ModelCache to take the model from (defaults to the module wide cache)
+    :param slot:            Which instance of the model to use (concurrent transcriptions need different slots)
+    :param window_length:   Target length of a window in seconds
+    :param prompt_length:   Number of characters of the previous window that are passed on as prompt
+    :param backend:         Name of the backend that runs the model (see utils.backends.BACKENDS)
+    :return:                Iterator over the transcribed segments (timestamps relative to the start of the audio)
+    """
+    cache = cache or model_cache
+    model = cache.get(model_name, device=device, fp16=fp16, slot=slot, backend=backend)
+
+    index = 0
+    prompt = None
+    start = datetime.now()
+    for first, window in iter_windows(iter_audio_blocks(audio), window_length):
+        window = to_float(window)
+        offset = first / SAMPLE_RATE
+        text = []
+        for segment in model.transcribe(window, language=language, verbose=verbose, initial_prompt=prompt):
+            text.append(segment["text"])
+            segment = dict(segment)
+            segment["id"] = index
+            segment["seek"] = segment["seek"] + first // HOP_LENGTH
+            segment["start"] += offset
+            segment["end"] += offset
+            index += 1
+            yield segment
+        del window
+
+        prompt = "".join(text)[-prompt_length:] or None
+
+    end = datetime.now()
+    logger.info("Transcription (without model loading) took %s", str(end - start))
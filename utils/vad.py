@@ -0,0 +1,175 @@
+import bisect
+import logging
+
+import numpy as np
+
+from utils.audio import SAMPLE_RATE, open_pcm, write_pcm_blocks
+
+
+logger = logging.getLogger("VO-Transcriber")
+
+FRAME_LENGTH = SAMPLE_RATE * 30 // 1000  # energy is measured in frames of 30 ms
+GAP_LENGTH = SAMPLE_RATE // 5  # 200 ms of silence are put between two speech regions, so that words don't get merged
+
+
+def detect_speech(
+    audio: np.ndarray,
+    margin: float = 12.0,
+    floor: float = -55.0,
+    min_speech: float = 0.3,
+    min_silence: float = 1.5,
+    padding: float = 0.3,
+) -> list[tuple[int, int]]:
+    """
+    Finds the regions of the audio that contain speech with an energy based voice activity detection.
+    A frame counts as speech if it is more than 'margin' dB louder than the noise floor of the recording (estimated as
+    the 10th percentile of all frame energies) and louder than 'floor' dBFS.
+    :param audio:           The audio samples (16 kHz, float in [-1, 1] or int16)
+    :param margin:          How many dB a frame has to be above the noise floor to count as speech
+    :param floor:           Frames quieter than this (in dBFS) never count as speech
+    :param min_speech:      Speech regions shorter than this many seconds are dropped
+    :param min_silence:     Pauses shorter than this many seconds don't split speech regions
+    :param padding:         Seconds added before and after every speech region
+    :return:                List of (first sample, last sample + 1) of the speech regions
+    """
+    frames = len(audio) // FRAME_LENGTH
+    if frames == 0:
+        return []
+
+    scale = 32768.0 if np.issubdtype(audio.dtype, np.integer) else 1.0
+    energy = np.empty(frames, dtype=np.float32)
+    # Done in blocks, so that memory-mapped audio is never loaded completely
+    block = 10000
+    for first in range(0, frames, block):
+        last = min(frames, first + block)
+        samples = np.asarray(audio[first * FRAME_LENGTH : last * FRAME_LENGTH], dtype=np.float32) / scale
+        samples = samples.reshape(last - first, FRAME_LENGTH)
+        energy[first:last] = 10 * np.log10(np.mean(samples**2, axis=1) + 1e-10)
+
+    threshold = max(float(np.percentile(energy, 10)) + margin, floor)
+    speech = energy > threshold
+
+    # Collect runs of speech frames
+    regions = []
+    changes = np.flatnonzero(np.diff(speech.astype(np.int8))) + 1
+    bounds = np.concatenate(([0], changes, [frames]))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if speech[start]:
+            regions.append([int(start) * FRAME_LENGTH, int(end) * FRAME_LENGTH])
+
+    # Merge regions separated by short pauses, drop short regions and pad the rest
+    merged = []
+    for region in regions:
+        if merged and region[0] - merged[-1][1] < min_silence * SAMPLE_RATE:
+            merged[-1][1] = region[1]
+        else:
+            merged.append(region)
+
+    result = []
+    pad = int(padding * SAMPLE_RATE)
+    for start, end in merged:
+        if end - start < min_speech * SAMPLE_RATE:
+            continue
+        start, end = max(0, start - pad), min(len(audio), end + pad)
+        if result and start <= result[-1][1]:
+            result[-1] = (result[-1][0], end)
+        else:
+            result.append((start, end))
+    return result
+
+
+class SpeechTimeline:
+    """
+    Maps timestamps of the compacted audio (only the speech regions, separated by short gaps) back to the original
+    recording.
+    """
+
+    def __init__(self, regions: list[tuple[int, int]]):
+        """
+        :param regions:     The speech regions in the original audio as (first sample, last sample + 1)
+        """
+        self.regions = regions
+        self.compact_starts = []
+        position = 0
+        for start, end in regions:
+            self.compact_starts.append(position)
+            position += end - start + GAP_LENGTH
+        self.compact_length = max(0, position - GAP_LENGTH)
+
+    def to_original(self, seconds: float) -> float:
+        """
+        Translates a time in the compacted audio into the time in the original audio.
+        Times that fall into a gap between two regions are clipped to the end of the previous region.
+        """
+        if not self.regions:
+            return seconds
+
+        sample = seconds * SAMPLE_RATE
+        index = max(0, bisect.bisect_right(self.compact_starts, sample) - 1)
+        start, end = self.regions[index]
+        return min(start + sample - self.compact_starts[index], end) / SAMPLE_RATE
+
+    def remap_segments(self, segments: list[dict]) -> list[dict]:
+        """
+        Returns copies of the segments with timestamps relative to the original audio.
+        """
+        remapped = []
+        for segment in segments:
+            segment = dict(segment)
+            segment["start"] = self.to_original(segment["start"])
+            segment["end"] = max(segment["start"], self.to_original(segment["end"]))
+            remapped.append(segment)
+        return remapped
+
+
+def compact_audio(audio: np.ndarray, regions: list[tuple[int, int]], output_file: str = None) -> np.ndarray:
+    """
+    Concatenates the speech regions of the audio, separated by short gaps of silence.
+    :param audio:           The audio samples
+    :param regions:         The speech regions as (first sample, last sample + 1)
+    :param output_file:     If given, the compacted audio is written to this prepared audio file block by block and
+                            returned memory-mapped (so it is never in memory as a whole)
+    :return:                The compacted audio (same dtype as the input, int16 if written to output_file)
+    """
+    if output_file is not None:
+        return open_pcm(write_pcm_blocks(_compacted_blocks(audio, regions), output_file))
+
+    timeline = SpeechTimeline(regions)
+    out = np.zeros(timeline.compact_length, dtype=audio.dtype)
+    for (start, end), position in zip(regions, timeline.compact_starts):
+        out[position : position + end - start] = audio[start:end]
+    return out
+
+
+def _compacted_blocks(audio: np.ndarray, regions: list[tuple[int, int]], block: int = 30 * SAMPLE_RATE):
+    for index, (start, end) in enumerate(regions):
+        if index > 0:
+            yield np.zeros(GAP_LENGTH, dtype=audio.dtype)
+        for first in range(start, end, block):
+            yield np.asarray(audio[first : min(end, first + block)])
+
+
+def filter_speech(audio: np.ndarray, name: str = "audio", output_file: str = None) -> tuple[np.ndarray, SpeechTimeline]:
+    """
+    Removes silence and non-speech from the audio and logs how much was removed.
+    :param audio:           The audio samples (16 kHz)
+    :param name:            Name of the audio (used for logging)
+    :param output_file:     If given, the compacted audio is written to this prepared audio file and memory-mapped
+    :return:                The compacted audio and the timeline to map its timestamps back to the original audio
+    """
+    regions = detect_speech(audio)
+    timeline = SpeechTimeline(regions)
+    compacted = compact_audio(audio, regions, output_file)
+
+    total = len(audio) / SAMPLE_RATE
+    speech = len(compacted) / SAMPLE_RATE
+    skipped = 1 - speech / total if total > 0 else 0.0
+    logger.info(
+        "VAD: %d speech region(s) in '%s', skipping %.1f%% of %.1f minutes (expected speedup %.2fx)",
+        len(regions),
+        name,
+        100 * skipped,
+        total / 60,
+        total / speech if speech > 0 else float("inf"),
+    )
+    return compacted, timeline
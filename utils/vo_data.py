@@ -1,3 +1,4 @@
+import codecs
 import json
 import logging
 import os
@@ -6,84 +7,260 @@ from datetime import datetime, timedelta
 import requests
 
 from models.VoDataModels import VoData
+from utils.tracing import tracer
 
 
 logger = logging.getLogger("VO-Transcriber")
 
+READ_SIZE = 2**16
 
-def get_all_vo_data(path=None, link=None):
+
+class _JsonStream:
     """
-    Loads the VO-Data from the given file or link. When file is given link is ignored.
+    Minimal incremental reader for a JSON document that arrives in chunks of text. Values are decoded one at a time with
+    the C accelerated json decoder, already consumed text is dropped, so only one value has to be in memory at a time.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def _fill(self) -> bool:
+        if self.exhausted:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.exhausted = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Returns the next non whitespace character (without consuming it) or "" at the end of the document.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' in VO-data but found '{self.peek()}'")
+        self.pos += 1
+
+    def decode(self):
+        """
+        Decodes the next value of the document.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer might continue in the next chunk
+                is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if self.exhausted or not is_number or (end < len(self.buffer) and self.buffer[end] not in "0123456789.eE+-"):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+            self._fill()
+
+    def items(self):
+        """
+        Iterates over the keys of the object that starts at the current position. The value of every key has to be
+        consumed (e.g. with decode) before the next key is requested.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def iter_results(chunks):
+    """
+    Streams the entries of "search-results" -> "result" from an Opencast search response.
+    :param chunks:  Iterable of text chunks the JSON document consists of
+    :return:        Iterator over the result entries (as dicts)
+    """
+    stream = _JsonStream(chunks)
+    for key in stream.items():
+        if key != "search-results":
+            stream.decode()
+            continue
+
+        for inner_key in stream.items():
+            if inner_key != "result":
+                stream.decode()
+                continue
+
+            if stream.peek() != "[":
+                # Opencast returns a single object instead of a list if there is only one result
+                yield stream.decode()
+                continue
+
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.pos += 1
+                continue
+            while True:
+                yield stream.decode()
+                if stream.peek() == ",":
+                    stream.pos += 1
+                    continue
+                stream.expect("]")
+                break
+
+
+def _file_chunks(path):
+    with open(path, "r", encoding="UTF-8") as f:
+        while chunk := f.read(READ_SIZE):
+            yield chunk
+
+
+def _response_chunks(response):
+    decoder = codecs.getincrementaldecoder(response.encoding or "UTF-8")()
+    with response:
+        for chunk in response.iter_content(chunk_size=READ_SIZE):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+
+
+def iter_vo_results(path=None, link=None, session: requests.Session = None):
+    """
+    Streams the raw VO entries from the given file or link. When file is given link is ignored.
     :param path:    Path to the file containing the VO-Data (is mutually exclusive with link)
     :param link:    Link to the file containing the VO-Data (is mutually exclusive with path)
+    :param session: Session the link is fetched with (e.g. to share its connection pool, None for a single request)
+    :return:        Iterator over the raw entries or None if neither could be opened
     """
     if path is not None:
         logger.info("Trying to load VO-Data from file: %s", path)
-        if not os.path.isfile(path):
-            logger.error("VO-data file is not a file or doesn't exist: %s", path)
-        try:
-            with open(path, "r", encoding="UTF-8") as f:
-                vo_data = json.load(f)
-                return vo_data["search-results"]["result"]
-        except Exception as e:
-            logger.error("Could not load VO-data from file: %s", path)
+        if os.path.isfile(path):
+            return iter_results(_file_chunks(path))
+        logger.error("VO-data file is not a file or doesn't exist: %s", path)
 
     if link is not None:
         logger.info("Trying to load VO-data from link: %s", link)
         try:
-            response = requests.get(link, timeout=5)
-            vo_data = response.json()
-            return vo_data["search-results"]["result"]
+            # Only covers the request until the headers arrived, the body is read while the results are parsed
+            with tracer.span("feed_fetch", link=link):
+                response = (session or requests).get(link, timeout=5, stream=True)
+                response.raise_for_status()
+            return iter_results(_response_chunks(response))
         except Exception as e:
             logger.error("Could not load VO-data from link: %s", link)
 
+    return None
+
+
+def get_all_vo_data(path=None, link=None):
+    """
+    Loads the VO-Data from the given file or link. When file is given link is ignored.
+    :param path:    Path to the file containing the VO-Data (is mutually exclusive with link)
+    :param link:    Link to the file containing the VO-Data (is mutually exclusive with path)
+    """
+    results = iter_vo_results(path, link)
+    if results is not None:
+        try:
+            return list(results)
+        except Exception as e:
+            logger.error("Could not load VO-data: %s", e)
+
     logger.info("Could not load VO-data from file or link. Returning None.")
     return None
 
 
+def parse_vo_tu(vo) -> VoData:
+    """
+    Parses a single VO entry from TU Wien.
+    :param vo:      The raw VO entry
+    :return:        The VoData object
+    """
+    vo_mp4_link = None
+    if isinstance(vo["mediapackage"]["media"]["track"], list):
+        mp4_tracks = [track for track in vo["mediapackage"]["media"]["track"] if track["mimetype"].startswith("video/mp4")]
+        mp4_track_high_res = max(mp4_tracks, key=lambda x: int(x["video"]["resolution"].split("x", 1)[0]))
+        vo_mp4_link = mp4_track_high_res["url"]
+    else:
+        vo_mp4_link = vo["mediapackage"]["media"]["track"]["url"]
+
+    vo_mp3_link = None
+    if isinstance(vo["mediapackage"]["media"]["track"], list):
+        mp3_tracks = [track for track in vo["mediapackage"]["media"]["track"] if track["mimetype"].startswith("audio/mpeg")]
+        if len(mp3_tracks) > 0:
+            mp3_track_high_res = max(mp3_tracks, key=lambda x: int(x["audio"]["bitrate"]))
+            vo_mp3_link = mp3_track_high_res["url"]
+
+    contributors = "-"
+    if isinstance(vo["mediapackage"]["creators"]["creator"], list):
+        contributors = ", ".join(vo["mediapackage"]["creators"]["creator"])
+
+    return VoData(
+        vo_mp4_link=vo_mp4_link,
+        vo_mp3_link=vo_mp3_link,
+        vo_id=vo.get("id"),
+        vo_title=vo["mediapackage"]["title"],
+        author=vo["dcCreator"],
+        contributors=contributors,
+        series_title=vo["mediapackage"]["seriestitle"],
+        duration=timedelta(milliseconds=int(vo["mediapackage"]["duration"])),
+        recorded_on=datetime.strptime(vo["dcCreated"], "%Y-%m-%dT%H:%M:%S%z")
+    )
+
+
+def parse_vo_uni_wien(vo) -> VoData:
+    """
+    Parses a single VO entry from Uni Wien.
+    :param vo:      The raw VO entry
+    :return:        The VoData object
+    """
+    mp4_tracks = [track for track in vo["mediapackage"]["media"]["track"] if track["mimetype"].startswith("video/mp4")]
+    mp4_track_high_res = max(mp4_tracks, key=lambda x: int(x["tags"]["tag"][0][:9]))
+    return VoData(
+        vo_mp4_link=mp4_track_high_res["url"],
+        vo_id=vo.get("id"),
+        vo_title=vo["mediapackage"]["title"],
+        author=vo["mediapackage"]["creators"]["creator"],
+        contributors=vo["mediapackage"]["contributors"]["contributor"],
+        series_title=vo["mediapackage"]["seriestitle"],
+        duration=timedelta(milliseconds=int(vo["mediapackage"]["duration"])),
+        recorded_on=datetime.strptime(vo["dcCreated"], "%Y-%m-%dT%H:%M:%S%z")
+    )
+
+
+PARSERS = {
+    "tu": parse_vo_tu,
+    "uw": parse_vo_uni_wien,
+}
+
+
 def parse_vo_data_tu(data) -> list[VoData]:
     """
     Parses the VO-Data from TU Wien.
     :param data:    The VO-Data to parse
     :return:        A list of VoData objects
     """
-    erg = []
-
-    for vo in data:
-        print()
-        print()
-        print(vo["mediapackage"]["title"])
-        vo_mp4_link = None
-        if isinstance(vo["mediapackage"]["media"]["track"], list):
-            mp4_tracks = [track for track in vo["mediapackage"]["media"]["track"] if track["mimetype"].startswith("video/mp4")]
-            mp4_track_high_res = max(mp4_tracks, key=lambda x: int(x["video"]["resolution"].split("x", 1)[0]))
-            vo_mp4_link = mp4_track_high_res["url"]
-        else:
-            vo_mp4_link = vo["mediapackage"]["media"]["track"]["url"]
-
-        vo_mp3_link = None
-        if isinstance(vo["mediapackage"]["media"]["track"], list):
-            mp3_tracks = [track for track in vo["mediapackage"]["media"]["track"] if track["mimetype"].startswith("audio/mpeg")]
-            if len(mp3_tracks) > 0:
-                mp3_track_high_res = max(mp3_tracks, key=lambda x: int(x["audio"]["bitrate"]))
-                vo_mp3_link = mp3_track_high_res["url"]
-        
-        contributors = "-"
-        if isinstance(vo["mediapackage"]["creators"]["creator"], list):
-            contributors = ", ".join(vo["mediapackage"]["creators"]["creator"])
-
-        erg.append(VoData(
-            vo_mp4_link=vo_mp4_link,
-            vo_mp3_link=vo_mp3_link,
-            vo_title=vo["mediapackage"]["title"],
-            author=vo["dcCreator"],
-            contributors=contributors,
-            series_title=vo["mediapackage"]["seriestitle"],
-            duration=timedelta(milliseconds=int(vo["mediapackage"]["duration"])),
-            recorded_on=datetime.strptime(vo["dcCreated"], "%Y-%m-%dT%H:%M:%S%z")
-        ))
-
-    return erg
+    return [parse_vo_tu(vo) for vo in data]
+
 
 def parse_vo_data_uni_wien(data) -> list[VoData]:
     """
@@ -91,19 +268,39 @@ def parse_vo_data_uni_wien(data) -> list[VoData]:
     :param data:    The VO-Data to parse
     :return:        A list of VoData objects
     """
-    erg = []
+    return [parse_vo_uni_wien(vo) for vo in data]
 
-    for vo in data:
-        mp4_tracks = [track for track in vo["mediapackage"]["media"]["track"] if track["mimetype"].startswith("video/mp4")]
-        mp4_track_high_res = max(mp4_tracks, key=lambda x: int(x["tags"]["tag"][0][:9]))
-        erg.append(VoData(
-            vo_mp4_link=mp4_track_high_res["url"],
-            vo_title=vo["mediapackage"]["title"],
-            author=vo["mediapackage"]["creators"]["creator"],
-            contributors=vo["mediapackage"]["contributors"]["contributor"],
-            series_title=vo["mediapackage"]["seriestitle"],
-            duration=timedelta(milliseconds=int(vo["mediapackage"]["duration"])),
-            recorded_on=datetime.strptime(vo["dcCreated"], "%Y-%m-%dT%H:%M:%S%z")
-        ))
-
-    return erg
\ No newline at end of file
+
+def iter_vo_data(results, uni: str, titles=None, series=None):
+    """
+    Lazily parses the raw VO entries. Entries are filtered by title and series before they are parsed, so that only the
+    selected VOs are turned into VoData objects.
+    :param results:     Iterable of raw VO entries (e.g. from iter_vo_results)
+    :param uni:         Which parser to use ("uw" or "tu")
+    :param titles:      Only VOs with one of these titles are parsed (None for all)
+    :param series:      Only VOs of one of these series are parsed (None for all)
+    :return:            Iterator over the VoData objects
+    """
+    parse = PARSERS[uni]
+    titles = set(titles) if titles is not None else None
+    series = set(series) if series is not None else None
+
+    for vo in results:
+        mediapackage = vo.get("mediapackage", {})
+        if titles is not None and mediapackage.get("title") not in titles:
+            continue
+        if series is not None and mediapackage.get("seriestitle") not in series:
+            continue
+
+        try:
+            yield parse(vo)
+        except Exception as e:
+            logger.error("Could not parse VO '%s': %s", mediapackage.get("title"), e)
+
+
+def iter_vo_titles(results):
+    """
+    Returns the titles of the raw VO entries without parsing them.
+    """
+    for vo in results:
+        yield vo.get("mediapackage", {}).get("title")